@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'wavewhiz_app.metricas.MetricasMiddleware',
+    'wavewhiz_app.roteamento.ReplicaMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -57,6 +60,13 @@ MIDDLEWARE = [
 
 CORS_ALLOW_ALL_ORIGINS = True
 
+# instrumentação por requisição exposta em /metrics (formato Prometheus)
+METRICAS_ATIVAS = True
+# requisições que repetem a mesma consulta mais vezes que isso são marcadas como N+1
+METRICAS_N_MAIS_UM_LIMIAR = 10
+# se definido, /metrics exige 'Authorization: Bearer <token>'
+METRICAS_TOKEN = os.environ.get('WAVEWHIZ_METRICAS_TOKEN')
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -87,6 +97,52 @@ DATABASES = {
     }
 }
 
+# Modo de produção do SQLite (WAVEWHIZ_SQLITE_PRODUCAO=1): WAL (leitores não
+# bloqueiam o escritor), pragmas aplicados a cada conexão nova, transações com
+# BEGIN IMMEDIATE (a trava de escrita é pedida no início e esperada pelo
+# busy_timeout, em vez de falhar com "database is locked" ao promover uma
+# leitura) e conexões persistentes.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # KiB
+    'temp_store': 'MEMORY',
+}
+SQLITE_OPCOES_PRODUCAO = {
+    'init_command': ';'.join(f'PRAGMA {nome}={valor}' for nome, valor in SQLITE_PRAGMAS.items()),
+    'transaction_mode': 'IMMEDIATE',
+}
+if os.environ.get('WAVEWHIZ_SQLITE_PRODUCAO') == '1':
+    DATABASES['default'].update(
+        OPTIONS=SQLITE_OPCOES_PRODUCAO,
+        CONN_MAX_AGE=int(os.environ.get('WAVEWHIZ_CONN_MAX_AGE', 600)),
+        CONN_HEALTH_CHECKS=True,
+    )
+
+# Réplicas de leitura (aliases de DATABASES) para list/retrieve do catálogo,
+# ver wavewhiz_app/roteamento.py. Localmente, WAVEWHIZ_REPLICA_SQLITE aponta
+# para uma cópia do banco mantida por `manage.py sincronizar_replica`.
+DATABASE_ROUTERS = ['wavewhiz_app.roteamento.RoteadorReplicas']
+DATABASE_REPLICAS = []
+if os.environ.get('WAVEWHIZ_REPLICA_SQLITE'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        # somente leitura; a cópia é trocada inteira a cada sincronização
+        'NAME': f"file:{os.environ['WAVEWHIZ_REPLICA_SQLITE']}?mode=ro",
+        'OPTIONS': {},
+        # sincronizar_replica troca o arquivo (os.replace): uma conexão
+        # persistente continuaria lendo a cópia antiga; cada requisição reabre
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': False,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append('replica')
+# segundos em que um cliente que acabou de escrever continua lendo do primário
+# (deve cobrir o atraso da réplica)
+REPLICA_JANELA_PRIMARIO = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -106,10 +162,44 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Hasher usado para senhas novas: 'scrypt' (padrão), 'argon2' (requer argon2-cffi)
+# ou 'pbkdf2_sha256', com os custos padrão do Django. Senhas em outro algoritmo
+# ou com outros custos são refeitas de forma transparente no próximo login.
+PASSWORD_HASHER = os.environ.get('WAVEWHIZ_PASSWORD_HASHER', 'scrypt')
+
+_PASSWORD_HASHERS = {
+    'scrypt': 'django.contrib.auth.hashers.ScryptPasswordHasher',
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'pbkdf2_sha256': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for algoritmo, hasher in _PASSWORD_HASHERS.items() if algoritmo != PASSWORD_HASHER
+]
+
+# threads dedicadas ao login (o hash de senha libera o GIL)
+LOGIN_THREADS = os.cpu_count() or 4
+# processos que calculam os hashes do cadastro em lote (0: na própria thread)
+CADASTRO_PROCESSOS = os.cpu_count() or 4
+
+# JSON das respostas e requisições: 'orjson' (mais rápido, se instalado; mesma
+# saída do JSONRenderer do DRF) ou 'json' (biblioteca padrão)
+JSON_BACKEND = os.environ.get('WAVEWHIZ_JSON_BACKEND', 'orjson')
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'wavewhiz_app.authentication.CachedJWTAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'wavewhiz_app.renderers.JSONRapidoRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'wavewhiz_app.parsers.JSONRapidoParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'wavewhiz_app.pagination.PaginacaoPorCursor',
+    'PAGE_SIZE': 20,
 }
 
 from rest_framework_simplejwt.settings import api_settings as jwt_api_settings
@@ -121,6 +211,51 @@ SIMPLE_JWT = {
     'USERNAME_FIELD': 'email',
 }
 
+# Cache usado, entre outros, pelo snapshot do usuário autenticado via JWT.
+# Em produção com vários processos, aponte para um cache compartilhado (ex.: Redis).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # respostas de /produtos/ e /lojas/ e seus contadores de versão (CACHE_RESPOSTAS)
+    'respostas': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'respostas',
+    },
+    # estado dos carrinhos abertos (CARRINHOS_KV): as chaves com alterações
+    # pendentes não podem ser expulsas, então o limite de entradas é alto
+    'carrinhos': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'carrinhos',
+        'OPTIONS': {'MAX_ENTRIES': 1_000_000},
+    },
+}
+
+# segundos que o snapshot do usuário (id, role, is_staff, is_superuser) fica em cache
+JWT_USUARIO_CACHE_TTL = 300
+
+# Cache de respostas de /produtos/ e /lojas/ (wavewhiz_app/cache_respostas.py):
+# alias de CACHES, ou vazio para desligar. Os signals invalidam incrementando
+# versões guardadas nele, então precisa ser compartilhado entre os processos
+# (ex.: Redis); fora do DEBUG um LocMemCache é recusado (check wavewhiz_app.E001).
+CACHE_RESPOSTAS = os.environ.get('WAVEWHIZ_CACHE_RESPOSTAS', 'respostas')
+# segundos que respostas de /produtos/ e /lojas/ ficam em cache (invalidadas por signals)
+CACHE_RESPOSTAS_TTL = 600
+
+# Itens dos carrinhos abertos num armazenamento chave-valor, gravados no banco
+# em lote (wavewhiz_app/estado_carrinhos.py): alias de CACHES, ou vazio para
+# gravar cada alteração direto no banco. Com vários processos use um cache
+# compartilhado (ex.: Redis) que não expulse chaves.
+CARRINHOS_KV = os.environ.get('WAVEWHIZ_CARRINHOS_KV', '')
+CARRINHOS_KV_INTERVALO = 2  # segundos entre as gravações em lote (0: só nas leituras e no checkout)
+CARRINHOS_KV_LOTE = 500  # carrinhos por transação
+CARRINHOS_KV_BALDES = 64  # conjuntos de carrinhos pendentes, cada um com sua trava (fora do Redis)
+CARRINHOS_KV_TTL = 3600  # segundos que um carrinho já gravado continua no armazenamento
+# travas por carrinho: expiram em TRAVA_TTL segundos (deve cobrir a gravação de um
+# lote e um checkout); quem espera uma trava desiste (503) após TRAVA_ESPERA segundos
+CARRINHOS_KV_TRAVA_TTL = 60
+CARRINHOS_KV_TRAVA_ESPERA = 5
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -141,6 +276,25 @@ STATIC_URL = 'static/'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# uploads gravados uma vez por conteúdo (media/blobs/ab/<sha256>.<ext>)
+STORAGES = {
+    'default': {'BACKEND': 'wavewhiz_app.storage.ArmazenamentoPorConteudo'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# segundos em que um blob recém-gravado ou reaproveitado não é apagado (cobre a
+# transação que grava a linha que aponta para ele)
+MIDIA_BLOB_CARENCIA = 600
+# serve MEDIA_URL pelo Django (com Cache-Control imutável para arquivos com hash no nome);
+# em produção prefira o servidor web/CDN com os mesmos cabeçalhos
+SERVIR_MIDIA = DEBUG
+MIDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+
+# variantes de Loja.imagem e Produto.imagem (maior lado em px), geradas em
+# media/derivados/ por um pool de threads
+IMAGENS_VARIANTES = {'thumb': 160, 'card': 480, 'full': 1280}
+IMAGENS_FORMATO = os.environ.get('WAVEWHIZ_IMAGENS_FORMATO', 'webp')  # 'webp' ou 'jpeg'
+IMAGENS_WORKERS = 2  # 0 gera na própria thread
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -9,6 +9,9 @@ class EmailBackend(ModelBackend):
         try:
             user = Usuario.objects.get(email=email)
         except Usuario.DoesNotExist:
+            # calcula um hash mesmo assim, como o ModelBackend: o tempo de
+            # resposta não revela quais emails estão cadastrados
+            Usuario().set_password(password)
             return None
         if user.check_password(password) and self.user_can_authenticate(user):
             return user
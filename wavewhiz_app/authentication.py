@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import Usuario
+
+# campos guardados no cache: o suficiente para as checagens de permissão e
+# filtros das views (cliente=user, is_staff); os demais são carregados sob demanda
+CAMPOS_SNAPSHOT = ('id', 'role', 'is_staff', 'is_superuser')
+
+
+def chave_usuario(user_id):
+    return f'jwt-usuario:{user_id}'
+
+
+def invalidar_usuario(user_id):
+    cache.delete(chave_usuario(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # igual ao JWTAuthentication, mas guarda um snapshot compacto do usuário
+    # em cache para não consultar o Usuario em toda requisição autenticada
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # a revogação depende do hash da senha, que não fica no cache
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token sem identificação de usuário reconhecível')
+
+        chave = chave_usuario(user_id)
+        snapshot = cache.get(chave)
+        if snapshot is None:
+            snapshot = (
+                Usuario.objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+                .values(*CAMPOS_SNAPSHOT)
+                .first()
+            )
+            if snapshot is None:
+                raise AuthenticationFailed('Usuário não encontrado', code='user_not_found')
+            cache.set(chave, snapshot, getattr(settings, 'JWT_USUARIO_CACHE_TTL', 300))
+
+        # instância parcial: campos fora do snapshot ficam adiados (deferred) e
+        # são buscados no banco apenas se alguém acessá-los
+        campos = [f.attname for f in Usuario._meta.concrete_fields if f.attname in snapshot]
+        return Usuario.from_db(Usuario.objects.db, campos, [snapshot[c] for c in campos])
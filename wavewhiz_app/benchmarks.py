@@ -0,0 +1,150 @@
+import os
+import random
+import tempfile
+from array import array
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import connections
+from django.db.models import Max
+
+
+@contextmanager
+def banco_temporario(alias='default'):
+    # os benchmarks rodam num banco descartável (criado com as migrations, como
+    # nos testes), nunca no banco configurado; no SQLite usa um arquivo em vez
+    # do banco em memória, para que várias threads/conexões funcionem como em produção
+    conexao = connections[alias]
+    with tempfile.TemporaryDirectory() as pasta:
+        if conexao.vendor == 'sqlite':
+            conexao.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(pasta, 'benchmark.sqlite3')
+        nome_original = conexao.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield conexao
+        finally:
+            conexao.creation.destroy_test_db(nome_original, verbosity=0)
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    posicao = min(len(ordenados) - 1, max(0, round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[posicao]
+
+
+SENHA_SINTETICA = 'senha-de-benchmark'
+LOTE = 5000
+
+
+def proporcoes(escala):
+    # quantidades por model a partir do nº de produtos
+    return {
+        'categorias': min(50, max(5, escala // 1000)),
+        'usuarios': max(10, escala // 10),
+        'lojas': max(2, escala // 100),
+        'produtos': escala,
+        'carrinhos': max(10, escala // 10),
+        'itens_por_carrinho': 3,
+    }
+
+
+def _em_lotes(objetos, model, tamanho=LOTE):
+    # bulk_create em lotes a partir de um gerador; devolve os pks criados
+    # num array compacto (milhões de ids sem milhões de objetos em memória)
+    pks = array('q')
+    lote = []
+    for objeto in objetos:
+        lote.append(objeto)
+        if len(lote) >= tamanho:
+            pks.extend(o.pk for o in model.objects.bulk_create(lote))
+            lote = []
+    if lote:
+        pks.extend(o.pk for o in model.objects.bulk_create(lote))
+    return pks
+
+
+def gerar_dados(quantidades, semente=0, progresso=None):
+    # preenche o banco atual com dados sintéticos (bulk_create, sem signals) e
+    # reconstrói os índices de busca; devolve o usuário admin, cuja senha é
+    # SENHA_SINTETICA, e os pks gerados
+    from . import busca, cache_respostas, indice_categorias
+    from .models import Carrinho, CategoriaLoja, ItemCarrinho, Loja, Produto, Usuario
+
+    aleatorio = random.Random(semente)
+    progresso = progresso or (lambda mensagem: None)
+    inicio = (Usuario.objects.aggregate(maior=Max('pk'))['maior'] or 0) + 1
+    senha = make_password(SENHA_SINTETICA)
+
+    admin = Usuario.objects.create_superuser(f'admin{inicio}@sintetico.local', password=SENHA_SINTETICA, cpf=f'9{inicio:010d}')
+    categorias = _em_lotes(
+        (CategoriaLoja(nome=f'Categoria {inicio}-{n}') for n in range(quantidades['categorias'])), CategoriaLoja
+    )
+
+    def usuarios(quantidade, role, deslocamento):
+        for n in range(quantidade):
+            numero = inicio + deslocamento + n + 1
+            yield Usuario(
+                nome=f'{role.title()} {numero}', email=f'{role}{numero}@sintetico.local', cpf=f'9{numero:010d}',
+                telefone='11999990000', data_nascimento=date(1990, 1, 1), role=role, password=senha,
+            )
+
+    empreendedores = _em_lotes(usuarios(quantidades['lojas'], 'empreendedor', 0), Usuario)
+    clientes = _em_lotes(usuarios(quantidades['usuarios'], 'cliente', quantidades['lojas']), Usuario)
+    progresso(f'usuários: {len(empreendedores) + len(clientes) + 1}')
+
+    lojas = _em_lotes(
+        (Loja(empreendedor_id=pk, nome=f'Loja {pk}', descricao=f'Loja sintética {pk}') for pk in empreendedores), Loja
+    )
+    Relacao = Loja.categorias.through
+    _em_lotes(
+        (
+            Relacao(loja_id=loja, categorialoja_id=categoria)
+            for loja in lojas
+            for categoria in aleatorio.sample(list(categorias), min(2, len(categorias)))
+        ),
+        Relacao,
+    )
+    # bulk_create na tabela M2M não dispara m2m_changed
+    indice_categorias.invalidar()
+    progresso(f'lojas: {len(lojas)}')
+
+    palavras = ('bolo', 'camiseta', 'caneca', 'livro', 'sabonete', 'vela', 'quadro', 'boné', 'brinco', 'café')
+    produtos = _em_lotes(
+        (
+            Produto(
+                loja_id=lojas[n % len(lojas)], nome=f'{aleatorio.choice(palavras).title()} {n}',
+                descricao=f'{aleatorio.choice(palavras)} artesanal', preco=Decimal(aleatorio.randint(100, 50000)) / 100,
+                estoque=aleatorio.randint(0, 500),
+            )
+            for n in range(quantidades['produtos'])
+        ),
+        Produto,
+    )
+    for posicao in range(0, len(lojas), LOTE):
+        Loja.recalcular_resumo(lojas[posicao:posicao + LOTE])
+    progresso(f'produtos: {len(produtos)}')
+
+    carrinhos = _em_lotes(
+        (Carrinho(cliente_id=clientes[n % len(clientes)]) for n in range(quantidades['carrinhos'])), Carrinho
+    )
+    por_carrinho = min(quantidades['itens_por_carrinho'], len(produtos))
+    itens = _em_lotes(
+        (
+            ItemCarrinho(carrinho_id=carrinho, produto_id=produtos[posicao], quantidade=aleatorio.randint(1, 5))
+            for carrinho in carrinhos
+            for posicao in aleatorio.sample(range(len(produtos)), por_carrinho)
+        ),
+        ItemCarrinho,
+    )
+    progresso(f'carrinhos: {len(carrinhos)}, itens: {len(itens)}')
+
+    indice = busca.backend()
+    for model in (Produto, Loja):
+        indice.reconstruir(model)
+    for namespace in ('produtos', 'lojas'):
+        cache_respostas.invalidar_tudo(namespace)
+    progresso('índices de busca reconstruídos')
+    return admin, {'lojas': lojas, 'produtos': produtos, 'carrinhos': carrinhos, 'categorias': categorias}
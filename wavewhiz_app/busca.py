@@ -0,0 +1,187 @@
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+# campos indexados de cada model pesquisável (mesma ordem nos backends);
+# o primeiro campo pesa mais no ranking
+CAMPOS_BUSCA = ('nome', 'descricao')
+PESOS = (2.0, 1.0)
+
+
+def remover_acentos(texto):
+    return ''.join(
+        ch for ch in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(ch)
+    )
+
+
+def termos(texto):
+    return re.findall(r'\w+', remover_acentos(texto).lower())
+
+
+class BackendBusca:
+    # interface dos índices de busca; os métodos recebem a classe do model
+    # (também funcionam com os models históricos das migrations)
+    def __init__(self, conexao):
+        self.conexao = conexao
+
+    def criar_indice(self, model):
+        raise NotImplementedError
+
+    def remover_indice(self, model):
+        raise NotImplementedError
+
+    def indexar(self, model, objetos):
+        raise NotImplementedError
+
+    def remover(self, model, pks):
+        raise NotImplementedError
+
+    def buscar(self, model, texto, limite, filtro=None):
+        # retorna os pks ordenados por relevância; filtro (queryset do model)
+        # restringe a busca aos objetos dele antes do limite
+        raise NotImplementedError
+
+    def reconstruir(self, model):
+        self.remover_indice(model)
+        self.criar_indice(model)
+        self.indexar(model, model._default_manager.only('pk', *CAMPOS_BUSCA).iterator(chunk_size=2000))
+
+
+class SQLiteFTS5Backend(BackendBusca):
+    # índice invertido FTS5 com tokenizer que ignora acentos; o rowid da
+    # tabela virtual é o pk do objeto
+    def tabela(self, model):
+        return self.conexao.ops.quote_name(f'{model._meta.db_table}_busca')
+
+    def criar_indice(self, model):
+        with self.conexao.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.tabela(model)} '
+                f"USING fts5({', '.join(CAMPOS_BUSCA)}, tokenize='unicode61 remove_diacritics 2')"
+            )
+
+    def remover_indice(self, model):
+        with self.conexao.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self.tabela(model)}')
+
+    def indexar(self, model, objetos):
+        tabela = self.tabela(model)
+        colunas = ', '.join(CAMPOS_BUSCA)
+        marcadores = ', '.join(['%s'] * (len(CAMPOS_BUSCA) + 1))
+        lote = []
+        # uma transação para tudo: em autocommit cada linha seria um commit
+        with transaction.atomic(using=self.conexao.alias), self.conexao.cursor() as cursor:
+            for objeto in objetos:
+                lote.append((objeto.pk, *(getattr(objeto, campo) or '' for campo in CAMPOS_BUSCA)))
+                if len(lote) >= 500:
+                    self._gravar(cursor, tabela, colunas, marcadores, lote)
+                    lote = []
+            if lote:
+                self._gravar(cursor, tabela, colunas, marcadores, lote)
+
+    def _gravar(self, cursor, tabela, colunas, marcadores, lote):
+        cursor.executemany(f'DELETE FROM {tabela} WHERE rowid = %s', [(linha[0],) for linha in lote])
+        cursor.executemany(f'INSERT INTO {tabela} (rowid, {colunas}) VALUES ({marcadores})', lote)
+
+    def remover(self, model, pks):
+        with self.conexao.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.tabela(model)} WHERE rowid = %s', [(pk,) for pk in pks])
+
+    def buscar(self, model, texto, limite, filtro=None):
+        consulta = ' '.join(f'"{termo}"*' for termo in termos(texto))
+        if not consulta:
+            return []
+        tabela = self.tabela(model)
+        pesos = ', '.join(str(peso) for peso in PESOS)
+        restricao, parametros = '', []
+        if filtro is not None:
+            # os pks do filtro entram como subconsulta, no mesmo SELECT
+            sql, parametros = filtro.order_by().values('pk').query.get_compiler(connection=self.conexao).as_sql()
+            restricao = f' AND rowid IN ({sql})'
+        with self.conexao.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {tabela} WHERE {tabela} MATCH %s{restricao} '
+                f'ORDER BY bm25({tabela}, {pesos}) LIMIT %s',
+                [consulta, *parametros, limite],
+            )
+            return [linha[0] for linha in cursor.fetchall()]
+
+
+class PostgresBackend(BackendBusca):
+    # índice GIN sobre a expressão tsvector das próprias colunas (config
+    # 'portuguese' + unaccent), mantido pelo Postgres: não há tabela auxiliar
+    # para sincronizar. A busca usa a mesma expressão, para o planner usar o
+    # índice. unaccent() não é IMMUTABLE e não entra em índice; o wrapper é.
+    FUNCAO_UNACCENT = 'wavewhiz_unaccent'
+
+    def indice(self, model):
+        return self.conexao.ops.quote_name(f'{model._meta.db_table}_busca_idx')
+
+    def vetor(self, model, tabela=''):
+        # tabela qualifica as colunas na busca (o filtro pode ter joins com
+        # outra coluna "nome"); o índice continua casando com a expressão
+        quote = self.conexao.ops.quote_name
+        prefixo = f'{quote(tabela)}.' if tabela else ''
+        partes = [
+            f"setweight(to_tsvector('portuguese', {self.FUNCAO_UNACCENT}(coalesce("
+            f"{prefixo}{quote(model._meta.get_field(campo).column)}, ''))), '{peso}')"
+            for campo, peso in zip(CAMPOS_BUSCA, 'AB')
+        ]
+        return ' || '.join(partes)
+
+    def criar_indice(self, model):
+        with self.conexao.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS unaccent')
+            cursor.execute(
+                f'CREATE OR REPLACE FUNCTION {self.FUNCAO_UNACCENT}(text) RETURNS text '
+                "AS $$ SELECT public.unaccent('public.unaccent', $1) $$ "
+                'LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {self.indice(model)} '
+                f'ON {self.conexao.ops.quote_name(model._meta.db_table)} USING GIN (({self.vetor(model)}))'
+            )
+
+    def remover_indice(self, model):
+        with self.conexao.cursor() as cursor:
+            cursor.execute(f'DROP INDEX IF EXISTS {self.indice(model)}')
+
+    def indexar(self, model, objetos):
+        pass
+
+    def remover(self, model, pks):
+        pass
+
+    def buscar(self, model, texto, limite, filtro=None):
+        from django.db.models import BooleanField, FloatField
+        from django.db.models.expressions import RawSQL
+
+        consulta = ' '.join(termos(texto))
+        if not consulta:
+            return []
+        vetor = self.vetor(model, model._meta.db_table)
+        query = "plainto_tsquery('portuguese', %s)"
+        queryset = model._default_manager.all() if filtro is None else filtro.order_by()
+        return list(
+            queryset.filter(RawSQL(f'({vetor}) @@ {query}', [consulta], output_field=BooleanField()))
+            .annotate(rank=RawSQL(f'ts_rank(({vetor}), {query})', [consulta], output_field=FloatField()))
+            .order_by('-rank', 'pk')
+            .values_list('pk', flat=True)[:limite]
+        )
+
+
+BACKENDS_POR_VENDOR = {
+    'sqlite': 'wavewhiz_app.busca.SQLiteFTS5Backend',
+    'postgresql': 'wavewhiz_app.busca.PostgresBackend',
+}
+
+
+def backend(conexao=None):
+    conexao = conexao or connection
+    caminho = getattr(settings, 'BUSCA_BACKEND', None) or BACKENDS_POR_VENDOR.get(conexao.vendor)
+    if caminho is None:
+        raise NotImplementedError(f'Busca textual não suportada para o banco {conexao.vendor!r}.')
+    return import_string(caminho)(conexao)
@@ -0,0 +1,151 @@
+import hashlib
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .renderers import JSONRapidoRenderer
+from .roteamento import lendo_da_replica
+
+# contadores do cache de respostas (expostos por estatisticas())
+_estatisticas = {'hits': 0, 'misses': 0, 'segundos_hits': 0.0, 'segundos_misses': 0.0}
+_lock = threading.Lock()
+
+
+def estatisticas():
+    with _lock:
+        dados = dict(_estatisticas)
+    total = dados['hits'] + dados['misses']
+    dados['taxa_de_acerto'] = dados['hits'] / total if total else 0.0
+    return dados
+
+
+def _registrar(resultado, segundos):
+    with _lock:
+        _estatisticas[resultado] += 1
+        _estatisticas[f'segundos_{resultado}'] += segundos
+
+
+# Respostas e contadores de versão ficam no alias CACHE_RESPOSTAS, que deve
+# ser compartilhado entre os processos (ver checks.py): a invalidação feita
+# pelo processo que recebeu a escrita vale para todos.
+def ativo():
+    return bool(settings.CACHE_RESPOSTAS)
+
+
+def _cache():
+    return caches[settings.CACHE_RESPOSTAS]
+
+
+def _versao(chave):
+    return _cache().get(chave, 0)
+
+
+def _incrementar(chave):
+    try:
+        _cache().incr(chave)
+    except ValueError:
+        _cache().set(chave, 1, None)
+
+
+# Cada namespace (ex.: 'produtos') tem três contadores de versão que entram nas
+# chaves: 'geral' (tudo), 'lista' (páginas de listagem) e um por objeto
+# (retrieve). Invalidar é só incrementar a versão certa; as entradas antigas
+# deixam de ser lidas e expiram pelo TTL.
+def invalidar(namespace, *pks):
+    if not ativo():
+        return
+    _incrementar(f'resposta:{namespace}:lista')
+    for pk in pks:
+        if pk is not None:
+            _incrementar(f'resposta:{namespace}:objeto:{pk}')
+    _marcar_alteracao(namespace)
+
+
+def invalidar_tudo(namespace):
+    if not ativo():
+        return
+    _incrementar(f'resposta:{namespace}:geral')
+    _incrementar(f'resposta:{namespace}:lista')
+    _marcar_alteracao(namespace)
+
+
+def _marcar_alteracao(namespace):
+    _cache().set(f'resposta:{namespace}:alterado_em', time.time(), None)
+
+
+def _replica_pode_estar_atrasada(namespace):
+    # logo após uma alteração, uma resposta lida da réplica pode não refleti-la
+    # e não deve ficar no cache até a próxima invalidação
+    if not lendo_da_replica():
+        return False
+    janela = getattr(settings, 'REPLICA_JANELA_PRIMARIO', 0)
+    return time.time() - _cache().get(f'resposta:{namespace}:alterado_em', 0) < janela
+
+
+class RespostaEmCacheMixin:
+    # cache read-through para list/retrieve públicos, com ETag/Last-Modified.
+    # A view define cache_namespace e os query params que alteram a resposta.
+    cache_namespace = None
+    cache_query_params = ()
+    # params da paginação por cursor também alteram a página
+    cache_query_params_paginacao = ('cursor', 'page_size')
+    # seleção de campos (ver serializers.CamposDinamicosMixin)
+    cache_query_params_campos = ('fields', 'expand')
+
+    def list(self, request, *args, **kwargs):
+        return self._responder_com_cache(request, None, partial(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self._responder_com_cache(request, pk, partial(super().retrieve, request, *args, **kwargs))
+
+    def chave_cache(self, request, pk):
+        namespace = self.cache_namespace
+        if pk is None:
+            versao = f'l{_versao(f"resposta:{namespace}:lista")}'
+        else:
+            versao = f'o{_versao(f"resposta:{namespace}:objeto:{pk}")}'
+        params = self.cache_query_params + self.cache_query_params_paginacao + self.cache_query_params_campos
+        partes = [request.build_absolute_uri('/')] + [
+            f'{nome}={request.query_params.get(nome, "")}' for nome in params
+        ]
+        resumo = hashlib.md5('&'.join(partes).encode()).hexdigest()
+        geral = _versao(f'resposta:{namespace}:geral')
+        return f'resposta:{namespace}:{self.action}:{pk}:g{geral}:{versao}:{resumo}'
+
+    def _responder_com_cache(self, request, pk, gerar):
+        if not ativo() or 'expand' in request.query_params or '.' in request.query_params.get('fields', ''):
+            # relações expandidas trazem dados de outros namespaces, cujas
+            # alterações não invalidam este
+            return gerar()
+        inicio = time.perf_counter()
+        chave = self.chave_cache(request, pk)
+        entrada = _cache().get(chave)
+        if entrada is None:
+            resposta = gerar()
+            if resposta.status_code != 200:
+                return resposta
+            etag = quote_etag(hashlib.md5(JSONRapidoRenderer().render(resposta.data)).hexdigest())
+            entrada = {'data': resposta.data, 'etag': etag, 'modificado_em': int(time.time())}
+            if not _replica_pode_estar_atrasada(self.cache_namespace):
+                _cache().set(chave, entrada, getattr(settings, 'CACHE_RESPOSTAS_TTL', 600))
+            resultado = 'misses'
+        else:
+            resposta = Response(entrada['data'])
+            resultado = 'hits'
+
+        resposta['ETag'] = entrada['etag']
+        resposta['Last-Modified'] = http_date(entrada['modificado_em'])
+        resposta['X-Cache'] = 'HIT' if resultado == 'hits' else 'MISS'
+        resposta = get_conditional_response(
+            request, etag=entrada['etag'], last_modified=entrada['modificado_em'], response=resposta
+        )
+        _registrar(resultado, time.perf_counter() - inicio)
+        return resposta
+
@@ -0,0 +1,105 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from operator import itemgetter
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import DatabaseError, transaction
+
+from .models import Usuario
+from .serializers import UsuarioLoteSerializer
+
+TAMANHO_LOTE = 1000
+UNICOS = {'cpf': 'CPF já cadastrado.', 'email': 'E-mail já cadastrado.'}
+
+_pool = None
+_pool_processos = None
+_pool_lock = threading.Lock()
+
+
+def _executor(processos):
+    # criado uma vez e reaproveitado; forkserver em vez de fork porque o
+    # processo do servidor tem threads (e locks) que não podem ser copiados.
+    # Os processos novos começam sem o Django configurado: o initializer é o
+    # próprio django.setup, que não depende dos models deste app.
+    global _pool, _pool_processos
+    with _pool_lock:
+        if _pool is None or _pool_processos != processos:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            contexto = multiprocessing.get_context('forkserver')
+            _pool = ProcessPoolExecutor(max_workers=processos, mp_context=contexto, initializer=django.setup)
+            _pool_processos = processos
+        return _pool
+
+
+def hashes(senhas, processos=None):
+    # hash de cada senha (CPU-bound) num pool de processos; sem senha, o
+    # usuário recebe uma senha inutilizável. processos=0 calcula aqui mesmo.
+    if processos is None:
+        processos = getattr(settings, 'CADASTRO_PROCESSOS', 0)
+    informadas = [senha for senha in senhas if senha]
+    if processos and len(informadas) > 1:
+        bloco = max(1, len(informadas) // (processos * 4))
+        calculadas = _executor(processos).map(make_password, informadas, chunksize=bloco)
+    else:
+        calculadas = map(make_password, informadas)
+    calculadas = iter(calculadas)
+    return [next(calculadas) if senha else make_password(None) for senha in senhas]
+
+
+def cadastrar_usuarios(registros, tamanho_lote=TAMANHO_LOTE, processos=None):
+    # registros: (número da linha, dict ou None), como importacao.ler_registros.
+    # Valida e grava em lotes (uma transação por lote); linhas inválidas ou
+    # repetidas entram no relatório sem interromper o resto.
+    relatorio = {'criados': 0, 'erros': []}
+    registros = iter(registros)
+    while lote := list(islice(registros, tamanho_lote)):
+        _cadastrar_lote(lote, relatorio, processos)
+    relatorio['erros'].sort(key=itemgetter('linha'))
+    return relatorio
+
+
+def _cadastrar_lote(lote, relatorio, processos):
+    validos = []
+    for numero, registro in lote:
+        if registro is None:
+            relatorio['erros'].append({'linha': numero, 'erros': {'non_field_errors': ['Linha inválida.']}})
+            continue
+        serializer = UsuarioLoteSerializer(data=registro)
+        if not serializer.is_valid():
+            relatorio['erros'].append({'linha': numero, 'erros': serializer.errors})
+            continue
+        validos.append((numero, serializer.validated_data))
+
+    # unicidade do lote inteiro: uma consulta IN por campo; os valores do
+    # próprio lote entram no conjunto, então a repetição também é recusada
+    usados = {
+        campo: set(Usuario.objects.filter(**{f'{campo}__in': [dados[campo] for _, dados in validos]}).values_list(campo, flat=True))
+        for campo in UNICOS
+    }
+    novos = []
+    for numero, dados in validos:
+        erros = {campo: [mensagem] for campo, mensagem in UNICOS.items() if dados[campo] in usados[campo]}
+        if erros:
+            relatorio['erros'].append({'linha': numero, 'erros': erros})
+            continue
+        for campo in UNICOS:
+            usados[campo].add(dados[campo])
+        novos.append((numero, dados))
+    if not novos:
+        return
+
+    senhas = hashes([dados.pop('password', None) for _, dados in novos], processos)
+    usuarios = [Usuario(password=senha, **dados) for (_, dados), senha in zip(novos, senhas)]
+    try:
+        with transaction.atomic():
+            Usuario.objects.bulk_create(usuarios)
+    except DatabaseError as erro:
+        # ex.: o mesmo CPF cadastrado por outra requisição depois da verificação
+        relatorio['erros'].extend({'linha': numero, 'erros': {'non_field_errors': [str(erro)]}} for numero, _ in novos)
+        return
+    relatorio['criados'] += len(usuarios)
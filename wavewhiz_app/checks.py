@@ -0,0 +1,25 @@
+import sys
+
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+LOCMEM = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+@register(Tags.caches)
+def cache_respostas_compartilhado(app_configs, **kwargs):
+    # com um cache por processo, a invalidação feita por um worker não chega
+    # aos outros, que continuariam servindo respostas antigas até o TTL
+    alias = settings.CACHE_RESPOSTAS
+    if not alias or settings.DEBUG or sys.argv[1:2] == ['test']:
+        return []
+    configuracao = settings.CACHES.get(alias)
+    if configuracao is None:
+        return [Error(f'CACHE_RESPOSTAS aponta para o alias inexistente "{alias}".', id='wavewhiz_app.E002')]
+    if configuracao['BACKEND'] == LOCMEM:
+        return [Error(
+            f'O cache de respostas (CACHES["{alias}"]) é um LocMemCache, local a cada processo.',
+            hint='Use um cache compartilhado (ex.: RedisCache) ou desligue com WAVEWHIZ_CACHE_RESPOSTAS="".',
+            id='wavewhiz_app.E001',
+        )]
+    return []
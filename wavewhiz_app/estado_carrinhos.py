@@ -0,0 +1,362 @@
+import logging
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import close_old_connections, models, transaction
+from django.db.models import Case, Value, When
+from rest_framework.exceptions import APIException
+
+# Estado dos carrinhos abertos num armazenamento chave-valor (o alias
+# CARRINHOS_KV de CACHES: LocMemCache no próprio processo ou um Redis
+# compartilhado). Cada carrinho alterado pela API vira um registro
+# {'itens': {produto_id: [item_id, quantidade]}, 'alterados': {produto_id}}:
+# adicionar, alterar e remover itens só mexem nesse registro, e as quantidades
+# alteradas vão para o banco em lote (write-behind) a cada
+# CARRINHOS_KV_INTERVALO segundos, antes das leituras dos carrinhos e no checkout.
+# A única escrita síncrona é a linha de um produto novo no carrinho, para o
+# item ter id. Os ids dos carrinhos com alterações pendentes ficam no próprio
+# armazenamento, visíveis a qualquer processo: num set do Redis (SADD/SREM)
+# ou, nos outros backends, repartidos em CARRINHOS_KV_BALDES conjuntos, cada
+# um com sua trava, para que marcar um carrinho não regrave todos os pendentes.
+logger = logging.getLogger(__name__)
+
+CHAVE_PENDENTES = 'carrinhos:pendentes'
+
+# escritas feitas pelo próprio módulo, com os carrinhos travados (os signals as ignoram)
+_gravando = ContextVar('gravando_carrinhos', default=False)
+_thread = None
+_thread_lock = threading.Lock()
+
+
+class CarrinhoOcupado(APIException):
+    status_code = 503
+    default_detail = 'Carrinho em uso por outra operação; tente novamente.'
+    default_code = 'carrinho_ocupado'
+
+
+def ativo():
+    return bool(getattr(settings, 'CARRINHOS_KV', None))
+
+
+def gravando():
+    return _gravando.get()
+
+
+def _kv():
+    return caches[settings.CARRINHOS_KV]
+
+
+def _chave(carrinho_id):
+    return f'carrinho:{carrinho_id}'
+
+
+def _obter_trava(kv, chave, dono):
+    # add é atômico; quem espera tenta de novo com intervalos crescentes (até
+    # 50 ms) e desiste após CARRINHOS_KV_TRAVA_ESPERA segundos
+    limite = time.monotonic() + settings.CARRINHOS_KV_TRAVA_ESPERA
+    espera = 0.001
+    while not kv.add(chave, dono, settings.CARRINHOS_KV_TRAVA_TTL):
+        if time.monotonic() >= limite:
+            raise CarrinhoOcupado
+        time.sleep(random.uniform(0, espera))
+        espera = min(espera * 2, 0.05)
+
+
+def _liberar_travas(kv, chaves, dono):
+    # só apaga as travas que ainda são deste dono: uma que expirou durante a
+    # operação pode já ter sido obtida por outro
+    valores = kv.get_many(chaves)
+    perdidas = [chave for chave in chaves if valores.get(chave) != dono]
+    if perdidas:
+        logger.error('Travas expiradas antes do fim da operação: %s', ', '.join(perdidas))
+    kv.delete_many([chave for chave in chaves if chave not in perdidas])
+
+
+@contextmanager
+def _travados(carrinho_ids):
+    # uma trava por carrinho no próprio armazenamento, obtidas na ordem dos
+    # ids. Expiram sozinhas se o processo que as tem cair, em
+    # CARRINHOS_KV_TRAVA_TTL segundos: o prazo precisa cobrir a operação mais
+    # longa feita com elas (gravar um lote, um checkout)
+    kv = _kv()
+    dono = uuid.uuid4().hex
+    obtidas = []
+    token = _gravando.set(True)
+    try:
+        for carrinho_id in sorted(set(carrinho_ids)):
+            chave = f'{_chave(carrinho_id)}:trava'
+            _obter_trava(kv, chave, dono)
+            obtidas.append(chave)
+        yield kv
+    finally:
+        _liberar_travas(kv, obtidas, dono)
+        _gravando.reset(token)
+
+
+@contextmanager
+def _balde_travado(kv, balde):
+    dono = uuid.uuid4().hex
+    _obter_trava(kv, f'{balde}:trava', dono)
+    try:
+        yield
+    finally:
+        _liberar_travas(kv, [f'{balde}:trava'], dono)
+
+
+def _redis(kv):
+    # (cliente, chave) do set de pendentes quando o armazenamento é Redis
+    if isinstance(kv, RedisCache):
+        return kv._cache.get_client(CHAVE_PENDENTES, write=True), kv.make_and_validate_key(CHAVE_PENDENTES)
+    return None, None
+
+
+def _balde(carrinho_id):
+    return f'{CHAVE_PENDENTES}:{carrinho_id % settings.CARRINHOS_KV_BALDES}'
+
+
+def _marcar_pendente(kv, carrinho_id):
+    cliente, chave = _redis(kv)
+    if cliente is not None:
+        cliente.sadd(chave, carrinho_id)
+        return
+    balde = _balde(carrinho_id)
+    with _balde_travado(kv, balde):
+        kv.set(balde, (kv.get(balde) or set()) | {carrinho_id}, None)
+
+
+def _pendentes(kv):
+    cliente, chave = _redis(kv)
+    if cliente is not None:
+        return {int(pk) for pk in cliente.smembers(chave)}
+    baldes = kv.get_many([f'{CHAVE_PENDENTES}:{n}' for n in range(settings.CARRINHOS_KV_BALDES)])
+    return set().union(*baldes.values())
+
+
+def _sujos(kv, carrinho_ids):
+    registros = kv.get_many([_chave(pk) for pk in carrinho_ids])
+    return {pk for pk in carrinho_ids if (registros.get(_chave(pk)) or {}).get('alterados')}
+
+
+def _desmarcar_gravados(kv, carrinho_ids):
+    # saem só os que estão gravados: um carrinho alterado de novo continua (ou
+    # volta: a alteração salva o registro antes de marcá-lo)
+    cliente, chave = _redis(kv)
+    if cliente is not None:
+        # tira antes de reler: uma alteração salva depois da releitura marca de novo
+        limpos = set(carrinho_ids) - _sujos(kv, carrinho_ids)
+        if limpos:
+            cliente.srem(chave, *limpos)
+            voltaram = _sujos(kv, limpos)
+            if voltaram:
+                cliente.sadd(chave, *voltaram)
+        return
+    por_balde = {}
+    for pk in carrinho_ids:
+        por_balde.setdefault(_balde(pk), set()).add(pk)
+    for balde, ids in por_balde.items():
+        with _balde_travado(kv, balde):
+            atuais = kv.get(balde) or set()
+            limpos = (atuais & ids) - _sujos(kv, atuais & ids)
+            if limpos:
+                kv.set(balde, atuais - limpos, None)
+
+
+def _carregar(kv, carrinho_id):
+    # registro do carrinho, lido do banco na primeira alteração; None se o
+    # carrinho não existe ou já foi finalizado (a escrita segue pelo banco)
+    registro = kv.get(_chave(carrinho_id))
+    if registro is not None:
+        return registro
+    from .models import Carrinho, ItemCarrinho
+
+    if not Carrinho.objects.filter(pk=carrinho_id, finalizado=False).exists():
+        return None
+    itens = ItemCarrinho.objects.filter(carrinho_id=carrinho_id).values_list('produto_id', 'pk', 'quantidade')
+    return {'itens': {produto: [pk, quantidade] for produto, pk, quantidade in itens}, 'alterados': set()}
+
+
+def _salvar(kv, carrinho_id, registro):
+    # com alterações pendentes o registro não expira; já gravado, pode sair do
+    # armazenamento (é relido do banco)
+    kv.set(_chave(carrinho_id), registro, None if registro['alterados'] else settings.CARRINHOS_KV_TTL)
+
+
+def _alterar(kv, carrinho_id, registro, produto_id, item_id, quantidade):
+    limpo = not registro['alterados']
+    registro['itens'][produto_id] = [item_id, quantidade]
+    registro['alterados'].add(produto_id)
+    _salvar(kv, carrinho_id, registro)
+    if limpo:
+        # marcado depois de salvo (ver _desmarcar_gravados)
+        _marcar_pendente(kv, carrinho_id)
+    _agendar()
+
+
+def adicionar(carrinho, produto, quantidade):
+    # soma ao item do produto; devolve o item (não salvo) ou None se o
+    # carrinho não está aberto
+    from .models import ItemCarrinho
+
+    with _travados([carrinho.pk]) as kv:
+        registro = _carregar(kv, carrinho.pk)
+        if registro is None:
+            return None
+        item_id, atual = registro['itens'].get(produto.pk, (None, None))
+        if item_id is None:
+            item, criado = ItemCarrinho.objects.get_or_create(
+                carrinho=carrinho, produto=produto, defaults={'quantidade': quantidade}
+            )
+            if criado:
+                registro['itens'][produto.pk] = [item.pk, quantidade]
+                _salvar(kv, carrinho.pk, registro)
+                return item
+            item_id, atual = item.pk, item.quantidade
+        # removido e ainda não gravado: volta com a quantidade nova
+        nova = (atual or 0) + quantidade
+        _alterar(kv, carrinho.pk, registro, produto.pk, item_id, nova)
+    return ItemCarrinho(pk=item_id, carrinho=carrinho, produto=produto, quantidade=nova)
+
+
+def definir(item, quantidade):
+    # quantidade None remove o item; devolve False se o carrinho não está aberto
+    with _travados([item.carrinho_id]) as kv:
+        registro = _carregar(kv, item.carrinho_id)
+        if registro is None:
+            return False
+        _alterar(kv, item.carrinho_id, registro, item.produto_id, item.pk, quantidade)
+    return True
+
+
+def remover(item):
+    return definir(item, None)
+
+
+def quantidade(item):
+    # (pendente, quantidade) do item no armazenamento; pendente False: vale a do banco
+    registro = _kv().get(_chave(item.carrinho_id))
+    item_id, valor = (registro or {'itens': {}})['itens'].get(item.produto_id, (None, None))
+    if item_id != item.pk:
+        return False, None
+    return True, valor
+
+
+def _gravar(kv, carrinho_ids):
+    # grava as quantidades alteradas (os carrinhos já estão travados)
+    from .models import ItemCarrinho
+
+    registros = kv.get_many([_chave(pk) for pk in carrinho_ids])
+    quantidades, removidos, gravados = {}, [], {}
+    for carrinho_id in carrinho_ids:
+        registro = registros.get(_chave(carrinho_id))
+        if not registro or not registro['alterados']:
+            continue
+        for produto_id in registro['alterados']:
+            item_id, valor = registro['itens'][produto_id]
+            if valor is None:
+                removidos.append(item_id)
+                del registro['itens'][produto_id]
+            else:
+                quantidades[item_id] = valor
+        registro['alterados'] = set()
+        gravados[carrinho_id] = registro
+    if not gravados:
+        return
+    with transaction.atomic():
+        if quantidades:
+            # um único UPDATE para o lote inteiro
+            ItemCarrinho.objects.filter(pk__in=quantidades).update(
+                quantidade=Case(
+                    *[When(pk=pk, then=Value(valor)) for pk, valor in quantidades.items()],
+                    output_field=models.PositiveIntegerField(),
+                )
+            )
+        if removidos:
+            ItemCarrinho.objects.filter(pk__in=removidos).delete()
+    for carrinho_id, registro in gravados.items():
+        _salvar(kv, carrinho_id, registro)
+
+
+def persistir(carrinho_ids):
+    # grava as alterações pendentes dos carrinhos, CARRINHOS_KV_LOTE por transação
+    if not ativo():
+        return
+    carrinho_ids = list(dict.fromkeys(carrinho_ids))
+    registros = _kv().get_many([_chave(pk) for pk in carrinho_ids])
+    sujos = [pk for pk in carrinho_ids if (registros.get(_chave(pk)) or {}).get('alterados')]
+    lote = settings.CARRINHOS_KV_LOTE
+    for inicio in range(0, len(sujos), lote):
+        with _travados(sujos[inicio:inicio + lote]) as kv:
+            _gravar(kv, sujos[inicio:inicio + lote])
+
+
+def persistir_pendentes():
+    # carrinhos com alterações pendentes, feitas por qualquer processo
+    if not ativo():
+        return
+    kv = _kv()
+    pendentes = _pendentes(kv)
+    if not pendentes:
+        return
+    persistir(pendentes)
+    _desmarcar_gravados(kv, pendentes)
+
+
+def persistir_visiveis(usuario):
+    # antes das leituras: os carrinhos abertos do cliente, ou todos os pendentes para staff
+    from .models import Carrinho
+
+    if usuario.is_staff:
+        persistir_pendentes()
+    else:
+        persistir(Carrinho.objects.filter(cliente_id=usuario.pk, finalizado=False).values_list('pk', flat=True))
+
+
+def descartar(carrinho_ids):
+    # o banco volta a valer para esses carrinhos (relidos na próxima alteração)
+    with _travados(carrinho_ids) as kv:
+        kv.delete_many([_chave(pk) for pk in carrinho_ids])
+
+
+@contextmanager
+def escrita_direta(*carrinho_ids):
+    # escritas que vão direto ao banco (checkout, itens em lote): grava o
+    # pendente antes, roda com os carrinhos travados e descarta os registros
+    if not ativo():
+        yield
+        return
+    with _travados(carrinho_ids) as kv:
+        _gravar(kv, carrinho_ids)
+        try:
+            yield
+        finally:
+            kv.delete_many([_chave(pk) for pk in carrinho_ids])
+
+
+def _agendar():
+    global _thread
+    with _thread_lock:
+        intervalo = settings.CARRINHOS_KV_INTERVALO
+        if intervalo and _thread is None:
+            _thread = threading.Thread(
+                target=_gravar_periodicamente, args=(intervalo,), name='carrinhos-kv', daemon=True
+            )
+            _thread.start()
+
+
+def _gravar_periodicamente(intervalo):
+    while True:
+        time.sleep(intervalo)
+        try:
+            persistir_pendentes()
+        except Exception:
+            logger.exception('Falha ao gravar os carrinhos pendentes.')
+        finally:
+            # a conexão pertence a esta thread; respeita CONN_MAX_AGE
+            close_old_connections()
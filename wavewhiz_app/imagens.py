@@ -0,0 +1,140 @@
+import hashlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from PIL import Image, ImageOps
+
+# variantes geradas para Loja.imagem e Produto.imagem: nome -> maior lado em px
+VARIANTES = getattr(settings, 'IMAGENS_VARIANTES', {'thumb': 160, 'card': 480, 'full': 1280})
+FORMATOS = {'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg')}
+
+_executor = None
+# originais com geração na fila (não agenda de novo a cada requisição)
+_agendados = set()
+_lock = threading.Lock()
+# travas por faixa de hash: duas gerações do mesmo original não correm juntas,
+# sem guardar uma trava por imagem
+_travas = [threading.Lock() for _ in range(64)]
+
+
+def formato():
+    return getattr(settings, 'IMAGENS_FORMATO', 'webp')
+
+
+def storage_derivados():
+    # os derivados já têm nome pelo hash do conteúdo; sobrescrever é seguro
+    return FileSystemStorage(location=settings.MEDIA_ROOT, base_url=settings.MEDIA_URL, allow_overwrite=True)
+
+
+def nome_derivado(hash_original, variante):
+    return f'derivados/{hash_original[:2]}/{hash_original}-{variante}.{formato()}'
+
+
+def hash_conhecido(storage, nome):
+    # hash do original sem ler o arquivo, ou None
+    valor = cache.get(f'imagem-hash:{nome}')
+    if valor is None and hasattr(storage, 'hash_do_nome'):
+        # storage por conteúdo: o hash já está no nome
+        valor = storage.hash_do_nome(nome)
+    return valor
+
+
+def hash_do_arquivo(storage, nome):
+    valor = hash_conhecido(storage, nome)
+    if valor is None:
+        resumo = hashlib.sha256()
+        with storage.open(nome, 'rb') as arquivo:
+            for bloco in iter(lambda: arquivo.read(64 * 1024), b''):
+                resumo.update(bloco)
+        valor = resumo.hexdigest()
+        cache.set(f'imagem-hash:{nome}', valor, None)
+    return valor
+
+
+def derivados_prontos(nome):
+    # hash do original se todas as variantes já foram geradas, senão None
+    return cache.get(f'imagem-derivados:{nome}:{formato()}')
+
+
+def gerar_derivados(storage, nome):
+    hash_original = hash_do_arquivo(storage, nome)
+    with _travas[int(hash_original[:8], 16) % len(_travas)]:
+        destino = storage_derivados()
+        faltando = [v for v in VARIANTES if not destino.exists(nome_derivado(hash_original, v))]
+        if faltando:
+            formato_pil = FORMATOS[formato()][0]
+            with storage.open(nome, 'rb') as arquivo:
+                original = ImageOps.exif_transpose(Image.open(arquivo))
+                original.load()
+            if formato_pil == 'JPEG' and original.mode != 'RGB':
+                original = original.convert('RGB')
+            elif original.mode not in ('RGB', 'RGBA'):
+                original = original.convert('RGBA')
+            for variante in faltando:
+                lado = VARIANTES[variante]
+                copia = original.copy()
+                copia.thumbnail((lado, lado), Image.Resampling.LANCZOS)
+                buffer = io.BytesIO()
+                copia.save(buffer, formato_pil, quality=80)
+                destino.save(nome_derivado(hash_original, variante), ContentFile(buffer.getvalue()))
+        cache.set(f'imagem-derivados:{nome}:{formato()}', hash_original, None)
+    return hash_original
+
+
+def _gerar_e_notificar(storage, nome, ao_concluir):
+    try:
+        gerar_derivados(storage, nome)
+    finally:
+        with _lock:
+            _agendados.discard(nome)
+    if ao_concluir is not None:
+        ao_concluir()
+
+
+def agendar_derivados(campo, ao_concluir=None):
+    # geração fora da thread da requisição; ao_concluir roda no worker.
+    # Com IMAGENS_WORKERS = 0 gera na hora (testes e scripts)
+    global _executor
+    if not campo or derivados_prontos(campo.name) is not None:
+        return
+    workers = getattr(settings, 'IMAGENS_WORKERS', 2)
+    with _lock:
+        if campo.name in _agendados and ao_concluir is None:
+            return
+        _agendados.add(campo.name)
+    if not workers:
+        _gerar_e_notificar(campo.storage, campo.name, ao_concluir)
+        return
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='imagens')
+    _executor.submit(_gerar_e_notificar, campo.storage, campo.name, ao_concluir)
+
+
+def urls_prontas(campo):
+    # {variante: url} dos arquivos já gerados, ou None se ainda faltam
+    hash_original = derivados_prontos(campo.name)
+    if hash_original is None:
+        return None
+    storage = storage_derivados()
+    return {variante: storage.url(nome_derivado(hash_original, variante)) for variante in VARIANTES}
+
+
+def url_derivado(campo, variante):
+    # url da variante, ou None se ainda não foi gerada: agenda a geração, sem
+    # ler nem redimensionar o original na requisição
+    hash_original = derivados_prontos(campo.name)
+    if hash_original is None:
+        hash_original = hash_conhecido(campo.storage, campo.name)
+        if hash_original is None or not storage_derivados().exists(nome_derivado(hash_original, variante)):
+            agendar_derivados(campo)
+            # com IMAGENS_WORKERS = 0 já foi gerada
+            hash_original = derivados_prontos(campo.name)
+            if hash_original is None:
+                return None
+    return storage_derivados().url(nome_derivado(hash_original, variante))
@@ -0,0 +1,119 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, transaction
+
+from . import busca, cache_respostas
+from .models import Loja, Produto
+from .serializers import ProdutoImportacaoSerializer
+
+CAMPOS = ('id', 'nome', 'preco', 'estoque', 'descricao')
+FORMATOS = ('csv', 'jsonl')
+TAMANHO_LOTE = 1000
+
+
+def formato_do_content_type(content_type):
+    content_type = (content_type or '').split(';')[0].strip()
+    if content_type == 'text/csv':
+        return 'csv'
+    if content_type in ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines'):
+        return 'jsonl'
+    return None
+
+
+def ler_registros(linhas, formato):
+    # gera (número da linha, dict ou None se a linha não pôde ser lida), sem
+    # carregar o arquivo inteiro
+    if formato == 'csv':
+        leitor = csv.DictReader(linhas)
+        for registro in leitor:
+            yield leitor.line_num, {campo: valor for campo, valor in registro.items() if campo and valor != ''}
+        return
+    for numero, linha in enumerate(linhas, start=1):
+        if not linha.strip():
+            continue
+        try:
+            registro = json.loads(linha)
+        except ValueError:
+            registro = None
+        yield numero, registro if isinstance(registro, dict) else None
+
+
+def importar_produtos(loja, registros, tamanho_lote=TAMANHO_LOTE):
+    # valida e grava em lotes (bulk_create/bulk_update, uma transação por
+    # lote); linhas inválidas entram no relatório sem interromper o resto
+    relatorio = {'criados': 0, 'atualizados': 0, 'erros': []}
+    registros = iter(registros)
+    while lote := list(islice(registros, tamanho_lote)):
+        _importar_lote(loja, lote, relatorio)
+    return relatorio
+
+
+def _importar_lote(loja, lote, relatorio):
+    novos, alterados = [], []
+    for numero, registro in lote:
+        if registro is None:
+            relatorio['erros'].append({'linha': numero, 'erros': {'non_field_errors': ['Linha inválida.']}})
+            continue
+        serializer = ProdutoImportacaoSerializer(data=registro)
+        if not serializer.is_valid():
+            relatorio['erros'].append({'linha': numero, 'erros': serializer.errors})
+            continue
+        dados = serializer.validated_data
+        (alterados if dados.get('id') else novos).append((numero, dados))
+
+    existentes = loja.produtos.in_bulk([dados['id'] for _, dados in alterados])
+    atualizar = []
+    for numero, dados in alterados:
+        produto = existentes.get(dados['id'])
+        if produto is None:
+            relatorio['erros'].append({'linha': numero, 'erros': {'id': ['Produto não encontrado nesta loja.']}})
+            continue
+        for campo, valor in dados.items():
+            setattr(produto, campo, valor)
+        atualizar.append(produto)
+    criar = [Produto(loja=loja, **dados) for _, dados in novos]
+
+    try:
+        with transaction.atomic():
+            Produto.objects.bulk_create(criar)
+            if atualizar:
+                Produto.objects.bulk_update(atualizar, [campo for campo in CAMPOS if campo != 'id'])
+            # bulk_create/bulk_update não disparam signals nem passam pelo Produto.save
+            busca.backend().indexar(Produto, criar + atualizar)
+            Loja.recalcular_resumo([loja.pk])
+    except DatabaseError as erro:
+        linhas = [numero for numero, _ in novos + alterados]
+        relatorio['erros'].extend({'linha': numero, 'erros': {'non_field_errors': [str(erro)]}} for numero in linhas)
+        return
+    relatorio['criados'] += len(criar)
+    relatorio['atualizados'] += len(atualizar)
+    cache_respostas.invalidar('produtos')
+    cache_respostas.invalidar('lojas', loja.pk)
+    for produto in atualizar:
+        cache_respostas.invalidar('produtos', produto.pk)
+
+
+def exportar_produtos(loja, formato, tamanho_bloco=64 * 1024):
+    # gera o catálogo em blocos de texto, lendo o banco com iterator(): a
+    # memória não cresce com o número de produtos
+    linhas = loja.produtos.order_by('pk').values_list(*CAMPOS).iterator(chunk_size=2000)
+    buffer = io.StringIO()
+    if formato == 'csv':
+        escritor = csv.writer(buffer)
+        escritor.writerow(CAMPOS)
+        escrever = escritor.writerow
+    else:
+        def escrever(linha):
+            buffer.write(json.dumps(dict(zip(CAMPOS, linha)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+    for linha in linhas:
+        escrever(linha)
+        if buffer.tell() >= tamanho_bloco:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,157 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import groupby, islice
+
+from django.db.models import F
+
+# Índice em memória categoria -> ids das lojas (array ordenado), usado para
+# filtrar /lojas/?categoria= sem passar pela tabela M2M. Cada alteração
+# incrementa uma versão no banco (VersaoIndice), compartilhada por todos os
+# processos, na mesma transação que altera a tabela M2M (ver signals): o
+# processo que a fez aplica a mudança no próprio índice depois do commit, os
+# demais percebem a versão nova (uma consulta pela chave primária por
+# filtragem, fora da trava) e reconstroem.
+CHAVE_VERSAO = 'indice-categorias'
+MODOS = ('any', 'all')
+
+_indice = None
+_versao = None
+_lock = threading.RLock()
+
+
+def _versao_atual():
+    from .models import VersaoIndice
+
+    return VersaoIndice.objects.filter(pk=CHAVE_VERSAO).values_list('versao', flat=True).first() or 0
+
+
+def incrementar():
+    # dentro da transação da alteração: a versão nova é confirmada (ou
+    # desfeita) junto com ela. Devolve a versão, para aplicar no commit.
+    from .models import VersaoIndice
+
+    if not VersaoIndice.objects.filter(pk=CHAVE_VERSAO).update(versao=F('versao') + 1):
+        _, criada = VersaoIndice.objects.get_or_create(pk=CHAVE_VERSAO, defaults={'versao': 1})
+        if not criada:
+            VersaoIndice.objects.filter(pk=CHAVE_VERSAO).update(versao=F('versao') + 1)
+    return _versao_atual()
+
+
+def _construir():
+    from .models import Loja
+
+    indice = {}
+    relacoes = (
+        Loja.categorias.through.objects.order_by('categorialoja_id', 'loja_id')
+        .values_list('categorialoja_id', 'loja_id')
+        .iterator(chunk_size=10000)
+    )
+    for categoria, loja in relacoes:
+        ids = indice.get(categoria)
+        if ids is None:
+            ids = indice[categoria] = array('q')
+        ids.append(loja)
+    return indice
+
+
+def _atual(versao):
+    # com _lock; versao foi lida antes (fora da trava): uma alteração durante
+    # a construção força outra na próxima leitura
+    global _indice, _versao
+    if _indice is None or versao > _versao:
+        _indice, _versao = _construir(), versao
+    return _indice
+
+
+def _alterar(versao, aplicar):
+    # no commit da transação que incrementou para `versao`
+    global _indice, _versao
+    with _lock:
+        if _indice is None or versao <= _versao:
+            # já reconstruído com a alteração
+            return
+        if versao == _versao + 1:
+            aplicar(_indice)
+            _versao = versao
+        else:
+            # outro processo também alterou: reconstrói na próxima leitura
+            _indice = None
+
+
+def invalidar():
+    # após escritas que não disparam signals (bulk_create na tabela M2M)
+    global _indice
+    incrementar()
+    with _lock:
+        _indice = None
+
+
+def aplicar(versao, pares, adicionar):
+    # pares (categoria, loja) incluídos ou removidos (ver signals)
+    def alterar(indice):
+        for categoria, loja in pares:
+            ids = indice.setdefault(categoria, array('q'))
+            if adicionar and not _contem(ids, loja):
+                insort(ids, loja)
+            elif not adicionar:
+                _remover(ids, loja)
+
+    _alterar(versao, alterar)
+
+
+def remover_loja(versao, loja):
+    def alterar(indice):
+        for ids in indice.values():
+            _remover(ids, loja)
+
+    _alterar(versao, alterar)
+
+
+def remover_categoria(versao, categoria):
+    _alterar(versao, lambda indice: indice.pop(categoria, None))
+
+
+def _contem(ids, loja):
+    posicao = bisect_left(ids, loja)
+    return posicao < len(ids) and ids[posicao] == loja
+
+
+def _remover(ids, loja):
+    posicao = bisect_left(ids, loja)
+    if posicao < len(ids) and ids[posicao] == loja:
+        del ids[posicao]
+
+
+def _descendo(ids, antes_de):
+    fim = len(ids) if antes_de is None else bisect_left(ids, antes_de)
+    return (ids[posicao] for posicao in range(fim - 1, -1, -1))
+
+
+def _subindo(ids, depois_de):
+    inicio = 0 if depois_de is None else bisect_right(ids, depois_de)
+    return (ids[posicao] for posicao in range(inicio, len(ids)))
+
+
+def lojas(categorias, modo='any', posicao=None, decrescente=True, quantidade=None, apenas=None):
+    # ids das lojas em qualquer (any) ou em todas (all) as categorias, em ordem
+    # decrescente (abaixo de posicao) ou crescente (acima dela), sem repetição;
+    # apenas: restringe a um conjunto de ids. Só percorre o necessário para
+    # devolver `quantidade` ids.
+    versao = _versao_atual()
+    with _lock:
+        indice = _atual(versao)
+        listas = [indice.get(categoria, array('q')) for categoria in dict.fromkeys(categorias)]
+        percorrer = _descendo if decrescente else _subindo
+        if modo == 'all':
+            listas.sort(key=len)
+            menor, outras = listas[0], listas[1:]
+            ids = (loja for loja in percorrer(menor, posicao) if all(_contem(lista, loja) for lista in outras))
+        else:
+            juntas = heapq.merge(*(percorrer(lista, posicao) for lista in listas), reverse=decrescente)
+            ids = (loja for loja, _ in groupby(juntas))
+        if apenas is not None:
+            ids = (loja for loja in ids if loja in apenas)
+        return list(islice(ids, quantidade))
+
@@ -0,0 +1,59 @@
+import math
+import re
+from decimal import Decimal
+
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON com orjson (settings.JSON_BACKEND = 'orjson', se instalado) produzindo
+# os mesmos bytes do JSONRenderer/JSONParser do DRF (compacto, sem escapar
+# não-ASCII). Quando o resultado poderia ser diferente, dumps levanta TypeError
+# e loads ValueError, e quem chama usa o json da biblioteca padrão. Única
+# diferença: um float (não Decimal) NaN/inf vira null em vez de ValueError.
+_OPCOES = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS if orjson else 0
+# floats escritos de outro jeito: com expoente (o orjson escreve 1e16, o json
+# 1e+16) e abaixo de 1e-4 (0.00001 contra 1e-05). Na saída compacta todo
+# número vem depois de '[', ':' ou ','
+_FLOAT_DIFERENTE = re.compile(rb'(?:^|[\[:,])-?(?:\d+(?:\.\d+)?e|0\.0000)')
+# inteiros além de 64 bits: o orjson os lê como float
+_NUMERO_LONGO = b'0' * 19
+# o re varre ~1 ms a cada 100 KB; com os dígitos trocados por 0 a busca
+# preliminar é por substring, e o _FLOAT_DIFERENTE só confirma os candidatos
+_DIGITOS = bytes.maketrans(b'123456789', b'000000000')
+_encoder = JSONEncoder()
+
+
+def ativo():
+    return orjson is not None and getattr(settings, 'JSON_BACKEND', 'orjson') == 'orjson'
+
+
+def _default(objeto):
+    # datas, Decimal etc. convertidos como no encoder do DRF (Decimal -> float)
+    if isinstance(objeto, Decimal):
+        valor = float(objeto)
+        if not math.isfinite(valor):
+            raise TypeError
+        return valor
+    return _encoder.default(objeto)
+
+
+def dumps(dados):
+    if not ativo():
+        raise TypeError('orjson indisponível.')
+    saida = orjson.dumps(dados, default=_default, option=_OPCOES)
+    zerada = saida.translate(_DIGITOS)
+    if (b'0e' in zerada or b'0.0000' in zerada) and _FLOAT_DIFERENTE.search(saida):
+        raise TypeError('Float formatado de outro jeito pelo orjson.')
+    # o JSONRenderer escapa os separadores de linha do JavaScript
+    return saida.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+def loads(corpo):
+    if not ativo() or _NUMERO_LONGO in corpo.translate(_DIGITOS):
+        raise ValueError('orjson indisponível para este corpo.')
+    return orjson.loads(corpo)
@@ -0,0 +1,164 @@
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from wavewhiz_app.benchmarks import SENHA_SINTETICA, banco_temporario, gerar_dados, percentil, proporcoes
+from wavewhiz_app.models import Carrinho, Loja, Usuario
+from wavewhiz_app.urls import router
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede vazão, latências (p50/p95/p99), consultas SQL e pico de memória de cada rota do router e de '
+        '/api/token/, num banco temporário com dados sintéticos, e grava os resultados em JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escala', type=int, default=2000, help='Nº de produtos gerados (ver gerar_dados).')
+        parser.add_argument('--requisicoes', type=int, default=50, help='Requisições medidas por rota.')
+        parser.add_argument('--saida', help='Arquivo JSON de resultados (padrão: bench_api-<commit>.json).')
+        parser.add_argument('--comparar', help='JSON de uma execução anterior para mostrar as diferenças.')
+        parser.add_argument(
+            '--banco-atual', metavar='EMAIL_ADMIN',
+            help=(
+                'Usa o banco configurado (ex.: preenchido com gerar_dados) com este admin, em vez de um banco '
+                'temporário. As rotas de escrita alteram esse banco.'
+            ),
+        )
+        parser.add_argument('--senha', default=SENHA_SINTETICA, help='Senha do admin com --banco-atual.')
+
+    def handle(self, *args, **options):
+        anterior = None
+        if options['comparar']:
+            with open(options['comparar']) as arquivo:
+                anterior = json.load(arquivo)
+        if options['banco_atual']:
+            if not Usuario.objects.filter(email=options['banco_atual'], is_staff=True).exists():
+                raise CommandError('Admin não encontrado no banco configurado.')
+            rotas = self.medir(options['banco_atual'], options['senha'], options['requisicoes'])
+        else:
+            with banco_temporario():
+                admin, _ = gerar_dados(proporcoes(options['escala']))
+                rotas = self.medir(admin.email, SENHA_SINTETICA, options['requisicoes'])
+
+        commit = self.commit_atual()
+        resultado = {
+            'meta': {
+                'commit': commit,
+                'data': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'escala': None if options['banco_atual'] else options['escala'],
+                'requisicoes_por_rota': options['requisicoes'],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'banco': connection.vendor,
+            },
+            'rotas': rotas,
+        }
+        saida = options['saida'] or f'bench_api-{commit or "local"}.json'
+        with open(saida, 'w') as arquivo:
+            json.dump(resultado, arquivo, indent=2, ensure_ascii=False)
+        self.imprimir(rotas, anterior and anterior.get('rotas'))
+        self.stdout.write(f'Resultados em {saida}')
+
+    def commit_atual(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def cenarios(self, email, senha, refresh):
+        # (nome, método, url, corpo); GET de listagem e detalhe de cada rota do
+        # router, mais ações customizadas e os endpoints de token
+        for prefixo, viewset, _ in router.registry:
+            model = viewset.queryset.model
+            yield f'{prefixo}-list', 'get', f'/{prefixo}/', None
+            pk = model.objects.order_by('pk').values_list('pk', flat=True).first()
+            if pk is not None:
+                yield f'{prefixo}-detail', 'get', f'/{prefixo}/{pk}/', None
+        loja = Loja.objects.order_by('pk').values_list('pk', flat=True).first()
+        carrinho = Carrinho.objects.filter(finalizado=False).order_by('pk').first()
+        yield 'produtos-search', 'get', '/produtos/search/?q=bolo', None
+        yield 'lojas-search', 'get', '/lojas/search/?q=loja', None
+        yield 'carrinhos-list-por-total', 'get', '/carrinhos/?ordering=-total', None
+        if loja is not None:
+            yield 'lojas-produtos-export', 'get', f'/lojas/{loja}/produtos/export/?formato=jsonl', None
+        if carrinho is not None:
+            produto = carrinho.itens.values_list('produto_id', flat=True).first()
+            if produto is not None:
+                corpo = [{'produto_id': produto, 'quantidade': 1}]
+                yield 'carrinhos-itens-bulk', 'post', f'/carrinhos/{carrinho.pk}/itens/bulk/', corpo
+        yield 'async-produtos-list', 'get', '/async/produtos/', None
+        yield 'async-lojas-list', 'get', '/async/lojas/', None
+        yield 'token-obtain', 'post', '/api/token/', {'email': email, 'password': senha}
+        yield 'token-refresh', 'post', '/api/token/refresh/', {'refresh': refresh}
+
+    def medir(self, email, senha, requisicoes):
+        resposta = Client(HTTP_HOST='localhost').post(
+            '/api/token/', {'email': email, 'password': senha}, content_type='application/json'
+        )
+        if resposta.status_code != 200:
+            raise CommandError(f'Login do admin falhou ({resposta.status_code}).')
+        tokens = resposta.json()
+        rotas = {}
+        autenticado = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {tokens["access"]}')
+
+        def requisitar(metodo, url, corpo):
+            resposta = getattr(autenticado, metodo)(url, corpo, content_type='application/json') if corpo else getattr(autenticado, metodo)(url)
+            if resposta.streaming:
+                b''.join(resposta.streaming_content)
+            return resposta
+
+        for nome, metodo, url, corpo in self.cenarios(email, senha, tokens['refresh']):
+            requisitar(metodo, url, corpo)  # aquecimento (cache, conexões)
+            latencias = []
+            # com DEBUG o log de consultas é limitado; esvaziá-lo mantém a contagem correta
+            reset_queries()
+            with CaptureQueriesContext(connection) as consultas:
+                for _ in range(requisicoes):
+                    comeco = time.perf_counter()
+                    resposta = requisitar(metodo, url, corpo)
+                    latencias.append(time.perf_counter() - comeco)
+            # lido antes da próxima requisição, que limpa o log de consultas
+            total_consultas = len(consultas)
+            tracemalloc.start()
+            requisitar(metodo, url, corpo)
+            pico = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rotas[nome] = self.resultado(metodo, url, resposta.status_code, latencias, total_consultas / requisicoes, pico)
+        return rotas
+
+    def resultado(self, metodo, url, status, latencias, consultas, pico):
+        return {
+            'metodo': metodo.upper(),
+            'url': url,
+            'status': status,
+            'req_s': round(len(latencias) / sum(latencias), 1),
+            'p50_ms': round(percentil(latencias, 50) * 1000, 2),
+            'p95_ms': round(percentil(latencias, 95) * 1000, 2),
+            'p99_ms': round(percentil(latencias, 99) * 1000, 2),
+            'consultas': round(consultas, 2),
+            'pico_memoria_kb': round(pico / 1024, 1),
+        }
+
+    def imprimir(self, rotas, anteriores):
+        anteriores = anteriores or {}
+        self.stdout.write(f'{"rota":28}{"status":>7}{"req/s":>9}{"p50 ms":>9}{"p99 ms":>9}{"SQL":>7}{"mem KB":>9}{"Δ p50":>9}')
+        for nome, dados in rotas.items():
+            delta = ''
+            if nome in anteriores and anteriores[nome]['p50_ms']:
+                delta = f'{(dados["p50_ms"] / anteriores[nome]["p50_ms"] - 1) * 100:+.0f}%'
+            self.stdout.write(
+                f'{nome:28}{dados["status"]:>7}{dados["req_s"]:>9}{dados["p50_ms"]:>9}{dados["p99_ms"]:>9}'
+                f'{dados["consultas"]:>7}{dados["pico_memoria_kb"]:>9}{delta:>9}'
+            )
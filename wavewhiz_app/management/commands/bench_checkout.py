@@ -0,0 +1,91 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+from wavewhiz_app.benchmarks import banco_temporario, percentil
+from wavewhiz_app.models import (
+    Carrinho,
+    CarrinhoJaFinalizado,
+    EstoqueInsuficiente,
+    ItemCarrinho,
+    Loja,
+    Produto,
+    Usuario,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Teste de carga do checkout: vários workers comprando o mesmo produto ao mesmo tempo, '
+        'num banco temporário. Verifica que o estoque nunca fica negativo nem é vendido a mais.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16)
+        parser.add_argument('--checkouts', type=int, default=25, help='Checkouts por worker.')
+        parser.add_argument('--estoque', type=int, default=100, help='Estoque inicial do produto disputado.')
+
+    def handle(self, *args, **options):
+        with banco_temporario():
+            produto, carrinhos = self.preparar(options)
+            resultado = self.executar(carrinhos, options['workers'])
+            produto.refresh_from_db()
+
+        vendidos = resultado['sucesso']
+        self.stdout.write(
+            f"{len(carrinhos)} checkouts, {options['workers']} workers, estoque inicial {options['estoque']}\n"
+            f"  vendidos: {vendidos}  sem estoque: {resultado['sem_estoque']}  erros de banco: {resultado['erros']}\n"
+            f"  estoque final: {produto.estoque} (esperado {options['estoque'] - vendidos})\n"
+            f"  vazão: {len(carrinhos) / resultado['segundos']:.1f} checkouts/s  "
+            f"p50: {percentil(resultado['latencias'], 50) * 1000:.1f} ms  "
+            f"p99: {percentil(resultado['latencias'], 99) * 1000:.1f} ms"
+        )
+        if vendidos > options['estoque'] or produto.estoque != options['estoque'] - vendidos:
+            self.stderr.write(self.style.ERROR('Estoque inconsistente: houve venda acima do disponível.'))
+
+    def preparar(self, options):
+        empreendedor = Usuario.objects.create_user(
+            'loja@benchmark.local', nome='Loja', cpf='00000000001', telefone='11999990000',
+            data_nascimento=date(1990, 1, 1), role='empreendedor',
+        )
+        loja = Loja.objects.create(empreendedor=empreendedor, nome='Loja benchmark')
+        produto = Produto.objects.create(loja=loja, nome='Produto disputado', preco=Decimal('10.00'), estoque=options['estoque'])
+        carrinhos = []
+        for i in range(options['workers'] * options['checkouts']):
+            cliente = Usuario.objects.create_user(
+                f'cliente{i}@benchmark.local', nome=f'Cliente {i}', cpf=f'{i + 10:011d}', telefone='11999990000',
+                data_nascimento=date(1990, 1, 1),
+            )
+            carrinho = Carrinho.objects.create(cliente=cliente)
+            ItemCarrinho.objects.create(carrinho=carrinho, produto=produto, quantidade=1)
+            carrinhos.append(carrinho)
+        return produto, carrinhos
+
+    def executar(self, carrinhos, workers):
+        resultado = {'sucesso': 0, 'sem_estoque': 0, 'erros': 0, 'latencias': []}
+
+        def comprar(carrinho):
+            inicio = time.perf_counter()
+            try:
+                carrinho.finalizar()
+                situacao = 'sucesso'
+            except (EstoqueInsuficiente, CarrinhoJaFinalizado):
+                situacao = 'sem_estoque'
+            except OperationalError:
+                # ex.: "database is locked" no SQLite sem WAL/BEGIN IMMEDIATE
+                situacao = 'erros'
+            finally:
+                connection.close()
+            return situacao, time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for situacao, segundos in pool.map(comprar, carrinhos):
+                resultado[situacao] += 1
+                resultado['latencias'].append(segundos)
+        resultado['segundos'] = time.perf_counter() - inicio
+        return resultado
@@ -0,0 +1,117 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, connections
+
+from wavewhiz_app.benchmarks import banco_temporario, percentil
+from wavewhiz_app.models import Carrinho, Loja, Produto, Usuario
+
+MODOS = {
+    'padrao': {'OPTIONS': {}, 'CONN_MAX_AGE': 0},
+    'producao': {'OPTIONS': settings.SQLITE_OPCOES_PRODUCAO, 'CONN_MAX_AGE': 600},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Carga de escrita concorrente no SQLite (cadastros e itens de carrinho, como nas requisições), '
+        'num banco temporário: vazão, latências e erros "database is locked".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--operacoes', type=int, default=200, help='Operações por worker.')
+        parser.add_argument('--modo', choices=sorted(MODOS), default='producao')
+        parser.add_argument('--comparar', action='store_true', help='Mede os dois modos (padrão e produção).')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write('Este benchmark só se aplica ao SQLite.')
+            return
+        modos = sorted(MODOS) if options['comparar'] else [options['modo']]
+        self.stdout.write(f'{"modo":10}{"ops/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"travado":>10}')
+        for modo in modos:
+            resultado = self.medir(modo, options['workers'], options['operacoes'])
+            self.stdout.write(
+                f'{modo:10}{resultado["ops_s"]:10.1f}{resultado["p50"] * 1000:10.1f}'
+                f'{resultado["p99"] * 1000:10.1f}{resultado["travado"]:10}'
+            )
+
+    def medir(self, modo, workers, operacoes):
+        configuracao = connection.settings_dict
+        originais = {chave: configuracao.get(chave) for chave in MODOS[modo]}
+        configuracao.update(MODOS[modo])
+        connection.close()
+        try:
+            with banco_temporario():
+                carrinhos = self.preparar(workers)
+                return self.executar(carrinhos, operacoes)
+        finally:
+            configuracao.update(originais)
+            connection.close()
+
+    def preparar(self, workers):
+        empreendedor = Usuario.objects.create_user(
+            'loja@benchmark.local', nome='Loja', cpf='00000000001', telefone='11999990000',
+            data_nascimento=date(1990, 1, 1), role='empreendedor',
+        )
+        loja = Loja.objects.create(empreendedor=empreendedor, nome='Loja benchmark')
+        produtos = Produto.objects.bulk_create(
+            Produto(loja=loja, nome=f'Produto {n}', preco=Decimal('10.00'), estoque=1000) for n in range(20)
+        )
+        carrinhos = []
+        for n in range(workers):
+            cliente = Usuario.objects.create_user(
+                f'cliente{n}@benchmark.local', nome=f'Cliente {n}', cpf=f'{n + 10:011d}',
+                telefone='11999990000', data_nascimento=date(1990, 1, 1),
+            )
+            carrinhos.append((Carrinho.objects.create(cliente=cliente), [p.pk for p in produtos]))
+        connection.close()
+        return carrinhos
+
+    def executar(self, carrinhos, operacoes):
+        latencias, travado = [], [0]
+        lock = threading.Lock()
+        sequencia = iter(range(100, 10**9))
+
+        def trabalhar(argumentos):
+            carrinho, produtos = argumentos
+            for n in range(operacoes):
+                inicio = time.perf_counter()
+                try:
+                    if n % 2:
+                        # leitura seguida de escrita na mesma transação
+                        carrinho.adicionar_itens({produtos[n % len(produtos)]: 1})
+                    else:
+                        with lock:
+                            numero = next(sequencia)
+                        Usuario.objects.create_user(
+                            f'novo{numero}@benchmark.local', nome='Novo', cpf=f'{numero:011d}',
+                            telefone='11999990000', data_nascimento=date(1990, 1, 1),
+                        )
+                except OperationalError:
+                    with lock:
+                        travado[0] += 1
+                else:
+                    with lock:
+                        latencias.append(time.perf_counter() - inicio)
+                finally:
+                    # fim da "requisição": fecha a conexão, salvo com CONN_MAX_AGE
+                    close_old_connections()
+            connections.close_all()
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(carrinhos)) as pool:
+            list(pool.map(trabalhar, carrinhos))
+        segundos = time.perf_counter() - inicio
+        return {
+            'ops_s': len(latencias) / segundos,
+            'p50': percentil(latencias, 50),
+            'p99': percentil(latencias, 99),
+            'travado': travado[0],
+        }
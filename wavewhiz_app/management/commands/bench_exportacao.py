@@ -0,0 +1,68 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from wavewhiz_app.benchmarks import banco_temporario, gerar_dados
+from wavewhiz_app.views import CarrinhoViewSet, UsuarioViewSet
+
+ROTAS = {'usuarios': UsuarioViewSet, 'carrinhos': CarrinhoViewSet}
+
+
+class Command(BaseCommand):
+    help = (
+        'Pico de memória (tracemalloc) e tempo da listagem inteira de /usuarios/ e /carrinhos/ montada de uma '
+        'vez (list sem paginação) e da exportação em streaming (/export/, JSON e NDJSON), para cada nº de '
+        'linhas, num banco temporário com dados sintéticos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, nargs='+', default=[1000, 5000, 20000])
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"rota":11}{"linhas":>8}  {"modo":16}{"pico MB":>9}{"segundos":>10}{"MB gerados":>12}')
+        for linhas in options['linhas']:
+            with banco_temporario():
+                admin, _ = gerar_dados({
+                    'categorias': 5, 'usuarios': linhas, 'lojas': 2, 'produtos': 100,
+                    'carrinhos': linhas, 'itens_por_carrinho': 3,
+                })
+                for rota, viewset in ROTAS.items():
+                    for modo, view, accept in self.modos(viewset):
+                        try:
+                            pico, segundos, tamanho = self.medir(view, rota, admin, accept)
+                        except DatabaseError as erro:
+                            # ex.: no SQLite, o prefetch da lista inteira passa do limite de expressões
+                            tracemalloc.stop()
+                            self.stdout.write(f'{rota:11}{linhas:8}  {modo:16}  falhou: {erro}')
+                            continue
+                        self.stdout.write(
+                            f'{rota:11}{linhas:8}  {modo:16}{pico / 2 ** 20:9.1f}{segundos:10.2f}{tamanho / 2 ** 20:12.1f}'
+                        )
+
+    def modos(self, viewset):
+        yield 'lista inteira', viewset.as_view({'get': 'list'}, pagination_class=None), 'application/json'
+        # como o router: os kwargs da @action (renderer_classes) viram initkwargs
+        exportar = viewset.as_view({'get': 'exportar'}, **viewset.exportar.kwargs)
+        yield 'streaming json', exportar, 'application/json'
+        yield 'streaming ndjson', exportar, 'application/x-ndjson'
+
+    def medir(self, view, rota, admin, accept):
+        requisicao = APIRequestFactory().get(f'/{rota}/', HTTP_ACCEPT=accept)
+        force_authenticate(requisicao, user=admin)
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        resposta = view(requisicao)
+        tamanho = 0
+        if resposta.streaming:
+            # cada pedaço é descartado, como ao escrever no socket
+            for pedaco in resposta.streaming_content:
+                tamanho += len(pedaco)
+        else:
+            tamanho = len(resposta.render().content)
+        segundos = time.perf_counter() - inicio
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return pico, segundos, tamanho
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wavewhiz_app.benchmarks import percentil
+
+
+class Command(BaseCommand):
+    help = (
+        'Gera carga HTTP concorrente (asyncio) contra uma ou mais URLs e mede requisições/s e latências. '
+        'Ex.: compare um servidor WSGI (gunicorn config.wsgi) em /produtos/ com um ASGI '
+        '(uvicorn config.asgi:application) em /async/produtos/.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='URLs http:// de um servidor já em execução.')
+        parser.add_argument('--concorrencia', type=int, default=200, help='Clientes simultâneos.')
+        parser.add_argument('--segundos', type=float, default=10.0, help='Duração da medição por URL.')
+        parser.add_argument(
+            '--lento', type=float, default=0.0,
+            help='Segundos que cada cliente leva para terminar de enviar a requisição (simula clientes lentos).',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"url":50}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"erros":>8}')
+        for url in options['urls']:
+            partes = urlsplit(url)
+            if partes.scheme != 'http' or not partes.hostname:
+                raise CommandError(f'URL inválida (use http://host:porta/caminho): {url}')
+            latencias, erros, duracao = asyncio.run(self.medir(partes, options))
+            vazao = len(latencias) / duracao
+            p50, p99 = (percentil(latencias, p) * 1000 for p in (50, 99))
+            self.stdout.write(f'{url:50}{vazao:10.1f}{p50:10.1f}{p99:10.1f}{erros:8}')
+
+    async def medir(self, partes, options):
+        caminho = partes.path or '/'
+        if partes.query:
+            caminho = f'{caminho}?{partes.query}'
+        cabecalho = f'GET {caminho} HTTP/1.1\r\nHost: {partes.netloc}\r\n'.encode()
+        latencias, erros = [], [0]
+        inicio = time.perf_counter()
+        fim = inicio + options['segundos']
+
+        async def cliente():
+            while time.perf_counter() < fim:
+                comeco = time.perf_counter()
+                try:
+                    leitor, escritor = await asyncio.open_connection(partes.hostname, partes.port or 80)
+                    try:
+                        escritor.write(cabecalho)
+                        await escritor.drain()
+                        if options['lento']:
+                            await asyncio.sleep(options['lento'])
+                        escritor.write(b'Connection: close\r\n\r\n')
+                        await escritor.drain()
+                        status = await leitor.readline()
+                        await leitor.read()
+                    finally:
+                        escritor.close()
+                except OSError:
+                    erros[0] += 1
+                    continue
+                if status.split(b' ')[1:2] == [b'200']:
+                    latencias.append(time.perf_counter() - comeco)
+                else:
+                    erros[0] += 1
+
+        await asyncio.gather(*(cliente() for _ in range(options['concorrencia'])))
+        return latencias, erros[0], time.perf_counter() - inicio
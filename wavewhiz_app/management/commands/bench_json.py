@@ -0,0 +1,74 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from wavewhiz_app import json_rapido
+from wavewhiz_app.benchmarks import banco_temporario, gerar_dados
+from wavewhiz_app.parsers import JSONRapidoParser
+from wavewhiz_app.renderers import JSONRapidoRenderer
+from wavewhiz_app.views import CarrinhoViewSet, ProdutoViewSet, UsuarioViewSet
+
+ROTAS = {'produtos': ProdutoViewSet, 'carrinhos': CarrinhoViewSet, 'usuarios': UsuarioViewSet}
+
+
+class Command(BaseCommand):
+    help = (
+        'Tempo de codificação (JSONRenderer x JSONRapidoRenderer) e de decodificação (JSONParser x '
+        'JSONRapidoParser) das listagens de /produtos/, /carrinhos/ e /usuarios/, num banco temporário '
+        'com dados sintéticos; confere que a saída é idêntica.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, default=500)
+        parser.add_argument('--repeticoes', type=int, default=50)
+
+    def handle(self, *args, **options):
+        if not json_rapido.ativo():
+            raise CommandError('orjson não instalado ou JSON_BACKEND diferente de "orjson".')
+        linhas, repeticoes = options['linhas'], options['repeticoes']
+        with banco_temporario():
+            admin, _ = gerar_dados({
+                'categorias': 5, 'usuarios': linhas, 'lojas': 10, 'produtos': linhas,
+                'carrinhos': linhas, 'itens_por_carrinho': 3,
+            })
+            listagens = {rota: self.listar(viewset, rota, admin) for rota, viewset in ROTAS.items()}
+
+        self.stdout.write(f'{"rota":11}{"KB":>8}  {"etapa":9}{"json ms":>10}{"orjson ms":>11}{"ganho":>8}')
+        for rota, dados in listagens.items():
+            padrao = JSONRenderer().render(dados)
+            if JSONRapidoRenderer().render(dados) != padrao:
+                raise CommandError(f'{rota}: saída diferente da do JSONRenderer.')
+            if JSONRapidoParser().parse(io.BytesIO(padrao)) != JSONParser().parse(io.BytesIO(padrao)):
+                raise CommandError(f'{rota}: leitura diferente da do JSONParser.')
+            etapas = {
+                'render': (lambda: JSONRenderer().render(dados), lambda: JSONRapidoRenderer().render(dados)),
+                'parse': (
+                    lambda: JSONParser().parse(io.BytesIO(padrao)),
+                    lambda: JSONRapidoParser().parse(io.BytesIO(padrao)),
+                ),
+            }
+            for etapa, (lento, rapido) in etapas.items():
+                antes, depois = self.medir(lento, repeticoes), self.medir(rapido, repeticoes)
+                self.stdout.write(
+                    f'{rota:11}{len(padrao) / 1024:8.0f}  {etapa:9}{antes * 1000:10.2f}{depois * 1000:11.2f}'
+                    f'{antes / depois:7.1f}x'
+                )
+
+    def listar(self, viewset, rota, admin):
+        # os dados que a listagem entrega ao renderer (sem paginação)
+        requisicao = APIRequestFactory().get(f'/{rota}/', HTTP_HOST='localhost')
+        force_authenticate(requisicao, user=admin)
+        return viewset.as_view({'get': 'list'}, pagination_class=None)(requisicao).data
+
+    def medir(self, funcao, repeticoes):
+        # melhor tempo entre as repetições
+        melhor = float('inf')
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            funcao()
+            melhor = min(melhor, time.perf_counter() - inicio)
+        return melhor
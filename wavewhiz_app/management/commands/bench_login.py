@@ -0,0 +1,51 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+# hasher padrão do Django (PBKDF2), usado antes de WAVEWHIZ_PASSWORD_HASHER
+HASHER_ANTERIOR = 'django.contrib.auth.hashers.PBKDF2PasswordHasher'
+SENHA = 'senha-de-benchmark'
+
+
+class Command(BaseCommand):
+    help = 'Mede logins por segundo (verificação de senha) por core e usando o pool de threads do login.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segundos', type=float, default=3.0, help='Duração de cada medição.')
+        parser.add_argument('--threads', type=int, default=settings.LOGIN_THREADS, help='Threads da medição com pool.')
+
+    def handle(self, *args, **options):
+        segundos, threads = options['segundos'], options['threads']
+        candidatos = [('antes', import_string(HASHER_ANTERIOR)())]
+        for posicao, hasher in enumerate(get_hashers()):
+            candidatos.append(('depois' if posicao == 0 else 'legado', hasher))
+
+        self.stdout.write(f'{"":8}{"algoritmo":16}{"logins/s por core":>20}{f"logins/s ({threads} threads)":>26}')
+        for rotulo, hasher in candidatos:
+            try:
+                encoded = hasher.encode(SENHA, hasher.salt())
+            except ValueError as erro:
+                # ex.: argon2-cffi não instalado
+                self.stdout.write(f'{rotulo:8}{hasher.algorithm:16}  indisponível: {erro}')
+                continue
+            por_core = self.medir(hasher, encoded, segundos, 1)
+            com_pool = self.medir(hasher, encoded, segundos, threads)
+            self.stdout.write(f'{rotulo:8}{hasher.algorithm:16}{por_core:20.1f}{com_pool:26.1f}')
+
+    def medir(self, hasher, encoded, segundos, threads):
+        def verificar(_):
+            logins = 0
+            fim = time.perf_counter() + segundos
+            while time.perf_counter() < fim:
+                hasher.verify(SENHA, encoded)
+                logins += 1
+            return logins
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            logins = sum(pool.map(verificar, range(threads)))
+        return logins / (time.perf_counter() - inicio)
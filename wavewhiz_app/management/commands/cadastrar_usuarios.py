@@ -0,0 +1,38 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from wavewhiz_app import cadastro_em_lote, importacao
+
+
+class Command(BaseCommand):
+    help = (
+        'Cadastra usuários de um arquivo CSV ou JSON Lines (nome, email, cpf, telefone, data_nascimento, '
+        'password, role) em lotes, com verificação de CPF/e-mail por lote e hashes num pool de processos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo')
+        parser.add_argument('--formato', choices=importacao.FORMATOS, help='Padrão: deduzido pela extensão do arquivo.')
+        parser.add_argument('--lote', type=int, default=cadastro_em_lote.TAMANHO_LOTE, help='Linhas por transação.')
+        parser.add_argument(
+            '--processos', type=int, default=settings.CADASTRO_PROCESSOS,
+            help='Processos para os hashes de senha (0: sem pool).',
+        )
+
+    def handle(self, *args, **options):
+        formato = options['formato'] or os.path.splitext(options['arquivo'])[1].lstrip('.').lower()
+        if formato == 'ndjson':
+            formato = 'jsonl'
+        if formato not in importacao.FORMATOS:
+            raise CommandError('Informe --formato csv ou jsonl.')
+
+        with open(options['arquivo'], encoding='utf-8-sig', newline='') as arquivo:
+            relatorio = cadastro_em_lote.cadastrar_usuarios(
+                importacao.ler_registros(arquivo, formato), tamanho_lote=options['lote'], processos=options['processos']
+            )
+
+        for erro in relatorio['erros']:
+            self.stderr.write(f"linha {erro['linha']}: {erro['erros']}")
+        self.stdout.write(self.style.SUCCESS(f"{relatorio['criados']} criados, {len(relatorio['erros'])} com erro."))
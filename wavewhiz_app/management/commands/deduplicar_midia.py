@@ -0,0 +1,59 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from wavewhiz_app import cache_respostas
+from wavewhiz_app.storage import ArmazenamentoPorConteudo
+
+
+class Command(BaseCommand):
+    help = 'Move as imagens enviadas antes do storage por conteúdo para blobs/, unificando arquivos repetidos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--remover-orfaos', action='store_true',
+            help='Apaga também os arquivos das pastas de upload e de blobs/ que nenhuma linha referencia.',
+        )
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ArmazenamentoPorConteudo):
+            raise CommandError('O storage padrão não é wavewhiz_app.storage.ArmazenamentoPorConteudo.')
+        antigos = {}
+        for model, campo in default_storage.campos():
+            nomes = model._default_manager.exclude(**{campo.name: ''}).exclude(**{f'{campo.name}__isnull': True})
+            for nome in nomes.values_list(campo.name, flat=True).distinct():
+                if default_storage.hash_do_nome(nome) is None:
+                    antigos.setdefault(nome, []).append((model, campo))
+
+        blobs = set()
+        for nome, campos in sorted(antigos.items()):
+            if not default_storage.exists(nome):
+                self.stderr.write(f'{nome}: arquivo não encontrado.')
+                continue
+            with default_storage.open(nome, 'rb') as arquivo:
+                novo = default_storage.save(nome, arquivo)
+            with transaction.atomic():
+                for model, campo in campos:
+                    model._default_manager.filter(**{campo.name: nome}).update(**{campo.name: novo})
+            default_storage.delete(nome)
+            blobs.add(novo)
+            self.stdout.write(f'{nome} -> {novo}')
+
+        if options['remover_orfaos']:
+            pastas = {campo.upload_to.rstrip('/') for _, campo in default_storage.campos() if isinstance(campo.upload_to, str)}
+            # blobs sem referência (delete() respeita a carência dos recém-gravados)
+            if default_storage.exists('blobs'):
+                pastas.update(f'blobs/{prefixo}' for prefixo in default_storage.listdir('blobs')[0])
+            for pasta in sorted(pastas):
+                if not default_storage.exists(pasta):
+                    continue
+                for arquivo in default_storage.listdir(pasta)[1]:
+                    nome = f'{pasta}/{arquivo}'
+                    if default_storage.referencias(nome) == 0:
+                        default_storage.delete(nome)
+                        if not default_storage.exists(nome):
+                            self.stdout.write(f'{nome}: órfão removido.')
+
+        for namespace in ('produtos', 'lojas'):
+            cache_respostas.invalidar_tudo(namespace)
+        self.stdout.write(f'{len(antigos)} arquivos migrados para {len(blobs)} blobs.')
@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wavewhiz_app import importacao
+from wavewhiz_app.models import Loja
+
+
+class Command(BaseCommand):
+    help = 'Exporta os produtos de uma loja em CSV ou JSON Lines, sem carregar o catálogo inteiro na memória.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('loja_id', type=int)
+        parser.add_argument('--formato', choices=importacao.FORMATOS, default='csv')
+        parser.add_argument('--saida', help='Arquivo de saída (padrão: stdout).')
+
+    def handle(self, *args, **options):
+        try:
+            loja = Loja.objects.get(pk=options['loja_id'])
+        except Loja.DoesNotExist:
+            raise CommandError(f"Loja {options['loja_id']} não encontrada.")
+        saida = open(options['saida'], 'w', encoding='utf-8', newline='') if options['saida'] else sys.stdout
+        try:
+            for bloco in importacao.exportar_produtos(loja, options['formato']):
+                saida.write(bloco)
+        finally:
+            if saida is not sys.stdout:
+                saida.close()
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from wavewhiz_app.benchmarks import SENHA_SINTETICA, gerar_dados, proporcoes
+
+
+class Command(BaseCommand):
+    help = (
+        'Preenche o banco configurado com dados sintéticos (usuários, lojas com categorias, produtos, '
+        'carrinhos e itens) na escala pedida, de 10 mil a 10 milhões de produtos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escala', type=int, default=10_000, help='Nº de produtos; os demais models seguem proporções fixas.')
+        for nome in ('categorias', 'usuarios', 'lojas', 'produtos', 'carrinhos', 'itens-por-carrinho'):
+            parser.add_argument(f'--{nome}', type=int, help='Sobrescreve a proporção padrão.')
+        parser.add_argument('--semente', type=int, default=0)
+
+    def handle(self, *args, **options):
+        quantidades = proporcoes(options['escala'])
+        for nome in quantidades:
+            if options.get(nome) is not None:
+                quantidades[nome] = options[nome]
+        inicio = time.perf_counter()
+        admin, _ = gerar_dados(quantidades, options['semente'], progresso=self.stdout.write)
+        self.stdout.write(
+            f'Concluído em {time.perf_counter() - inicio:.1f}s. Admin: {admin.email} / {SENHA_SINTETICA}'
+        )
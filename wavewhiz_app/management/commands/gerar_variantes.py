@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from wavewhiz_app import imagens
+from wavewhiz_app.models import Loja, Produto
+
+
+class Command(BaseCommand):
+    help = 'Gera as variantes (thumb, card, full) das imagens já enviadas de lojas e produtos.'
+
+    def handle(self, *args, **options):
+        for model in (Loja, Produto):
+            nomes = set(model.objects.exclude(imagem='').exclude(imagem__isnull=True).values_list('imagem', flat=True))
+            campo = model._meta.get_field('imagem')
+            for nome in sorted(nomes):
+                try:
+                    imagens.gerar_derivados(campo.storage, nome)
+                except (OSError, ValueError) as erro:
+                    self.stderr.write(f'{nome}: {erro}')
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {len(nomes)} imagens processadas.')
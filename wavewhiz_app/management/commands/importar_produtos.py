@@ -0,0 +1,38 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wavewhiz_app import importacao
+from wavewhiz_app.models import Loja
+
+
+class Command(BaseCommand):
+    help = 'Importa produtos de um arquivo CSV ou JSON Lines para uma loja, em lotes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('loja_id', type=int)
+        parser.add_argument('arquivo')
+        parser.add_argument('--formato', choices=importacao.FORMATOS, help='Padrão: deduzido pela extensão do arquivo.')
+        parser.add_argument('--lote', type=int, default=importacao.TAMANHO_LOTE, help='Linhas por transação.')
+
+    def handle(self, *args, **options):
+        try:
+            loja = Loja.objects.get(pk=options['loja_id'])
+        except Loja.DoesNotExist:
+            raise CommandError(f"Loja {options['loja_id']} não encontrada.")
+        formato = options['formato'] or os.path.splitext(options['arquivo'])[1].lstrip('.').lower()
+        if formato == 'ndjson':
+            formato = 'jsonl'
+        if formato not in importacao.FORMATOS:
+            raise CommandError('Informe --formato csv ou jsonl.')
+
+        with open(options['arquivo'], encoding='utf-8-sig', newline='') as arquivo:
+            relatorio = importacao.importar_produtos(
+                loja, importacao.ler_registros(arquivo, formato), tamanho_lote=options['lote']
+            )
+
+        for erro in relatorio['erros']:
+            self.stderr.write(f"linha {erro['linha']}: {erro['erros']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{relatorio['criados']} criados, {relatorio['atualizados']} atualizados, {len(relatorio['erros'])} com erro."
+        ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from wavewhiz_app import cache_respostas
+from wavewhiz_app.models import Loja
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula total_produtos, preco_min e preco_max das lojas a partir dos produtos (ex.: depois de '
+        'alterações feitas com update()/bulk_update fora da importação).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('lojas', nargs='*', type=int, help='IDs das lojas (padrão: todas).')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = Loja.recalcular_resumo(options['lojas'] or None)
+        cache_respostas.invalidar_tudo('lojas')
+        self.stdout.write(f'{total} lojas recalculadas.')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from wavewhiz_app.busca import backend
+from wavewhiz_app.models import Loja, Produto
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói os índices de busca textual de produtos e lojas.'
+
+    def handle(self, *args, **options):
+        busca = backend()
+        for model in (Produto, Loja):
+            busca.reconstruir(model)
+            self.stdout.write(f'{model._meta.verbose_name_plural}: índice reconstruído.')
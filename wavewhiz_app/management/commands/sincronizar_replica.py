@@ -0,0 +1,46 @@
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Substituto local da replicação: copia o banco SQLite primário para o arquivo da réplica '
+        '(WAVEWHIZ_REPLICA_SQLITE) com a API de backup do SQLite, uma vez ou a cada --intervalo segundos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alias', default='replica')
+        parser.add_argument('--intervalo', type=float, help='Repete a cópia a cada N segundos até ser interrompido.')
+
+    def handle(self, *args, **options):
+        alias = options['alias']
+        if alias not in settings.DATABASES or connections[alias].vendor != 'sqlite':
+            raise CommandError(f'Defina WAVEWHIZ_REPLICA_SQLITE (alias {alias!r} de SQLite).')
+        origem = str(settings.DATABASES['default']['NAME'])
+        destino = str(settings.DATABASES[alias]['NAME']).removeprefix('file:').split('?')[0]
+        while True:
+            inicio = time.perf_counter()
+            self.copiar(origem, destino)
+            self.stdout.write(f'{destino} sincronizada em {(time.perf_counter() - inicio) * 1000:.0f} ms')
+            if not options['intervalo']:
+                return
+            time.sleep(options['intervalo'])
+
+    def copiar(self, origem, destino):
+        # cópia consistente mesmo com escritas em andamento; o arquivo novo
+        # substitui o antigo de uma vez, então os leitores nunca veem uma cópia pela metade.
+        # Conexões já abertas continuam no arquivo antigo (apagado, mas aberto)
+        # até fecharem: por isso o alias da réplica usa CONN_MAX_AGE = 0
+        temporario = f'{destino}.sincronizando'
+        with sqlite3.connect(origem) as primario, sqlite3.connect(temporario) as copia:
+            primario.backup(copia)
+            # a réplica é aberta somente leitura, o que não combina com WAL
+            copia.execute('PRAGMA journal_mode=DELETE')
+        primario.close()
+        copia.close()
+        os.replace(temporario, destino)
@@ -0,0 +1,83 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from wavewhiz_app.forms import LojaAdminForm
+from wavewhiz_app.models import Usuario
+from wavewhiz_app.urls import router
+
+# (prefixo do router, query params, usuário) de cada consulta verificada; as
+# listagens sem filtro de staff podem varrer a tabela principal porque a
+# paginação por cursor para no LIMIT
+CENARIOS = (
+    ('produtos', {'loja': '1'}, 'cliente'),
+    ('lojas', {'empreendedor': '1'}, 'cliente'),
+    ('lojas', {'categoria': '1'}, 'cliente'),
+    ('carrinhos', {}, 'cliente'),
+    ('carrinhos', {'cliente': '1'}, 'staff'),
+    ('carrinhos', {'ordering': '-total'}, 'cliente'),
+    ('itens-carrinho', {}, 'cliente'),
+    ('usuarios', {}, 'cliente'),
+)
+# "SCAN tabela" sem índice; "SCAN tabela USING [COVERING] INDEX" não é varredura da tabela
+_VARREDURA = re.compile(r'\bSCAN (\w+)(?! USING (?:COVERING )?INDEX)(?:\s|$)')
+
+
+class Command(BaseCommand):
+    help = (
+        'Roda EXPLAIN QUERY PLAN nas consultas de listagem/detalhe de cada viewset (com os filtros usados '
+        'pelas rotas) e falha se alguma fizer varredura completa de tabela.'
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Este comando interpreta o EXPLAIN QUERY PLAN do SQLite.')
+        usuarios = {
+            'cliente': Usuario(pk=1, role='cliente'),
+            'staff': Usuario(pk=1, role='admin', is_staff=True),
+        }
+        falhas = []
+        for nome, queryset, permite_varredura in self.consultas(usuarios):
+            plano = queryset.explain()
+            varridas = set(_VARREDURA.findall(plano)) - ({queryset.model._meta.db_table} if permite_varredura else set())
+            situacao = self.style.ERROR('VARREDURA') if varridas else self.style.SUCCESS('ok')
+            self.stdout.write(f'{situacao} {nome}')
+            if varridas or options['verbosity'] > 1:
+                self.stdout.write('    ' + plano.replace('\n', '\n    '))
+            if varridas:
+                falhas.append(f'{nome}: {", ".join(sorted(varridas))}')
+        if falhas:
+            raise CommandError('Consultas com varredura completa de tabela:\n' + '\n'.join(falhas))
+
+    def consultas(self, usuarios):
+        # (nome, queryset, permite varrer a tabela principal)
+        viewsets = {prefixo: viewset for prefixo, viewset, _ in router.registry}
+        for prefixo, viewset in viewsets.items():
+            view = self.view(viewset, prefixo, {}, usuarios['staff'], 'list')
+            yield f'{prefixo} list', self.paginar(view), True
+            view = self.view(viewset, prefixo, {}, usuarios['staff'], 'retrieve')
+            yield f'{prefixo} retrieve', view.get_queryset().filter(pk=1), False
+        for prefixo, params, usuario in CENARIOS:
+            view = self.view(viewsets[prefixo], prefixo, params, usuarios[usuario], 'list')
+            nome = f'{prefixo} list {usuario} ' + '&'.join(f'{chave}={valor}' for chave, valor in params.items())
+            yield nome.strip(), self.paginar(view), False
+        queryset = LojaAdminForm().fields['empreendedor'].queryset
+        yield 'admin LojaAdminForm.empreendedor', queryset, False
+
+    def view(self, viewset, prefixo, params, usuario, acao):
+        requisicao = APIRequestFactory().get(f'/{prefixo}/', params)
+        force_authenticate(requisicao, user=usuario)
+        view = viewset(action_map={'get': acao}, format_kwarg=None, kwargs={}, args=())
+        view.request = view.initialize_request(requisicao)
+        return view
+
+    def paginar(self, view):
+        queryset = view.filter_queryset(view.get_queryset())
+        paginador = view.paginator
+        if paginador is None:
+            return queryset
+        ordenacao = paginador.get_ordering(view.request, queryset, view)
+        limite = getattr(view, 'page_size', None) or paginador.page_size
+        return queryset.order_by(*ordenacao)[:limite]
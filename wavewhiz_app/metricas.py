@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from . import cache_respostas
+
+logger = logging.getLogger(__name__)
+
+# limites (segundos) do histograma de duração das requisições
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_SOMAS = ('requisicoes', 'segundos', 'consultas', 'sql_segundos', 'python_segundos', 'render_segundos', 'bytes', 'n_mais_um')
+
+_lock = threading.Lock()
+# medição da requisição atual; sob ASGI o contexto acompanha as consultas que o
+# ORM assíncrono roda em outras threads (sync_to_async)
+_medicao_atual = ContextVar('medicao', default=None)
+_agregados = defaultdict(lambda: dict.fromkeys(_SOMAS, 0) | {'buckets': [0] * len(BUCKETS)})
+
+
+def limiar_n_mais_um():
+    return getattr(settings, 'METRICAS_N_MAIS_UM_LIMIAR', 10)
+
+
+def nome_da_view(view_func, metodo):
+    # ViewSets do DRF: 'CarrinhoViewSet.list'; views comuns: nome da função
+    classe = getattr(view_func, 'cls', None)
+    if classe is None:
+        return getattr(view_func, '__name__', type(view_func).__name__)
+    acoes = getattr(view_func, 'actions', None) or {}
+    return f'{classe.__name__}.{acoes.get(metodo.lower(), metodo.lower())}'
+
+
+class _Medicao:
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.view = None
+        self.consultas = 0
+        self.sql_segundos = 0.0
+        self.formatos = Counter()
+        self.fim_da_view = None
+        self.render_segundos = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper: o SQL vem com placeholders, então consultas iguais
+        # com parâmetros diferentes têm o mesmo formato
+        comeco = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_segundos += time.perf_counter() - comeco
+            self.consultas += 1
+            self.formatos[sql] += 1
+
+
+def medir_consulta(execute, sql, params, many, context):
+    # execute_wrapper de todas as conexões (ver signals.instalar_medicao)
+    medicao = _medicao_atual.get()
+    if medicao is None:
+        return execute(sql, params, many, context)
+    return medicao(execute, sql, params, many, context)
+
+
+def registrar(view, metodo, status, medicao, duracao, tamanho):
+    repetido, vezes = medicao.formatos.most_common(1)[0] if medicao.formatos else (None, 0)
+    n_mais_um = vezes > limiar_n_mais_um()
+    if n_mais_um:
+        logger.warning('Possível N+1 em %s: %d execuções de %s', view, vezes, repetido)
+    fim_da_view = medicao.fim_da_view or (medicao.inicio + duracao)
+    python = max(0.0, fim_da_view - medicao.inicio - medicao.sql_segundos)
+    with _lock:
+        agregado = _agregados[(view, metodo, status)]
+        agregado['requisicoes'] += 1
+        agregado['segundos'] += duracao
+        agregado['consultas'] += medicao.consultas
+        agregado['sql_segundos'] += medicao.sql_segundos
+        agregado['python_segundos'] += python
+        agregado['render_segundos'] += medicao.render_segundos
+        agregado['bytes'] += tamanho
+        agregado['n_mais_um'] += n_mais_um
+        for posicao, limite in enumerate(BUCKETS):
+            if duracao <= limite:
+                agregado['buckets'][posicao] += 1
+
+
+def limpar():
+    with _lock:
+        _agregados.clear()
+
+
+class MetricasMiddleware:
+    # Por requisição: view, nº de consultas e tempo de SQL (execute_wrapper),
+    # tempo de Python na view, tempo de renderização e tamanho da resposta.
+    # Os agregados ficam em memória, por processo, e saem em /metrics.
+    # Sob ASGI roda sem sair do event loop (as views assíncronas continuam
+    # sem ocupar uma thread).
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.assincrono = iscoroutinefunction(get_response)
+        if self.assincrono:
+            markcoroutinefunction(self)
+            # o Django adaptaria um process_view síncrono com sync_to_async
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.assincrono:
+            return self.__acall__(request)
+        if not self.ativo(request):
+            return self.get_response(request)
+        medicao = request._medicao = _Medicao()
+        token = _medicao_atual.set(medicao)
+        try:
+            response = self.get_response(request)
+        finally:
+            _medicao_atual.reset(token)
+        return self.registrar(request, response, medicao)
+
+    async def __acall__(self, request):
+        if not self.ativo(request):
+            return await self.get_response(request)
+        medicao = request._medicao = _Medicao()
+        token = _medicao_atual.set(medicao)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _medicao_atual.reset(token)
+        return self.registrar(request, response, medicao)
+
+    def ativo(self, request):
+        return getattr(settings, 'METRICAS_ATIVAS', True) and request.path != '/metrics'
+
+    def registrar(self, request, response, medicao):
+        duracao = time.perf_counter() - medicao.inicio
+        tamanho = 0 if response.streaming else len(response.content)
+        registrar(medicao.view or 'desconhecida', request.method, response.status_code, medicao, duracao, tamanho)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        medicao = getattr(request, '_medicao', None)
+        if medicao is not None:
+            medicao.view = nome_da_view(view_func, request.method)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return MetricasMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+
+    def process_template_response(self, request, response):
+        # chamado depois da view e antes de response.render()
+        medicao = getattr(request, '_medicao', None)
+        if medicao is not None:
+            medicao.fim_da_view = time.perf_counter()
+
+            def renderizado(response):
+                medicao.render_segundos = time.perf_counter() - medicao.fim_da_view
+
+            response.add_post_render_callback(renderizado)
+        return response
+
+
+def _linhas_prometheus():
+    with _lock:
+        agregados = {chave: dict(valor, buckets=list(valor['buckets'])) for chave, valor in _agregados.items()}
+
+    def rotulos(view, metodo, status, **extras):
+        pares = {'view': view, 'metodo': metodo, 'status': status, **extras}
+        return ','.join(f'{nome}="{valor}"' for nome, valor in pares.items())
+
+    metricas = (
+        ('wavewhiz_requisicoes_total', 'counter', 'requisicoes', 'Requisições atendidas.'),
+        ('wavewhiz_sql_consultas_total', 'counter', 'consultas', 'Consultas SQL executadas.'),
+        ('wavewhiz_sql_segundos_total', 'counter', 'sql_segundos', 'Tempo gasto em SQL.'),
+        ('wavewhiz_view_python_segundos_total', 'counter', 'python_segundos', 'Tempo na view fora do SQL (inclui serializers).'),
+        ('wavewhiz_render_segundos_total', 'counter', 'render_segundos', 'Tempo de renderização da resposta (JSON).'),
+        ('wavewhiz_resposta_bytes_total', 'counter', 'bytes', 'Bytes no corpo das respostas.'),
+        ('wavewhiz_n_mais_um_total', 'counter', 'n_mais_um', 'Requisições com a mesma consulta repetida acima do limiar.'),
+    )
+    for nome, tipo, campo, ajuda in metricas:
+        yield f'# HELP {nome} {ajuda}'
+        yield f'# TYPE {nome} {tipo}'
+        for (view, metodo, status), valor in sorted(agregados.items()):
+            yield f'{nome}{{{rotulos(view, metodo, status)}}} {valor[campo]}'
+
+    nome = 'wavewhiz_requisicao_segundos'
+    yield f'# HELP {nome} Duração das requisições.'
+    yield f'# TYPE {nome} histogram'
+    for (view, metodo, status), valor in sorted(agregados.items()):
+        # os buckets já são cumulativos (ver registrar)
+        for limite, quantidade in zip(BUCKETS, valor['buckets']):
+            yield f'{nome}_bucket{{{rotulos(view, metodo, status, le=limite)}}} {quantidade}'
+        yield f'{nome}_bucket{{{rotulos(view, metodo, status, le="+Inf")}}} {valor["requisicoes"]}'
+        yield f'{nome}_sum{{{rotulos(view, metodo, status)}}} {valor["segundos"]}'
+        yield f'{nome}_count{{{rotulos(view, metodo, status)}}} {valor["requisicoes"]}'
+
+    estatisticas = cache_respostas.estatisticas()
+    for campo in ('hits', 'misses'):
+        yield f'# TYPE wavewhiz_cache_respostas_{campo}_total counter'
+        yield f'wavewhiz_cache_respostas_{campo}_total {estatisticas[campo]}'
+
+
+def metricas(request):
+    token = getattr(settings, 'METRICAS_TOKEN', None)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    corpo = '\n'.join(_linhas_prometheus()) + '\n'
+    return HttpResponse(corpo, content_type='text/plain; version=0.0.4; charset=utf-8')
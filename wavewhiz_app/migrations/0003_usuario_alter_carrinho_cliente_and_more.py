@@ -10,6 +10,11 @@ class Migration(migrations.Migration):
         ('wavewhiz_app', '0002_categorialoja_remove_produtos_empreendedor_and_more'),
     ]
 
+    # o admin referencia AUTH_USER_MODEL, que só passa a existir aqui
+    run_before = [
+        ('admin', '0001_initial'),
+    ]
+
     operations = [
         migrations.CreateModel(
             name='Usuario',
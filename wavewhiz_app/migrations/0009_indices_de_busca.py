@@ -0,0 +1,28 @@
+from django.db import migrations
+
+from wavewhiz_app.busca import backend
+
+MODELS_PESQUISAVEIS = ('Produto', 'Loja')
+
+
+def criar_indices(apps, schema_editor):
+    busca = backend(schema_editor.connection)
+    for nome in MODELS_PESQUISAVEIS:
+        busca.reconstruir(apps.get_model('wavewhiz_app', nome))
+
+
+def remover_indices(apps, schema_editor):
+    busca = backend(schema_editor.connection)
+    for nome in MODELS_PESQUISAVEIS:
+        busca.remover_indice(apps.get_model('wavewhiz_app', nome))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wavewhiz_app', '0008_remove_produto_categoria'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indices, remover_indices),
+    ]
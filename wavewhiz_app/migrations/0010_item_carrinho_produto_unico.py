@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:07
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def juntar_itens_duplicados(apps, schema_editor):
+    # itens repetidos do mesmo produto no mesmo carrinho viram um só, somando as quantidades
+    ItemCarrinho = apps.get_model('wavewhiz_app', 'ItemCarrinho')
+    duplicados = (
+        ItemCarrinho.objects.values('carrinho_id', 'produto_id')
+        .annotate(itens=Count('id'), primeiro=Min('id'), quantidade_total=Sum('quantidade'))
+        .filter(itens__gt=1)
+    )
+    for grupo in duplicados:
+        ItemCarrinho.objects.filter(pk=grupo['primeiro']).update(quantidade=grupo['quantidade_total'])
+        ItemCarrinho.objects.filter(
+            carrinho_id=grupo['carrinho_id'], produto_id=grupo['produto_id']
+        ).exclude(pk=grupo['primeiro']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wavewhiz_app', '0009_indices_de_busca'),
+    ]
+
+    operations = [
+        migrations.RunPython(juntar_itens_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='itemcarrinho',
+            constraint=models.UniqueConstraint(fields=('carrinho', 'produto'), name='item_carrinho_produto_unico'),
+        ),
+    ]
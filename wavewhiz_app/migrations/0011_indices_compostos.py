@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wavewhiz_app', '0010_item_carrinho_produto_unico'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carrinho',
+            index=models.Index(fields=['cliente', 'finalizado', 'criado_em'], name='carrinho_cliente_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(fields=['role'], name='usuario_role_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:26
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def preencher_resumo(apps, schema_editor):
+    # mesmo cálculo de Loja.recalcular_resumo, com os models históricos
+    Loja = apps.get_model('wavewhiz_app', 'Loja')
+    Produto = apps.get_model('wavewhiz_app', 'Produto')
+    produtos = Produto.objects.filter(loja=OuterRef('pk')).order_by().values('loja')
+    Loja.objects.update(
+        total_produtos=Coalesce(Subquery(produtos.annotate(total=Count('pk')).values('total')), 0),
+        preco_min=Subquery(produtos.annotate(valor=Min('preco')).values('valor')),
+        preco_max=Subquery(produtos.annotate(valor=Max('preco')).values('valor')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wavewhiz_app', '0011_indices_compostos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loja',
+            name='preco_max',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='loja',
+            name='preco_min',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='loja',
+            name='total_produtos',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(preencher_resumo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+from wavewhiz_app.busca import PostgresBackend
+
+MODELS_PESQUISAVEIS = ('Produto', 'Loja')
+
+
+def criar_indices(apps, schema_editor):
+    # no Postgres a 0009 só instalava o unaccent; o índice GIN vem agora
+    # (no SQLite o índice FTS5 da 0009 continua valendo)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    busca = PostgresBackend(schema_editor.connection)
+    for nome in MODELS_PESQUISAVEIS:
+        busca.criar_indice(apps.get_model('wavewhiz_app', nome))
+
+
+def remover_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    busca = PostgresBackend(schema_editor.connection)
+    for nome in MODELS_PESQUISAVEIS:
+        busca.remover_indice(apps.get_model('wavewhiz_app', nome))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wavewhiz_app', '0012_resumo_dos_produtos_da_loja'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indices, remover_indices),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wavewhiz_app', '0013_indice_gin_busca_postgres'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersaoIndice',
+            fields=[
+                ('nome', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('versao', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
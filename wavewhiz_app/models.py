@@ -1,8 +1,11 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, Max, Min, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from datetime import date
+from functools import partial
 
 cpf_validator = RegexValidator(
     regex=r'^\d{11}$',
@@ -34,6 +37,12 @@ class CategoriaLoja(models.Model):
     def __str__(self):
         return self.nome
 
+class VersaoIndice(models.Model):
+    # versão de um índice mantido em memória pelos processos (ver
+    # indice_categorias): fica no banco para valer entre processos
+    nome = models.CharField(max_length=50, primary_key=True)
+    versao = models.BigIntegerField(default=0)
+
 class UsuarioManager(BaseUserManager):
     def create_user(self, email, password=None, role='cliente', **extra_fields):
         if not email:
@@ -95,6 +104,12 @@ class Usuario(AbstractBaseUser):
 
     objects = UsuarioManager()
 
+    class Meta:
+        indexes = [
+            # LojaAdminForm filtra os empreendedores
+            models.Index(fields=['role'], name='usuario_role_idx'),
+        ]
+
     def __str__(self):
         return f"{self.nome} ({self.role})"
 
@@ -114,7 +129,17 @@ class Usuario(AbstractBaseUser):
     def has_module_perms(self, app_label):
         return bool(self.is_superuser)
 
-class Loja(models.Model):
+class ImagemOriginalMixin:
+    # guarda o nome da imagem lida do banco para liberar o arquivo antigo
+    # quando ela é trocada (ver signals.liberar_imagem_substituida)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        if 'imagem' in field_names:
+            instancia._imagem_original = values[field_names.index('imagem')]
+        return instancia
+
+class Loja(ImagemOriginalMixin, models.Model):
     empreendedor = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='lojas')  # on_delete CASCADE garante deleção em cascata
     nome = models.CharField(max_length=150)
     categorias = models.ManyToManyField(CategoriaLoja, blank=True, related_name='lojas')
@@ -125,6 +150,13 @@ class Loja(models.Model):
     numero = models.CharField(max_length=20, null=True, blank=True)
     complemento = models.CharField(max_length=150, null=True, blank=True)
     cpf_cnpj = models.CharField(max_length=14, validators=[cpf_cnpj_validator], null=True, blank=True)
+    # resumo dos produtos, mantido pelo Produto.save e por signals.atualizar_resumo_da_loja
+    # (reconstruído por recalcular_resumo_lojas)
+    total_produtos = models.PositiveIntegerField(default=0, editable=False)
+    preco_min = models.DecimalField(max_digits=10, decimal_places=2, null=True, editable=False)
+    preco_max = models.DecimalField(max_digits=10, decimal_places=2, null=True, editable=False)
+
+    CAMPOS_RESUMO = ('total_produtos', 'preco_min', 'preco_max')
 
     class Meta:
         verbose_name = "Loja"
@@ -133,11 +165,51 @@ class Loja(models.Model):
     def __str__(self):
         return self.nome
 
+    def save(self, *args, **kwargs):
+        # uma loja carregada antes de uma alteração nos produtos não pode
+        # sobrescrever o resumo com valores antigos
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.name not in self.CAMPOS_RESUMO
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def somar_produto(cls, pk, preco):
+        # produto novo: o resumo é atualizado sem reler os produtos da loja
+        valor = Value(preco, output_field=models.DecimalField(max_digits=10, decimal_places=2))
+        return cls.objects.filter(pk=pk).update(
+            total_produtos=F('total_produtos') + 1,
+            preco_min=Least(Coalesce('preco_min', valor), valor),
+            preco_max=Greatest(Coalesce('preco_max', valor), valor),
+        )
+
+    @classmethod
+    def subtrair_produto(cls, pk, preco):
+        # produto removido com preço estritamente entre o mínimo e o máximo:
+        # a faixa não muda. Devolve 0 (nada atualizado) nos outros casos
+        return cls.objects.filter(pk=pk, preco_min__lt=preco, preco_max__gt=preco).update(
+            total_produtos=F('total_produtos') - 1,
+        )
+
+    @classmethod
+    def recalcular_resumo(cls, pks=None):
+        # recalcula o resumo das lojas indicadas (ou de todas) a partir dos
+        # produtos, em uma única UPDATE
+        produtos = Produto.objects.filter(loja=OuterRef('pk')).order_by().values('loja')
+        lojas = cls.objects.all() if pks is None else cls.objects.filter(pk__in=pks)
+        return lojas.update(
+            total_produtos=Coalesce(Subquery(produtos.annotate(total=Count('pk')).values('total')), 0),
+            preco_min=Subquery(produtos.annotate(valor=Min('preco')).values('valor')),
+            preco_max=Subquery(produtos.annotate(valor=Max('preco')).values('valor')),
+        )
+
     def clean(self):
         if self.empreendedor.role != 'empreendedor':
             raise ValidationError("O usuário deve ter role 'empreendedor' para criar uma loja.")
 
-class Produto(models.Model):
+class Produto(ImagemOriginalMixin, models.Model):
     loja = models.ForeignKey(Loja, on_delete=models.CASCADE, related_name='produtos')
     nome = models.CharField(max_length=150)
     preco = models.DecimalField(max_digits=10, decimal_places=2)
@@ -152,6 +224,27 @@ class Produto(models.Model):
     def __str__(self):
         return f"{self.nome} - {self.loja.nome}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # loja e preço lidos do banco, para saber se o resumo da loja muda no save
+        if 'loja_id' in field_names and 'preco' in field_names:
+            instancia._resumo_original = (values[field_names.index('loja_id')], values[field_names.index('preco')])
+        return instancia
+
+    def save(self, *args, **kwargs):
+        # o resumo da loja (total_produtos, preco_min, preco_max) muda na mesma transação
+        novo = self._state.adding
+        original = getattr(self, '_resumo_original', None)
+        self._lojas_alteradas = {self.loja_id} | ({original[0]} if original else set())
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if novo:
+                Loja.somar_produto(self.loja_id, self.preco)
+            elif original != (self.loja_id, self.preco):
+                Loja.recalcular_resumo(self._lojas_alteradas)
+        self._resumo_original = (self.loja_id, self.preco)
+
 class MetodoPagamento(models.Model):
     nome = models.CharField(max_length=40)
 
@@ -162,30 +255,148 @@ class MetodoPagamento(models.Model):
     def __str__(self):
         return self.nome
 
+class ErroCheckout(Exception):
+    pass
+
+class CarrinhoJaFinalizado(ErroCheckout):
+    pass
+
+class CarrinhoVazio(ErroCheckout):
+    pass
+
+class EstoqueInsuficiente(ErroCheckout):
+    def __init__(self, produtos):
+        super().__init__('Estoque insuficiente.')
+        self.produtos = produtos
+
+class CarrinhoQuerySet(models.QuerySet):
+    def com_totais(self):
+        # total e quantidade de itens agregados no banco, permitindo filtrar
+        # e ordenar por eles
+        valor = models.DecimalField(max_digits=12, decimal_places=2)
+        return self.annotate(
+            valor_total=Coalesce(
+                Sum(F('itens__quantidade') * F('itens__produto__preco'), output_field=valor),
+                Value(0),
+                output_field=valor,
+            ),
+            quantidade_itens=Count('itens'),
+        )
+
 class Carrinho(models.Model):
     cliente = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='carrinhos')  # on_delete CASCADE garante deleção em cascata
     metodo_pagamento = models.ForeignKey(MetodoPagamento, on_delete=models.SET_NULL, null=True)
     criado_em = models.DateTimeField(auto_now_add=True)
     finalizado = models.BooleanField(default=False)
 
+    objects = CarrinhoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # carrinhos de um cliente (abertos/finalizados), do mais recente ao mais antigo
+            models.Index(fields=['cliente', 'finalizado', 'criado_em'], name='carrinho_cliente_idx'),
+        ]
+
     def __str__(self):
         return f'Carrinho {self.pk} - {self.cliente.nome}'
 
-    def total(self):                 
+    def total(self):
+        # total agregado no banco (ver CarrinhoQuerySet.com_totais)
+        total = getattr(self, 'valor_total', None)
+        if total is not None:
+            return total
+        # usa os itens pré-carregados (prefetch) quando disponíveis
         return sum(item.subtotal() for item in self.itens.all())
 
+    def finalizar(self):
+        with transaction.atomic():
+            # a primeira escrita da transação marca o carrinho, então dois
+            # checkouts simultâneos do mesmo carrinho não passam daqui
+            if not Carrinho.objects.filter(pk=self.pk, finalizado=False).update(finalizado=True):
+                raise CarrinhoJaFinalizado('Carrinho já finalizado.')
+            quantidades = dict(
+                self.itens.values('produto_id').annotate(total=Sum('quantidade')).values_list('produto_id', 'total')
+            )
+            if not quantidades:
+                raise CarrinhoVazio('Carrinho vazio.')
+            # um único UPDATE condicional para todos os produtos:
+            # estoque = estoque - n WHERE estoque >= n
+            necessario = Case(
+                *[When(pk=produto_id, then=Value(total)) for produto_id, total in quantidades.items()],
+                output_field=models.PositiveIntegerField(),
+            )
+            atualizados = Produto.objects.filter(pk__in=quantidades, estoque__gte=necessario).update(
+                estoque=F('estoque') - necessario
+            )
+            faltando = atualizados != len(quantidades)
+            if faltando:
+                # desfaz a transação inteira, inclusive a marcação do carrinho
+                transaction.set_rollback(True)
+            else:
+                # o update() não dispara signals: as respostas em cache de
+                # /produtos/ (que trazem o estoque) são invalidadas após o commit
+                from . import cache_respostas
+
+                transaction.on_commit(partial(cache_respostas.invalidar, 'produtos', *quantidades))
+        if faltando:
+            produtos = Produto.objects.filter(pk__in=quantidades).values('id', 'nome', 'estoque')
+            raise EstoqueInsuficiente([
+                {**produto, 'quantidade': quantidades[produto['id']]}
+                for produto in produtos if produto['estoque'] < quantidades[produto['id']]
+            ])
+        self.finalizado = True
+
+    def adicionar_itens(self, quantidades):
+        # upsert em lote de {produto_id: quantidade}: soma à quantidade já existente
+        with transaction.atomic():
+            Carrinho.objects.select_for_update().only('pk').get(pk=self.pk)
+            atuais = dict(self.itens.filter(produto_id__in=quantidades).values_list('produto_id', 'quantidade'))
+            ItemCarrinho.objects.bulk_create(
+                [
+                    ItemCarrinho(carrinho=self, produto_id=produto_id, quantidade=atuais.get(produto_id, 0) + quantidade)
+                    for produto_id, quantidade in quantidades.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['carrinho', 'produto'],
+                update_fields=['quantidade'],
+            )
+
+    def quantidade_de_itens(self):
+        quantidade = getattr(self, 'quantidade_itens', None)
+        if quantidade is not None:
+            return quantidade
+        return len(self.itens.all())
+
+class ItemCarrinhoQuerySet(models.QuerySet):
+    def com_subtotal(self):
+        # só a anotação: o produto é carregado apenas se o serializer o expande
+        return self.annotate(
+            subtotal_calculado=ExpressionWrapper(
+                F('quantidade') * F('produto__preco'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            )
+        )
+
 class ItemCarrinho(models.Model):
     carrinho = models.ForeignKey(Carrinho, on_delete=models.CASCADE, related_name='itens')  
     produto = models.ForeignKey(Produto, on_delete=models.CASCADE)
     quantidade = models.PositiveIntegerField(default=1)
 
+    objects = ItemCarrinhoQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Item do Carrinho"
         verbose_name_plural = "Itens do Carrinho"
+        constraints = [
+            models.UniqueConstraint(fields=['carrinho', 'produto'], name='item_carrinho_produto_unico'),
+        ]
 
     def __str__(self):
         return f"{self.quantidade}x {self.produto.nome}"
 
     def subtotal(self):
-        return self.quantidade * self.produto.preco
+        # subtotal calculado no banco (ver ItemCarrinhoQuerySet.com_subtotal)
+        subtotal = getattr(self, 'subtotal_calculado', None)
+        if subtotal is not None:
+            return subtotal
         return self.quantidade * self.produto.preco
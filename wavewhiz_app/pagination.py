@@ -0,0 +1,22 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PaginacaoPorCursor(CursorPagination):
+    # paginação keyset: a página seguinte é filtrada pela posição do cursor
+    # (coluna indexada) em vez de OFFSET, então páginas profundas custam o
+    # mesmo que a primeira
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # cada viewset pode definir seu próprio page_size
+        self.page_size = getattr(view, 'page_size', None) or self.page_size
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        # respeita uma ordenação explícita feita pela view
+        # (ex.: ?ordering=-total em /carrinhos/); o último campo deve ser único
+        if queryset.query.order_by:
+            return tuple(queryset.query.order_by)
+        return super().get_ordering(request, queryset, view)
@@ -0,0 +1,20 @@
+import io
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from . import json_rapido
+
+
+class JSONRapidoParser(JSONParser):
+    # mesmo resultado do JSONParser, decodificado pelo orjson quando possível;
+    # o que o orjson recusa (inclusive JSON inválido) passa pelo JSONParser
+    def parse(self, stream, media_type=None, parser_context=None):
+        codificacao = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if not json_rapido.ativo() or codificacao.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        corpo = stream.read()
+        try:
+            return json_rapido.loads(corpo)
+        except ValueError:
+            return super().parse(io.BytesIO(corpo), media_type, parser_context)
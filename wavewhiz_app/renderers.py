@@ -0,0 +1,50 @@
+from rest_framework.renderers import JSONRenderer
+
+from . import json_rapido
+
+
+class JSONRapidoRenderer(JSONRenderer):
+    # mesma saída do JSONRenderer, codificada pelo orjson quando possível (ver json_rapido)
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        compativel = self.compact and not self.ensure_ascii and not self.get_indent(accepted_media_type, renderer_context or {})
+        if data is not None and compativel:
+            try:
+                return json_rapido.dumps(data)
+            except TypeError:
+                pass
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+# render_lotes(lotes) recebe listas já serializadas (ex.: blocos de
+# queryset.iterator()) e devolve um gerador de bytes para StreamingHttpResponse;
+# a saída é a mesma do render() da lista inteira.
+class JSONEmStreamingRenderer(JSONRapidoRenderer):
+    def render_lotes(self, lotes, accepted_media_type=None, renderer_context=None):
+        yield b'['
+        primeiro = True
+        for lote in lotes:
+            if not lote:
+                continue
+            # "[a,b]" de cada bloco, sem os colchetes
+            corpo = self.render(lote, accepted_media_type, renderer_context).strip()[1:-1]
+            yield corpo if primeiro else b',' + corpo
+            primeiro = False
+        yield b']'
+
+
+class NDJSONRenderer(JSONRapidoRenderer):
+    # um objeto JSON por linha (Accept: application/x-ndjson ou ?format=ndjson)
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        itens = data if isinstance(data, list) else [data]
+        # sem indentação: cada objeto precisa caber numa linha
+        render = super().render
+        return b''.join(render(item) + b'\n' for item in itens)
+
+    def render_lotes(self, lotes, accepted_media_type=None, renderer_context=None):
+        for lote in lotes:
+            yield self.render(lote)
@@ -0,0 +1,121 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+# réplica escolhida para a requisição atual (None: tudo no primário)
+_replica = ContextVar('replica', default=None)
+
+# leituras que podem ir para uma réplica: ações de leitura destes models
+MODELOS_EM_REPLICA = {'wavewhiz_app.produto', 'wavewhiz_app.loja', 'wavewhiz_app.categorialoja', 'wavewhiz_app.metodopagamento'}
+ACOES_EM_REPLICA = {'list', 'retrieve'}
+COOKIE_PRIMARIO = 'wavewhiz_primario'
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def lendo_da_replica():
+    return _replica.get() is not None
+
+
+@contextmanager
+def usar_replica(alias):
+    token = _replica.set(alias)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def em_replica(view):
+    # marca views comuns (ex.: as views assíncronas do catálogo) como só leitura
+    view.leitura_em_replica = True
+    return view
+
+
+def leitura_elegivel(view_func, metodo):
+    if metodo not in ('GET', 'HEAD'):
+        return False
+    if getattr(view_func, 'leitura_em_replica', False):
+        return True
+    classe = getattr(view_func, 'cls', None)
+    queryset = getattr(classe, 'queryset', None)
+    if queryset is None:
+        return False
+    acao = (getattr(view_func, 'actions', None) or {}).get(metodo.lower())
+    return acao in ACOES_EM_REPLICA and queryset.model._meta.label_lower in MODELOS_EM_REPLICA
+
+
+class RoteadorReplicas:
+    # escritas sempre no primário; leituras só vão para uma réplica dentro de
+    # uma requisição marcada pelo ReplicaMiddleware
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # as réplicas recebem o schema do primário pela replicação
+        return db not in replicas()
+
+
+class ReplicaMiddleware:
+    # Leituras elegíveis vão para uma réplica, exceto logo depois de uma escrita
+    # do mesmo cliente: uma escrita bem-sucedida grava um cookie que mantém as
+    # leituras no primário por REPLICA_JANELA_PRIMARIO segundos (a réplica pode
+    # estar atrasada), para o cliente ler o que acabou de escrever.
+    # Sob ASGI roda no event loop, sem sync_to_async.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.assincrono = iscoroutinefunction(get_response)
+        if self.assincrono:
+            markcoroutinefunction(self)
+            # o Django adaptaria um process_view síncrono com sync_to_async
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.assincrono:
+            return self.__acall__(request)
+        token = _replica.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            _replica.reset(token)
+        return self.marcar_escrita(request, response)
+
+    async def __acall__(self, request):
+        token = _replica.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _replica.reset(token)
+        return self.marcar_escrita(request, response)
+
+    def marcar_escrita(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            response.set_cookie(
+                COOKIE_PRIMARIO, '1', max_age=settings.REPLICA_JANELA_PRIMARIO, httponly=True, samesite='Lax'
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if COOKIE_PRIMARIO not in request.COOKIES and leitura_elegivel(view_func, request.method):
+            _replica.set(random.choice(replicas()))
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        # aguardado na mesma task da view: a réplica escolhida vale para ela
+        return ReplicaMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
@@ -1,24 +1,147 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Prefetch
+from django.urls import reverse
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from . import estado_carrinhos, imagens
 from .models import Usuario, Produto, MetodoPagamento, Carrinho, ItemCarrinho, Loja, CategoriaLoja
 
+
+def _arvore(valor):
+    # "a,b.c,b.d" -> {'a': None, 'b': {'c': None, 'd': None}}; None: sem restrição abaixo
+    if valor is None:
+        return None
+    raiz = {}
+    for caminho in valor.split(','):
+        nomes = [nome.strip() for nome in caminho.split('.')]
+        if not all(nomes):
+            continue
+        no = raiz
+        for nome in nomes[:-1]:
+            if nome in no and no[nome] is None:
+                break
+            no = no.setdefault(nome, {})
+        else:
+            no[nomes[-1]] = None
+    return raiz
+
+
+class CamposDinamicosMixin:
+    # Em leituras, ?fields=a,b.c limita a resposta aos campos pedidos (b.c:
+    # campo c da relação b) e ?expand=b,b.d escolhe as relações serializadas
+    # por inteiro; as demais saem como pk. Sem ?expand= valem as
+    # expansoes_padrao de cada nível. Escritas devolvem o serializer completo.
+    expansoes = {}
+    expansoes_padrao = ()
+    # campo calculado -> colunas do model que ele lê (ver preparar_queryset)
+    dependencias = {}
+
+    def __init__(self, *args, selecao=None, **kwargs):
+        self._selecao = selecao
+        super().__init__(*args, **kwargs)
+
+    def lendo(self):
+        request = self.context.get('request')
+        return request is not None and request.method in ('GET', 'HEAD')
+
+    def selecao(self):
+        # (campos, expansões) deste nível; None: todos os campos / expansões padrão
+        if self._selecao is not None:
+            return self._selecao
+        if not self.lendo():
+            return None, None
+        request = self.context['request']
+        params = getattr(request, 'query_params', request.GET)
+        return _arvore(params.get('fields') or None), _arvore(params.get('expand'))
+
+    def get_fields(self):
+        campos = super().get_fields()
+        selecionados, expandir = self.selecao()
+        for nome, classe in self.expansoes.items():
+            if nome not in campos:
+                continue
+            sub_campos = (selecionados or {}).get(nome)
+            if expandir is None:
+                expandido, sub_expandir = nome in self.expansoes_padrao, None
+            else:
+                expandido, sub_expandir = nome in expandir, expandir.get(nome) or {}
+            # pedir campos de uma relação (?fields=b.c) também a expande
+            if expandido or sub_campos:
+                relacao = self.Meta.model._meta.get_field(nome)
+                campos[nome] = classe(
+                    many=relacao.many_to_many or relacao.one_to_many, read_only=True, selecao=(sub_campos, sub_expandir)
+                )
+        if selecionados is not None:
+            campos = {nome: campo for nome, campo in campos.items() if nome in selecionados}
+        return campos
+
+    def anotar(self, queryset):
+        # anotações exigidas pelos campos gerados
+        return queryset
+
+
+def preparar_queryset(queryset, serializer, extras=(), colunas=None):
+    # Carrega só o que o serializer vai gerar: anotações dos campos calculados,
+    # only() das colunas (só em leituras, para um save() não perder campos) e
+    # um Prefetch, preparado do mesmo jeito, por relação serializada.
+    serializer = getattr(serializer, 'child', serializer)
+    if not isinstance(serializer, CamposDinamicosMixin):
+        # relação que sai como lista de pks
+        return queryset.only(queryset.model._meta.pk.name, *extras) if colunas else queryset
+    if colunas is None:
+        colunas = serializer.lendo()
+    opcoes = queryset.model._meta
+    queryset = serializer.anotar(queryset)
+    carregar, prefetches = {opcoes.pk.attname, *extras}, []
+    for nome, campo in serializer.fields.items():
+        if campo.write_only:
+            continue
+        carregar.update(serializer.dependencias.get(nome, ()))
+        try:
+            relacao = opcoes.get_field(campo.source)
+        except FieldDoesNotExist:
+            continue
+        if relacao.concrete and not relacao.many_to_many:
+            carregar.add(relacao.attname)
+        if not relacao.is_relation or (relacao.many_to_one and not isinstance(campo, CamposDinamicosMixin)):
+            continue
+        aninhado = getattr(campo, 'child_relation', campo)
+        chave = (relacao.field.attname,) if relacao.one_to_many else ()
+        relacionados = relacao.related_model._default_manager.all()
+        prefetches.append(Prefetch(campo.source, queryset=preparar_queryset(relacionados, aninhado, chave, colunas)))
+    if colunas:
+        queryset = queryset.only(*carregar)
+    return queryset.prefetch_related(*prefetches)
+
+
+def imagem_variantes(serializer, obj, rota):
+    if not obj.imagem:
+        return None
+    urls = imagens.urls_prontas(obj.imagem)
+    if urls is None:
+        # ainda não geradas: a rota redireciona para a variante quando estiver pronta
+        urls = {variante: reverse(rota, kwargs={'pk': obj.pk, 'variante': variante}) for variante in imagens.VARIANTES}
+    request = serializer.context.get('request')
+    if request is not None:
+        urls = {variante: request.build_absolute_uri(url) for variante, url in urls.items()}
+    return urls
+
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     username_field = 'email'
     email = serializers.EmailField()
 
     def validate(self, attrs):
-        email = attrs.get('email') or attrs.get('username')
-        password = attrs.get('password')
-        try:
-            user = Usuario.objects.get(email=email)
-        except Usuario.DoesNotExist:
-            raise serializers.ValidationError("Credenciais inválidas")
-
-        if not user.check_password(password):
+        # mesmo caminho do login do admin (EmailBackend), que também refaz
+        # o hash da senha quando o hasher preferido muda
+        email, password = attrs.get('email') or attrs.get('username'), attrs.get('password')
+        user = authenticate(request=self.context.get('request'), email=email, password=password)
+        if user is None:
+            # o EmailBackend recusa usuários inativos mesmo com a senha certa
+            inativo = Usuario.objects.filter(email=email).first()
+            if inativo is not None and not inativo.is_active and inativo.check_password(password):
+                raise serializers.ValidationError("Usuário inativo")
             raise serializers.ValidationError("Credenciais inválidas")
-        if not getattr(user, 'is_active', True):
-            raise serializers.ValidationError("Usuário inativo")
 
         refresh = self.get_token(user)
         return {
@@ -26,7 +149,14 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
             'access': str(refresh.access_token),
         }
 
-class UsuarioSerializer(serializers.ModelSerializer):
+def normalizar_cpf(value):
+    # normaliza removendo caracteres não numéricos
+    digits = ''.join(ch for ch in value if ch.isdigit())
+    if len(digits) != 11:
+        raise serializers.ValidationError('CPF precisa conter 11 dígitos.')
+    return digits
+
+class UsuarioSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     # aceitar CPF com pontos/traços no input; normalizar antes da validação do campo do modelo
     cpf = serializers.CharField(required=False, allow_blank=True, max_length=18)
     data_nascimento = serializers.DateField(format='%d/%m/%Y', input_formats=['%d/%m/%Y', '%Y-%m-%d'])
@@ -39,10 +169,7 @@ class UsuarioSerializer(serializers.ModelSerializer):
     def validate_cpf(self, value):
         if not value:
             return value
-        # normaliza removendo caracteres não numéricos
-        digits = ''.join(ch for ch in value if ch.isdigit())
-        if len(digits) != 11:
-            raise serializers.ValidationError('CPF precisa conter 11 dígitos.')
+        digits = normalizar_cpf(value)
         # valida unicidade (permitir atualizar o próprio registro)
         qs = Usuario.objects.filter(cpf=digits)
         if self.instance:
@@ -68,18 +195,40 @@ class UsuarioSerializer(serializers.ModelSerializer):
         return instance
 
 
-class CategoriaLojaSerializer(serializers.ModelSerializer):
+class UsuarioLoteSerializer(serializers.ModelSerializer):
+    # uma linha do cadastro em lote; a unicidade de CPF e e-mail é verificada
+    # para o lote inteiro em cadastro_em_lote, não linha a linha
+    cpf = serializers.CharField(max_length=18)
+    data_nascimento = serializers.DateField(input_formats=['%d/%m/%Y', '%Y-%m-%d'])
+    role = serializers.ChoiceField(choices=['cliente', 'empreendedor'], default='cliente')
+
+    class Meta:
+        model = Usuario
+        fields = ['nome', 'email', 'cpf', 'telefone', 'data_nascimento', 'password', 'role']
+        extra_kwargs = {'email': {'validators': []}, 'password': {'required': False}}
+
+    def validate_cpf(self, value):
+        return normalizar_cpf(value)
+
+    def validate_email(self, value):
+        return Usuario.objects.normalize_email(value)
+
+
+class CategoriaLojaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = CategoriaLoja
         fields = ['id', 'nome']
 
 
-class LojaSerializer(serializers.ModelSerializer):
+class LojaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     categorias = serializers.PrimaryKeyRelatedField(queryset=CategoriaLoja.objects.all(), many=True, required=False)
+    imagem_variantes = serializers.SerializerMethodField()
+    expansoes = {'categorias': CategoriaLojaSerializer}
+    dependencias = {'imagem_variantes': ('imagem',)}
 
     class Meta:
         model = Loja
-        fields = ['id', 'nome', 'empreendedor', 'categorias', 'descricao', 'imagem', 'cep', 'rua', 'numero', 'complemento', 'cpf_cnpj']
+        fields = ['id', 'nome', 'empreendedor', 'categorias', 'descricao', 'imagem', 'imagem_variantes', 'cep', 'rua', 'numero', 'complemento', 'cpf_cnpj', 'total_produtos', 'preco_min', 'preco_max']
         read_only_fields = ['empreendedor']
 
     def validate_cpf_cnpj(self, value):
@@ -90,6 +239,9 @@ class LojaSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('CPF/CNPJ precisa ter 11 (CPF) ou 14 (CNPJ) dígitos.')
         return digits
 
+    def get_imagem_variantes(self, obj):
+        return imagem_variantes(self, obj, 'loja-imagem')
+
 class UsuarioLoginSerializer(serializers.Serializer):
     email = serializers.EmailField()
     senha = serializers.CharField(write_only=True)
@@ -104,18 +256,32 @@ class UsuarioLoginSerializer(serializers.Serializer):
         return data
 
 # Produtos e carrinho
-class ProdutoSerializer(serializers.ModelSerializer):
+class ProdutoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    imagem_variantes = serializers.SerializerMethodField()
+    expansoes = {'loja': LojaSerializer}
+    dependencias = {'imagem_variantes': ('imagem',)}
+
     class Meta:
         model = Produto
         fields = '__all__'
 
-class MetodoPagamentoSerializer(serializers.ModelSerializer):
+    def get_imagem_variantes(self, obj):
+        return imagem_variantes(self, obj, 'produto-imagem')
+
+class ProdutoImportacaoSerializer(serializers.ModelSerializer):
+    # uma linha da importação em lote; com id, atualiza o produto existente da loja
+    id = serializers.IntegerField(required=False, min_value=1)
+
+    class Meta:
+        model = Produto
+        fields = ['id', 'nome', 'preco', 'estoque', 'descricao']
+
+class MetodoPagamentoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = MetodoPagamento
         fields = '__all__'
 
-class ItemCarrinhoSerializer(serializers.ModelSerializer):
-    produto = ProdutoSerializer(read_only=True)
+class ItemCarrinhoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     produto_id = serializers.PrimaryKeyRelatedField(
         queryset=Produto.objects.all(), write_only=True, source='produto'
     )
@@ -123,25 +289,83 @@ class ItemCarrinhoSerializer(serializers.ModelSerializer):
         queryset=Carrinho.objects.all(), write_only=True, source='carrinho'
     )
     subtotal = serializers.SerializerMethodField()
+    expansoes = {'produto': ProdutoSerializer}
+    expansoes_padrao = ('produto',)
 
     class Meta:
         model = ItemCarrinho
         fields = ['id', 'carrinho_id', 'produto', 'produto_id', 'quantidade', 'subtotal']
+        read_only_fields = ['produto']
+        # (carrinho, produto) é único, mas adicionar de novo soma a quantidade (ver create)
+        validators = []
+
+    def validate_carrinho_id(self, value):
+        if value.finalizado:
+            raise serializers.ValidationError('Carrinho já finalizado.')
+        return value
+
+    def create(self, validated_data):
+        quantidade = validated_data.get('quantidade', 1)
+        if estado_carrinhos.ativo():
+            item = estado_carrinhos.adicionar(validated_data['carrinho'], validated_data['produto'], quantidade)
+            if item is not None:
+                return item
+        item, criado = ItemCarrinho.objects.get_or_create(
+            carrinho=validated_data['carrinho'],
+            produto=validated_data['produto'],
+            defaults={'quantidade': quantidade},
+        )
+        if not criado:
+            ItemCarrinho.objects.filter(pk=item.pk).update(quantidade=F('quantidade') + quantidade)
+            item.refresh_from_db(fields=['quantidade'])
+        return item
+
+    def update(self, instance, validated_data):
+        if not estado_carrinhos.ativo():
+            return super().update(instance, validated_data)
+        if set(validated_data) <= {'quantidade'}:
+            quantidade = validated_data.get('quantidade', instance.quantidade)
+            if estado_carrinhos.definir(instance, quantidade):
+                instance.quantidade, instance.subtotal_calculado = quantidade, None
+                return instance
+        # troca de carrinho ou produto: direto no banco, com os dois carrinhos gravados antes
+        destino = validated_data.get('carrinho', instance.carrinho)
+        with estado_carrinhos.escrita_direta(instance.carrinho_id, destino.pk):
+            return super().update(instance, validated_data)
+
+    def anotar(self, queryset):
+        return queryset.com_subtotal() if 'subtotal' in self.fields else queryset
 
     def get_subtotal(self, obj):
         return obj.subtotal()
 
-class CarrinhoSerializer(serializers.ModelSerializer):
-    cliente = UsuarioSerializer(read_only=True)
+class ItemCarrinhoLoteSerializer(serializers.Serializer):
+    produto_id = serializers.IntegerField(min_value=1)
+    quantidade = serializers.IntegerField(min_value=1)
+
+class CarrinhoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     cliente_id = serializers.PrimaryKeyRelatedField(
         queryset=Usuario.objects.all(), write_only=True, source='cliente', required=False
     )
-    itens = ItemCarrinhoSerializer(many=True, read_only=True)
     total = serializers.SerializerMethodField()
+    quantidade_itens = serializers.SerializerMethodField()
+    expansoes = {'cliente': UsuarioSerializer, 'itens': ItemCarrinhoSerializer, 'metodo_pagamento': MetodoPagamentoSerializer}
+    expansoes_padrao = ('cliente', 'itens')
 
     class Meta:
         model = Carrinho
-        fields = ['id', 'cliente', 'cliente_id', 'metodo_pagamento', 'itens', 'total', 'finalizado']
+        fields = ['id', 'cliente', 'cliente_id', 'metodo_pagamento', 'itens', 'total', 'quantidade_itens', 'finalizado']
+        # finalizar só pelo checkout (POST /carrinhos/{id}/checkout/), que baixa o estoque
+        read_only_fields = ['cliente', 'finalizado']
+
+    def anotar(self, queryset):
+        # total e quantidade agregados no SQL só quando pedidos
+        if {'total', 'quantidade_itens'} & set(self.fields) and 'valor_total' not in queryset.query.annotations:
+            return queryset.com_totais()
+        return queryset
 
     def get_total(self, obj):
-        return obj.total()
\ No newline at end of file
+        return obj.total()
+
+    def get_quantidade_itens(self, obj):
+        return obj.quantidade_de_itens()
@@ -0,0 +1,154 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import busca, cache_respostas, estado_carrinhos, imagens, indice_categorias, metricas
+from .authentication import invalidar_usuario
+from .models import Carrinho, CategoriaLoja, ItemCarrinho, Loja, Produto, Usuario
+
+
+@receiver(connection_created)
+def instalar_medicao(sender, connection, **kwargs):
+    # as consultas de toda conexão passam pela medição da requisição atual
+    if metricas.medir_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metricas.medir_consulta)
+
+
+@receiver([post_save, post_delete], sender=Usuario)
+def invalidar_cache_do_usuario(sender, instance, **kwargs):
+    invalidar_usuario(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Produto)
+def invalidar_respostas_do_produto(sender, instance, **kwargs):
+    cache_respostas.invalidar('produtos', instance.pk)
+
+
+@receiver(post_delete, sender=Produto)
+def atualizar_resumo_da_loja(sender, instance, origin=None, **kwargs):
+    # roda dentro da transação do delete (o save é tratado em Produto.save)
+    instance._lojas_alteradas = {instance.loja_id}
+    if isinstance(origin, Loja) or getattr(origin, 'model', None) is Loja:
+        # apagado em cascata com a própria loja: não há resumo a manter
+        return
+    if not Loja.subtrair_produto(instance.loja_id, instance.preco):
+        Loja.recalcular_resumo(instance._lojas_alteradas)
+
+
+@receiver([post_save, post_delete], sender=Produto)
+def invalidar_respostas_da_loja_do_produto(sender, instance, **kwargs):
+    # as respostas de /lojas/ trazem o total e a faixa de preço dos produtos
+    for loja_pk in getattr(instance, '_lojas_alteradas', {instance.loja_id}):
+        cache_respostas.invalidar('lojas', loja_pk)
+
+
+@receiver([post_save, post_delete], sender=Loja)
+def invalidar_respostas_da_loja(sender, instance, **kwargs):
+    cache_respostas.invalidar('lojas', instance.pk)
+
+
+@receiver(post_delete, sender=CategoriaLoja)
+def invalidar_respostas_da_categoria(sender, instance, **kwargs):
+    # as linhas da tabela M2M são apagadas sem m2m_changed
+    cache_respostas.invalidar_tudo('lojas')
+    versao = indice_categorias.incrementar()
+    transaction.on_commit(partial(indice_categorias.remover_categoria, versao, instance.pk))
+
+
+@receiver(post_delete, sender=Loja)
+def remover_loja_do_indice_de_categorias(sender, instance, **kwargs):
+    versao = indice_categorias.incrementar()
+    transaction.on_commit(partial(indice_categorias.remover_loja, versao, instance.pk))
+
+
+@receiver(m2m_changed, sender=Loja.categorias.through)
+def categorias_da_loja_alteradas(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # clear() não informa as linhas removidas: guarda quais são antes
+        relacionados = instance.lojas if reverse else instance.categorias
+        instance._relacionados_antes_do_clear = set(relacionados.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_relacionados_antes_do_clear', set())
+    if reverse:
+        for loja_pk in pk_set or ():
+            cache_respostas.invalidar('lojas', loja_pk)
+    else:
+        cache_respostas.invalidar('lojas', instance.pk)
+    # pares (categoria, loja); a versão sobe nesta transação, o índice local
+    # só muda se ela for confirmada
+    pares = [(instance.pk, pk) if reverse else (pk, instance.pk) for pk in pk_set or ()]
+    if pares:
+        versao = indice_categorias.incrementar()
+        transaction.on_commit(partial(indice_categorias.aplicar, versao, pares, action == 'post_add'))
+
+
+@receiver(post_save, sender=Produto)
+@receiver(post_save, sender=Loja)
+def indexar_para_busca(sender, instance, **kwargs):
+    busca.backend().indexar(sender, [instance])
+
+
+@receiver(post_delete, sender=Produto)
+@receiver(post_delete, sender=Loja)
+def remover_da_busca(sender, instance, **kwargs):
+    busca.backend().remover(sender, [instance.pk])
+
+
+@receiver(post_save, sender=Produto)
+@receiver(post_save, sender=Loja)
+def agendar_variantes_da_imagem(sender, instance, **kwargs):
+    if not instance.imagem:
+        return
+    namespace = 'produtos' if sender is Produto else 'lojas'
+    # as respostas em cache apontam para a rota sob demanda até a geração terminar
+    ao_concluir = partial(cache_respostas.invalidar, namespace, instance.pk)
+    transaction.on_commit(partial(imagens.agendar_derivados, instance.imagem, ao_concluir))
+
+
+@receiver(post_save, sender=Produto)
+@receiver(post_save, sender=Loja)
+def liberar_imagem_substituida(sender, instance, **kwargs):
+    original = getattr(instance, '_imagem_original', None)
+    atual = instance.imagem.name or None
+    if original and original != atual:
+        transaction.on_commit(partial(instance.imagem.storage.delete, original))
+    instance._imagem_original = atual
+
+
+@receiver(post_delete, sender=Produto)
+@receiver(post_delete, sender=Loja)
+def liberar_imagem_removida(sender, instance, **kwargs):
+    # o storage só apaga o arquivo se nenhuma outra linha o referencia
+    if instance.imagem:
+        transaction.on_commit(partial(instance.imagem.storage.delete, instance.imagem.name))
+
+
+@receiver(pre_save, sender=ItemCarrinho)
+@receiver(pre_delete, sender=ItemCarrinho)
+def gravar_carrinho_antes_de_escrita_externa(sender, instance, signal, **kwargs):
+    # escritas de itens fora do estado_carrinhos (admin, shell, cascata): o
+    # pendente do carrinho vai antes para o banco e, depois do commit, o
+    # registro é descartado para ser relido
+    if not estado_carrinhos.ativo() or estado_carrinhos.gravando():
+        return
+    carrinhos = {instance.carrinho_id}
+    if signal is pre_save and instance.pk:
+        # o item pode estar mudando de carrinho
+        carrinhos.update(ItemCarrinho.objects.filter(pk=instance.pk).values_list('carrinho_id', flat=True))
+    estado_carrinhos.persistir(carrinhos)
+    transaction.on_commit(partial(estado_carrinhos.descartar, carrinhos))
+
+
+@receiver(post_save, sender=Carrinho)
+@receiver(post_delete, sender=Carrinho)
+def descartar_estado_do_carrinho(sender, instance, signal, **kwargs):
+    if not estado_carrinhos.ativo() or estado_carrinhos.gravando():
+        return
+    if signal is post_delete or instance.finalizado:
+        transaction.on_commit(partial(estado_carrinhos.descartar, [instance.pk]))
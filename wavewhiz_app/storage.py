@@ -0,0 +1,115 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+
+try:
+    import fcntl
+except ImportError:  # Windows: só a trava entre threads do processo
+    fcntl = None
+
+PASTA = 'blobs'
+_NOME_POR_CONTEUDO = re.compile(rf'^{PASTA}/[0-9a-f]{{2}}/([0-9a-f]{{64}})\.\w+$')
+_EXTENSOES_EQUIVALENTES = {'.jpeg': '.jpg'}
+_lock = threading.Lock()
+
+
+def nome_por_conteudo(hash_conteudo, extensao):
+    extensao = extensao.lower()
+    extensao = _EXTENSOES_EQUIVALENTES.get(extensao, extensao)
+    return f'{PASTA}/{hash_conteudo[:2]}/{hash_conteudo}{extensao}'
+
+
+class ArmazenamentoPorConteudo(FileSystemStorage):
+    # Cada arquivo é gravado uma única vez, com o sha256 do conteúdo no nome
+    # (blobs/ab/abcd...png), independente do upload_to do campo: uploads
+    # repetidos — inclusive entre lojas e produtos — apontam para o mesmo blob.
+    # delete() só apaga o arquivo quando nenhuma linha o referencia mais e ele
+    # não foi gravado nem reaproveitado nos últimos MIDIA_BLOB_CARENCIA
+    # segundos: um upload do mesmo conteúdo em outra transação (ou processo)
+    # ainda não confirmada já aponta para ele. Os que sobram são apagados por
+    # `deduplicar_midia --remover-orfaos`.
+    def get_available_name(self, name, max_length=None):
+        # o nome definitivo só é conhecido em _save, depois de ler o conteúdo
+        return name
+
+    def _save(self, name, content):
+        os.makedirs(self.location, exist_ok=True)
+        resumo = hashlib.sha256()
+        descritor, temporario = tempfile.mkstemp(dir=self.location, prefix='.upload-')
+        try:
+            with os.fdopen(descritor, 'wb') as destino:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for bloco in content.chunks():
+                    resumo.update(bloco)
+                    destino.write(bloco)
+            nome = nome_por_conteudo(resumo.hexdigest(), os.path.splitext(name)[1])
+            caminho = self.path(nome)
+            with self.travado():
+                try:
+                    # reaproveitado: renova a carência
+                    os.utime(caminho)
+                    os.remove(temporario)
+                except FileNotFoundError:
+                    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(temporario, self.file_permissions_mode)
+                    os.replace(temporario, caminho)
+        except BaseException:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+        return nome
+
+    @contextmanager
+    def travado(self):
+        # entre threads e entre processos (flock num arquivo da pasta de mídia)
+        with _lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.location, exist_ok=True)
+            with open(os.path.join(self.location, '.trava-blobs'), 'a') as trava:
+                fcntl.flock(trava, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(trava, fcntl.LOCK_UN)
+
+    def hash_do_nome(self, name):
+        encontrado = _NOME_POR_CONTEUDO.match(name or '')
+        return encontrado.group(1) if encontrado else None
+
+    def referencias(self, name):
+        return sum(
+            model._default_manager.filter(**{campo.name: name}).count()
+            for model, campo in self.campos()
+        )
+
+    def campos(self):
+        # campos de arquivo (de qualquer model) servidos por este storage
+        for model in apps.get_models():
+            for campo in model._meta.concrete_fields:
+                if isinstance(campo, models.FileField) and isinstance(campo.storage, type(self)):
+                    yield model, campo
+
+    def em_carencia(self, name):
+        try:
+            modificado = os.path.getmtime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return time.time() - modificado < settings.MIDIA_BLOB_CARENCIA
+
+    def delete(self, name):
+        with self.travado():
+            if name and not self.em_carencia(name) and self.referencias(name) == 0:
+                super().delete(name)
@@ -1,3 +1,1107 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from itertools import count
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.http import HttpResponse
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from . import checks, estado_carrinhos, imagens, indice_categorias, json_rapido, metricas, roteamento
+from .benchmarks import SENHA_SINTETICA, gerar_dados, proporcoes
+from .models import Usuario, Loja, Produto, Carrinho, ItemCarrinho, CategoriaLoja
+from .parsers import JSONRapidoParser
+from .renderers import JSONRapidoRenderer
+from .serializers import UsuarioSerializer
+from .views import CarrinhoViewSet, UsuarioViewSet
+
+_sequencia = count(1)
+
+
+def criar_usuario(role='cliente', password=None, **extra):
+    n = next(_sequencia)
+    dados = {
+        'nome': f'Usuario {n}',
+        'cpf': f'{n:011d}',
+        'telefone': '11999990000',
+        'data_nascimento': date(1990, 1, 1),
+    }
+    dados.update(extra)
+    return Usuario.objects.create_user(f'usuario{n}@ex.com', password=password, role=role, **dados)
+
+
+def limpar_caches():
+    cache.clear()
+    caches[settings.CACHE_RESPOSTAS].clear()
+
+
+class CarrinhoConsultasTests(APITestCase):
+    def setUp(self):
+        self.staff = criar_usuario(role='admin', is_staff=True)
+        empreendedor = criar_usuario(role='empreendedor')
+        self.loja = Loja.objects.create(empreendedor=empreendedor, nome='Loja')
+        self.client.force_authenticate(self.staff)
+
+    def criar_carrinhos(self, quantidade, itens_por_carrinho):
+        for _ in range(quantidade):
+            carrinho = Carrinho.objects.create(cliente=criar_usuario())
+            for i in range(itens_por_carrinho):
+                produto = Produto.objects.create(loja=self.loja, nome=f'Produto {i}', preco=Decimal('9.99'), estoque=10)
+                ItemCarrinho.objects.create(carrinho=carrinho, produto=produto, quantidade=3)
+
+    def test_listagem_de_carrinhos_com_consultas_constantes(self):
+        self.criar_carrinhos(2, 1)
+        with CaptureQueriesContext(connection) as poucos:
+            resposta = self.client.get('/carrinhos/')
+        self.assertEqual(resposta.status_code, 200)
+
+        self.criar_carrinhos(10, 5)
+        with CaptureQueriesContext(connection) as muitos:
+            resposta = self.client.get('/carrinhos/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(len(poucos), len(muitos))
+
+        totais = {Decimal(str(c['total'])) for c in resposta.data['results'] if c['itens']}
+        self.assertEqual(totais, {Decimal('29.97'), Decimal('149.85')})
+
+    def test_listagem_de_itens_com_consultas_constantes(self):
+        self.criar_carrinhos(1, 1)
+        with CaptureQueriesContext(connection) as poucos:
+            self.client.get('/itens-carrinho/')
+        self.criar_carrinhos(5, 4)
+        with CaptureQueriesContext(connection) as muitos:
+            resposta = self.client.get('/itens-carrinho/')
+        self.assertEqual(len(poucos), len(muitos))
+        self.assertEqual(Decimal(str(resposta.data['results'][0]['subtotal'])), Decimal('29.97'))
+
+    def test_filtro_e_ordenacao_por_total(self):
+        baratos = Carrinho.objects.create(cliente=criar_usuario())
+        caros = Carrinho.objects.create(cliente=criar_usuario())
+        produto = Produto.objects.create(loja=self.loja, nome='Produto', preco=Decimal('10.00'))
+        ItemCarrinho.objects.create(carrinho=baratos, produto=produto, quantidade=1)
+        ItemCarrinho.objects.create(carrinho=caros, produto=produto, quantidade=5)
+
+        resposta = self.client.get('/carrinhos/', {'ordering': '-total'})
+        self.assertEqual([c['id'] for c in resposta.data['results']], [caros.id, baratos.id])
+        self.assertEqual(resposta.data['results'][0]['quantidade_itens'], 1)
+
+        resposta = self.client.get('/carrinhos/', {'total_min': '20'})
+        self.assertEqual([c['id'] for c in resposta.data['results']], [caros.id])
+
+        resposta = self.client.get('/carrinhos/', {'total_min': 'abc'})
+        self.assertEqual(resposta.status_code, 400)
+
+    def test_paginacao_por_cursor_percorre_todos_os_carrinhos(self):
+        produto = Produto.objects.create(loja=self.loja, nome='Produto', preco=Decimal('10.00'))
+        carrinhos = []
+        for quantidade in (1, 2, 2, 3, 1):
+            carrinho = Carrinho.objects.create(cliente=criar_usuario())
+            ItemCarrinho.objects.create(carrinho=carrinho, produto=produto, quantidade=quantidade)
+            carrinhos.append(carrinho)
+
+        for params, esperado in (
+            ({}, sorted((c.id for c in carrinhos), reverse=True)),
+            ({'ordering': '-total'}, [carrinhos[i].id for i in (3, 2, 1, 4, 0)]),
+        ):
+            ids = []
+            resposta = self.client.get('/carrinhos/', {'page_size': 2, **params})
+            while True:
+                ids += [c['id'] for c in resposta.data['results']]
+                if not resposta.data['next']:
+                    break
+                resposta = self.client.get(resposta.data['next'])
+            self.assertEqual(ids, esperado)
+
+
+class AutenticacaoJWTCacheTests(APITransactionTestCase):
+    def setUp(self):
+        limpar_caches()
+        self.usuario = criar_usuario(password='senha-forte-123')
+        resposta = self.client.post('/api/token/', {'email': self.usuario.email, 'password': 'senha-forte-123'})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {resposta.data['access']}")
+
+    def contar_consultas(self):
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get('/carrinhos/')
+        self.assertEqual(resposta.status_code, 200)
+        return len(consultas)
+
+    def test_usuario_em_cache_ate_ser_alterado(self):
+        sem_cache = self.contar_consultas()
+        self.assertEqual(self.contar_consultas(), sem_cache - 1)
+
+        self.usuario.nome = 'Outro nome'
+        self.usuario.save()
+        self.assertEqual(self.contar_consultas(), sem_cache)
+
+    def test_usuario_removido_perde_acesso(self):
+        self.contar_consultas()
+        self.usuario.delete()
+        self.assertEqual(self.client.get('/carrinhos/').status_code, 401)
+
+    def test_criar_carrinho_com_usuario_do_cache(self):
+        self.contar_consultas()
+        # INSERT e o carrinho relido com cliente e itens (sem uma consulta por campo do usuário)
+        with self.assertNumQueries(4):
+            resposta = self.client.post('/carrinhos/', {})
+        self.assertEqual(resposta.status_code, 201)
+        esperado = {campo: getattr(self.usuario, campo) for campo in ('nome', 'email', 'cpf', 'telefone')}
+        self.assertEqual({campo: resposta.data['cliente'][campo] for campo in esperado}, esperado)
+
+
+class LoginTests(APITransactionTestCase):
+    def test_login_refaz_hash_com_o_hasher_preferido(self):
+        usuario = criar_usuario()
+        hasher = PBKDF2PasswordHasher()
+        usuario.password = hasher.encode('senha-antiga', hasher.salt(), iterations=1000)
+        usuario.save()
+
+        resposta = self.client.post('/api/token/', {'email': usuario.email, 'password': 'senha-antiga'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('access', resposta.data)
+        usuario.refresh_from_db()
+        self.assertTrue(usuario.password.startswith('scrypt$'))
+
+    def test_login_com_credenciais_invalidas(self):
+        usuario = criar_usuario(password='senha-forte-123')
+        for email, senha in ((usuario.email, 'errada'), ('ninguem@ex.com', 'senha-forte-123')):
+            resposta = self.client.post('/api/token/', {'email': email, 'password': senha})
+            self.assertEqual(resposta.status_code, 400)
+
+    def test_email_desconhecido_tambem_calcula_hash(self):
+        with mock.patch('django.contrib.auth.base_user.make_password') as make_password:
+            resposta = self.client.post('/api/token/', {'email': 'ninguem@ex.com', 'password': 'senha-forte-123'})
+        self.assertEqual(resposta.status_code, 400)
+        make_password.assert_called_once_with('senha-forte-123')
+
+    def test_login_de_usuario_inativo(self):
+        usuario = criar_usuario(password='senha-forte-123')
+        with mock.patch.object(Usuario, 'is_active', new_callable=mock.PropertyMock, return_value=False):
+            resposta = self.client.post('/api/token/', {'email': usuario.email, 'password': 'senha-forte-123'})
+            self.assertEqual(resposta.data['non_field_errors'], ['Usuário inativo'])
+            resposta = self.client.post('/api/token/', {'email': usuario.email, 'password': 'errada'})
+            self.assertEqual(resposta.data['non_field_errors'], ['Credenciais inválidas'])
+
+
+class CatalogoCacheTests(APITestCase):
+    def setUp(self):
+        limpar_caches()
+        self.loja = Loja.objects.create(empreendedor=criar_usuario(role='empreendedor'), nome='Loja')
+        self.produto = Produto.objects.create(loja=self.loja, nome='Produto', preco=Decimal('5.00'))
+
+    def test_listagem_em_cache_ate_o_produto_mudar(self):
+        primeira = self.client.get('/produtos/', {'loja': self.loja.id})
+        self.assertEqual(primeira['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            segunda = self.client.get('/produtos/', {'loja': self.loja.id})
+        self.assertEqual(segunda['X-Cache'], 'HIT')
+        self.assertEqual(segunda.data, primeira.data)
+
+        resposta = self.client.get('/produtos/', {'loja': self.loja.id}, HTTP_IF_NONE_MATCH=primeira['ETag'])
+        self.assertEqual(resposta.status_code, 304)
+
+        self.produto.nome = 'Produto novo'
+        self.produto.save()
+        resposta = self.client.get('/produtos/', {'loja': self.loja.id}, HTTP_IF_NONE_MATCH=primeira['ETag'])
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.data['results'][0]['nome'], 'Produto novo')
+
+    def test_detalhe_da_loja_invalidado_pelas_categorias(self):
+        categoria = CategoriaLoja.objects.create(nome='Alimentos')
+        self.client.get(f'/lojas/{self.loja.id}/')
+        categoria.lojas.add(self.loja)
+        resposta = self.client.get(f'/lojas/{self.loja.id}/')
+        self.assertEqual(resposta['X-Cache'], 'MISS')
+        self.assertEqual(resposta.data['categorias'], [categoria.id])
+
+        categoria.delete()
+        resposta = self.client.get(f'/lojas/{self.loja.id}/')
+        self.assertEqual(resposta.data['categorias'], [])
+
+    def test_cache_local_recusado_fora_do_debug(self):
+        with override_settings(DEBUG=False), mock.patch('sys.argv', ['manage.py', 'runserver']):
+            self.assertEqual([erro.id for erro in checks.cache_respostas_compartilhado(None)], ['wavewhiz_app.E001'])
+            with override_settings(CACHE_RESPOSTAS=''):
+                self.assertEqual(checks.cache_respostas_compartilhado(None), [])
+                self.client.get('/produtos/')
+                self.assertNotIn('X-Cache', self.client.get('/produtos/'))
+
+    def test_busca_textual_ignora_acentos_e_ordena_por_relevancia(self):
+        Produto.objects.create(loja=self.loja, nome='Bolo', preco=Decimal('9.00'), descricao='feito com açúcar mascavo')
+        pao = Produto.objects.create(loja=self.loja, nome='Pão de açúcar', preco=Decimal('3.00'))
+        Produto.objects.create(loja=self.loja, nome='Café', preco=Decimal('12.00'))
+
+        resposta = self.client.get('/produtos/search/', {'q': 'acucar'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual([p['nome'] for p in resposta.data['results']], ['Pão de açúcar', 'Bolo'])
+
+        pao.delete()
+        resposta = self.client.get('/produtos/search/', {'q': 'AÇÚC'})
+        self.assertEqual([p['nome'] for p in resposta.data['results']], ['Bolo'])
+
+        self.loja.descricao = 'Cafeteria artesanal'
+        self.loja.save()
+        resposta = self.client.get('/lojas/search/', {'q': 'cafeteria'})
+        self.assertEqual([l['id'] for l in resposta.data['results']], [self.loja.id])
+
+    def test_busca_textual_com_filtro(self):
+        # os resultados mais relevantes de outra loja não ocupam o limite
+        for i in range(3):
+            Produto.objects.create(loja=self.loja, nome=f'Bolo bolo {i}', preco=Decimal('9.00'))
+        outra = Loja.objects.create(empreendedor=criar_usuario(role='empreendedor'), nome='Outra')
+        fuba = Produto.objects.create(loja=outra, nome='Fubá', preco=Decimal('7.00'), descricao='bolo de milho')
+        resposta = self.client.get('/produtos/search/', {'q': 'bolo', 'loja': outra.id, 'page_size': 2})
+        self.assertEqual([p['id'] for p in resposta.data['results']], [fuba.id])
+        resposta = self.client.get('/produtos/search/', {'q': 'bolo', 'page_size': 2})
+        self.assertEqual(len(resposta.data['results']), 2)
+        self.assertNotIn(fuba.id, [p['id'] for p in resposta.data['results']])
+
+
+class ResumoDaLojaTests(APITestCase):
+    def setUp(self):
+        limpar_caches()
+        self.empreendedor = criar_usuario(role='empreendedor')
+        self.loja = Loja.objects.create(empreendedor=self.empreendedor, nome='Loja')
+
+    def resumo(self, loja=None):
+        resposta = self.client.get(f'/lojas/{(loja or self.loja).id}/')
+        return resposta.data['total_produtos'], resposta.data['preco_min'], resposta.data['preco_max']
+
+    def test_resumo_acompanha_os_produtos(self):
+        self.assertEqual(self.resumo(), (0, None, None))
+        barato = Produto.objects.create(loja=self.loja, nome='Barato', preco=Decimal('2.00'))
+        caro = Produto.objects.create(loja=self.loja, nome='Caro', preco=Decimal('30.00'))
+        self.assertEqual(self.resumo(), (2, '2.00', '30.00'))
+
+        barato = Produto.objects.get(pk=barato.pk)
+        barato.preco = Decimal('5.00')
+        barato.save()
+        self.assertEqual(self.resumo(), (2, '5.00', '30.00'))
+
+        outra = Loja.objects.create(empreendedor=self.empreendedor, nome='Outra')
+        caro.loja = outra
+        caro.save()
+        self.assertEqual(self.resumo(), (1, '5.00', '5.00'))
+        self.assertEqual(self.resumo(outra), (1, '30.00', '30.00'))
+
+        barato.delete()
+        self.assertEqual(self.resumo(), (0, None, None))
+
+    def test_remocao_sem_recalcular_a_loja(self):
+        produtos = [
+            Produto.objects.create(loja=self.loja, nome=f'Produto {preco}', preco=Decimal(preco))
+            for preco in ('2.00', '5.00', '9.00')
+        ]
+        with CaptureQueriesContext(connection) as consultas:
+            produtos[1].delete()
+        atualizacoes = [c['sql'] for c in consultas if c['sql'].startswith('UPDATE "wavewhiz_app_loja"')]
+        self.assertEqual(len(atualizacoes), 1)
+        self.assertNotIn('SELECT', atualizacoes[0])
+        self.assertEqual(self.resumo(), (2, '2.00', '9.00'))
+        produtos[2].delete()
+        self.assertEqual(self.resumo(), (1, '2.00', '2.00'))
+
+        with CaptureQueriesContext(connection) as consultas:
+            self.loja.delete()
+        self.assertFalse([c for c in consultas if c['sql'].startswith('UPDATE "wavewhiz_app_loja"')])
+
+    def test_salvar_loja_carregada_antes_nao_sobrescreve_o_resumo(self):
+        loja = Loja.objects.get(pk=self.loja.pk)
+        Produto.objects.create(loja=self.loja, nome='Produto', preco=Decimal('7.00'))
+        loja.nome = 'Renomeada'
+        loja.save()
+        loja.refresh_from_db()
+        self.assertEqual((loja.nome, loja.total_produtos, loja.preco_min), ('Renomeada', 1, Decimal('7.00')))
+
+    def test_listagem_nao_agrega_produtos_e_comando_recalcula(self):
+        Produto.objects.create(loja=self.loja, nome='Produto', preco=Decimal('7.00'))
+        Produto.objects.filter(loja=self.loja).update(preco=Decimal('9.00'))
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get('/lojas/')
+        self.assertEqual(resposta.data['results'][0]['preco_max'], '7.00')
+        self.assertFalse([c for c in consultas if 'wavewhiz_app_produto' in c['sql']])
+
+        call_command('recalcular_resumo_lojas', stdout=io.StringIO())
+        self.assertEqual(self.resumo(), (1, '9.00', '9.00'))
+
+
+class CamposDinamicosTests(APITestCase):
+    def setUp(self):
+        limpar_caches()
+        self.cliente = criar_usuario()
+        self.loja = Loja.objects.create(empreendedor=criar_usuario(role='empreendedor'), nome='Loja')
+        self.categoria = CategoriaLoja.objects.create(nome='Alimentos')
+        self.loja.categorias.add(self.categoria)
+        self.produto = Produto.objects.create(loja=self.loja, nome='Produto', preco=Decimal('4.00'), descricao='x' * 500)
+        self.carrinho = Carrinho.objects.create(cliente=self.cliente)
+        ItemCarrinho.objects.create(carrinho=self.carrinho, produto=self.produto, quantidade=2)
+        self.client.force_authenticate(self.cliente)
+
+    def test_campos_pedidos_limitam_colunas_e_relacoes(self):
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get('/carrinhos/', {'fields': 'id,total,itens.quantidade'})
+        self.assertEqual(resposta.data['results'], [{'id': self.carrinho.id, 'total': Decimal('8.00'), 'itens': [{'quantidade': 2}]}])
+        sql = ' '.join(consulta['sql'] for consulta in consultas)
+        self.assertNotIn('"cpf"', sql)
+        self.assertNotIn('"descricao"', sql)
+
+        resposta = self.client.get('/produtos/', {'fields': 'id,nome'})
+        self.assertEqual(resposta.data['results'], [{'id': self.produto.id, 'nome': 'Produto'}])
+
+    def test_expansao_padrao_e_explicita(self):
+        resposta = self.client.get(f'/carrinhos/{self.carrinho.id}/')
+        self.assertEqual(resposta.data['cliente']['id'], self.cliente.id)
+        self.assertEqual(resposta.data['itens'][0]['produto']['nome'], 'Produto')
+
+        resposta = self.client.get(f'/carrinhos/{self.carrinho.id}/', {'expand': 'itens'})
+        self.assertEqual(resposta.data['cliente'], self.cliente.id)
+        self.assertEqual(resposta.data['itens'][0]['produto'], self.produto.id)
+
+        with self.assertNumQueries(3):
+            resposta = self.client.get('/produtos/', {'expand': 'loja.categorias', 'fields': 'id,loja'})
+        self.assertEqual(resposta.data['results'][0]['loja']['categorias'], [{'id': self.categoria.id, 'nome': 'Alimentos'}])
+        self.assertNotIn('X-Cache', resposta)
+
+    def test_escrita_devolve_o_serializer_completo(self):
+        resposta = self.client.post('/carrinhos/?fields=id', {}, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(resposta.data['cliente']['id'], self.cliente.id)
+
+    async def test_rota_assincrona_com_expansao(self):
+        resposta = await self.async_client.get('/async/lojas/', {'fields': 'id,categorias.nome'})
+        self.assertEqual(resposta.json()['results'], [{'id': self.loja.id, 'categorias': [{'nome': 'Alimentos'}]}])
+
+
+class IndiceCategoriasTests(APITestCase):
+    def setUp(self):
+        limpar_caches()
+        indice_categorias.invalidar()
+        empreendedor = criar_usuario(role='empreendedor')
+        self.doces, self.salgados = (CategoriaLoja.objects.create(nome=nome) for nome in ('Doces', 'Salgados'))
+        self.lojas = [Loja.objects.create(empreendedor=empreendedor, nome=f'Loja {n}') for n in range(4)]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doces.lojas.add(*self.lojas[:3])
+            self.lojas[1].categorias.add(self.salgados)
+            self.lojas[3].categorias.add(self.salgados)
+
+    def ids(self, **params):
+        ids, resposta = [], self.client.get('/lojas/', params)
+        while True:
+            self.assertEqual(resposta.status_code, 200)
+            ids += [loja['id'] for loja in resposta.data['results']]
+            if not resposta.data['next']:
+                return ids
+            resposta = self.client.get(resposta.data['next'])
+
+    def test_uniao_e_intersecao_paginadas_sem_repeticao(self):
+        loja = [loja.id for loja in self.lojas]
+        categorias = f'{self.doces.id},{self.salgados.id}'
+        self.assertEqual(self.ids(categoria=categorias, page_size=1), [loja[3], loja[2], loja[1], loja[0]])
+        self.assertEqual(self.ids(categoria=categorias, modo='all'), [loja[1]])
+        self.assertEqual(self.ids(categoria=self.salgados.id, empreendedor=self.lojas[0].empreendedor_id), [loja[3], loja[1]])
+        self.assertEqual(self.client.get('/lojas/', {'categoria': categorias, 'modo': 'xor'}).status_code, 400)
+
+    def test_alteracao_feita_por_outro_processo(self):
+        self.assertEqual(self.ids(categoria=self.salgados.id), [self.lojas[3].id, self.lojas[1].id])
+        # outro processo: índice, versão e cache local próprios (os deste ficam
+        # como estavam); só o cache de respostas é compartilhado
+        outro_cache = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'outro-processo'}
+        with mock.patch.multiple(indice_categorias, _indice=None, _versao=None), \
+                override_settings(CACHES={**settings.CACHES, 'default': outro_cache}), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.lojas[0].categorias.add(self.salgados)
+        self.assertEqual(
+            self.ids(categoria=self.salgados.id), [self.lojas[3].id, self.lojas[1].id, self.lojas[0].id]
+        )
+
+    def test_atualizado_pelas_alteracoes_confirmadas(self):
+        self.assertEqual(self.ids(categoria=self.salgados.id), [self.lojas[3].id, self.lojas[1].id])
+        with mock.patch('wavewhiz_app.indice_categorias._construir') as construir:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.lojas[0].categorias.add(self.salgados)
+                self.lojas[3].categorias.clear()
+            self.assertEqual(self.ids(categoria=self.salgados.id), [self.lojas[1].id, self.lojas[0].id])
+            construir.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.salgados.lojas.remove(self.lojas[1])
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+            self.lojas[0].delete()
+        self.assertEqual(self.ids(categoria=self.salgados.id), [self.lojas[1].id])
+
+    def test_versao_sobe_na_transacao_da_alteracao(self):
+        antes = indice_categorias._versao_atual()
+        try:
+            with transaction.atomic():
+                self.lojas[0].categorias.add(self.salgados)
+                self.assertEqual(indice_categorias._versao_atual(), antes + 1)
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        self.assertEqual(indice_categorias._versao_atual(), antes)
+        # confirmada antes do on_commit (que só aplica no índice local)
+        with self.captureOnCommitCallbacks(execute=False):
+            self.lojas[0].categorias.add(self.salgados)
+        self.assertEqual(indice_categorias._versao_atual(), antes + 1)
+        self.assertEqual(
+            self.ids(categoria=self.salgados.id), [self.lojas[3].id, self.lojas[1].id, self.lojas[0].id]
+        )
+
+    async def test_rota_assincrona_usa_o_indice(self):
+        resposta = await self.async_client.get('/async/lojas/', {'categoria': f'{self.doces.id},{self.salgados.id}', 'modo': 'all'})
+        self.assertEqual([loja['id'] for loja in resposta.json()['results']], [self.lojas[1].id])
+
+
+class CatalogoAsyncTests(APITestCase):
+    def setUp(self):
+        limpar_caches()
+        self.categoria = CategoriaLoja.objects.create(nome='Alimentos')
+        self.loja = Loja.objects.create(empreendedor=criar_usuario(role='empreendedor'), nome='Loja')
+        self.loja.categorias.add(self.categoria)
+        Produto.objects.bulk_create(
+            Produto(loja=self.loja, nome=f'Produto {n}', preco=Decimal('5.00')) for n in range(5)
+        )
+
+    async def test_listagem_paginada_igual_a_sincrona(self):
+        resposta = await self.async_client.get('/async/produtos/', {'loja': self.loja.id, 'page_size': 3})
+        self.assertEqual(resposta.status_code, 200)
+        pagina = resposta.json()
+        self.assertEqual(len(pagina['results']), 3)
+        seguinte = (await self.async_client.get(pagina['next'])).json()
+        self.assertIsNone(seguinte['next'])
+
+        sincrona = await sync_to_async(self.client.get)('/produtos/', {'loja': self.loja.id})
+        self.assertEqual(pagina['results'] + seguinte['results'], json.loads(sincrona.content)['results'])
+
+    async def test_detalhe_da_loja_com_categorias(self):
+        resposta = await self.async_client.get(f'/async/lojas/{self.loja.id}/')
+        self.assertEqual(resposta.json()['categorias'], [self.categoria.id])
+        resposta = await self.async_client.get('/async/lojas/0/')
+        self.assertEqual(resposta.status_code, 404)
+
+
+class MetricasTests(APITestCase):
+    def setUp(self):
+        metricas.limpar()
+        CategoriaLoja.objects.bulk_create(CategoriaLoja(nome=f'Categoria {n}') for n in range(3))
+
+    def test_metricas_por_view_no_formato_prometheus(self):
+        self.client.get('/categorias/')
+        with self.settings(METRICAS_N_MAIS_UM_LIMIAR=0), self.assertLogs('wavewhiz_app.metricas', 'WARNING'):
+            self.client.get('/async/categorias/')
+        corpo = self.client.get('/metrics').content.decode()
+        rotulos = 'view="CategoriaLojaViewSet.list",metodo="GET",status="200"'
+        self.assertIn(f'wavewhiz_requisicoes_total{{{rotulos}}} 1', corpo)
+        self.assertIn(f'wavewhiz_sql_consultas_total{{{rotulos}}} 1', corpo)
+        self.assertIn(f'wavewhiz_n_mais_um_total{{{rotulos}}} 0', corpo)
+        self.assertIn('wavewhiz_n_mais_um_total{view="categorias_async",metodo="GET",status="200"} 1', corpo)
+        self.assertIn(f'wavewhiz_requisicao_segundos_count{{{rotulos}}} 1', corpo)
+
+    async def test_middleware_assincrono(self):
+        # sob ASGI o middleware não é adaptado com sync_to_async, e as
+        # consultas do ORM assíncrono (em outra thread) entram na medição
+        async def proxima(request):
+            return HttpResponse()
+
+        middleware = metricas.MetricasMiddleware(proxima)
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertTrue(iscoroutinefunction(middleware.process_view))
+        resposta = await self.async_client.get('/async/categorias/')
+        self.assertEqual(resposta.status_code, 200)
+        corpo = (await self.async_client.get('/metrics')).content.decode()
+        rotulos = 'view="categorias_async",metodo="GET",status="200"'
+        self.assertIn(f'wavewhiz_requisicoes_total{{{rotulos}}} 1', corpo)
+        self.assertNotIn(f'wavewhiz_sql_consultas_total{{{rotulos}}} 0', corpo)
+
+
+class GerarDadosTests(APITestCase):
+    def test_quantidades_e_busca(self):
+        quantidades = dict(proporcoes(100), usuarios=20, carrinhos=10)
+        admin, _ = gerar_dados(quantidades)
+        self.assertEqual(Produto.objects.count(), 100)
+        self.assertEqual(Loja.objects.count(), quantidades['lojas'])
+        self.assertEqual(ItemCarrinho.objects.count(), 10 * quantidades['itens_por_carrinho'])
+        self.assertEqual(Loja.categorias.through.objects.count(), 2 * quantidades['lojas'])
+        self.assertTrue(admin.check_password(SENHA_SINTETICA))
+        self.assertTrue(self.client.get('/produtos/search/', {'q': 'artesanal'}).data['results'])
+
+
+@override_settings(DATABASE_REPLICAS=['default'])
+class RoteamentoReplicasTests(APITestCase):
+    def setUp(self):
+        limpar_caches()
+        loja = Loja.objects.create(empreendedor=criar_usuario(role='empreendedor'), nome='Loja')
+        self.produto = Produto.objects.create(loja=loja, nome='Produto', preco=Decimal('5.00'))
+
+    def test_roteador_usa_a_replica_so_dentro_da_requisicao_marcada(self):
+        roteador = roteamento.RoteadorReplicas()
+        self.assertIsNone(roteador.db_for_read(Produto))
+        with roteamento.usar_replica('replica'):
+            self.assertEqual(roteador.db_for_read(Produto), 'replica')
+            self.assertEqual(roteador.db_for_write(Produto), 'default')
+
+    def test_leitura_vai_para_replica_exceto_logo_apos_escrita(self):
+        with mock.patch('wavewhiz_app.roteamento.random.choice', return_value='default') as escolha:
+            self.client.get('/produtos/')
+            self.client.get('/carrinhos/')
+            self.assertEqual(escolha.call_count, 1)
+
+            resposta = self.client.patch(f'/produtos/{self.produto.id}/', {'nome': 'Novo'}, format='json')
+            self.assertIn(roteamento.COOKIE_PRIMARIO, resposta.cookies)
+            self.client.get(f'/produtos/{self.produto.id}/')
+            self.assertEqual(escolha.call_count, 1)
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    async def test_middleware_assincrono(self):
+        async def proxima(request):
+            return HttpResponse()
+
+        middleware = roteamento.ReplicaMiddleware(proxima)
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertTrue(iscoroutinefunction(middleware.process_view))
+
+        lidos = []
+        ler = roteamento.RoteadorReplicas.db_for_read
+
+        def registrar(roteador, model, **hints):
+            lidos.append(ler(roteador, model, **hints))
+            return lidos[-1]
+
+        with mock.patch('wavewhiz_app.roteamento.random.choice', return_value='default'), \
+                mock.patch.object(roteamento.RoteadorReplicas, 'db_for_read', registrar):
+            resposta = await self.async_client.get('/async/produtos/')
+        self.assertEqual(resposta.status_code, 200)
+        # a réplica escolhida no process_view chega às consultas da view
+        self.assertIn('default', lidos)
+
+
+class VerificarPlanosTests(APITestCase):
+    def test_nenhuma_consulta_varre_a_tabela(self):
+        saida = io.StringIO()
+        call_command('verificar_planos', stdout=saida)
+        self.assertIn('ok carrinhos list cliente', saida.getvalue())
+        self.assertNotIn('VARREDURA', saida.getvalue())
+
+
+def png(tamanho, cor='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', tamanho, cor).save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue())
+
+
+class ImagensVariantesTests(APITestCase):
+    def setUp(self):
+        limpar_caches()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        configuracao = override_settings(MEDIA_ROOT=self.media)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.loja = Loja.objects.create(empreendedor=criar_usuario(role='empreendedor'), nome='Loja')
+        self.produto = Produto(loja=self.loja, nome='Produto', preco=Decimal('5.00'))
+        self.produto.imagem.save('foto.png', png((2000, 1000)))
+
+    @override_settings(IMAGENS_WORKERS=0)
+    def test_variante_gerada_sob_demanda(self):
+        variantes = self.client.get(f'/produtos/{self.produto.id}/').data['imagem_variantes']
+        self.assertTrue(variantes['thumb'].endswith(f'/produtos/{self.produto.id}/imagem/thumb/'))
+
+        resposta = self.client.get(f'/produtos/{self.produto.id}/imagem/thumb/')
+        self.assertEqual(resposta.status_code, 302)
+        self.assertIn('/media/derivados/', resposta['Location'])
+        caminho = resposta['Location'].split('/media/', 1)[1]
+        with Image.open(f'{self.media}/{caminho}') as imagem:
+            self.assertEqual(imagem.format, 'WEBP')
+            self.assertEqual(imagem.size, (160, 80))
+
+        self.produto.save()
+        variantes = self.client.get(f'/produtos/{self.produto.id}/').data['imagem_variantes']
+        self.assertEqual(variantes['thumb'], resposta['Location'])
+
+    def test_variante_pendente_nao_gerada_na_requisicao(self):
+        with mock.patch.object(imagens, 'agendar_derivados') as agendar, \
+                mock.patch.object(imagens, 'gerar_derivados') as gerar, \
+                mock.patch.object(imagens, 'hash_do_arquivo') as hash_do_arquivo:
+            resposta = self.client.get(f'/produtos/{self.produto.id}/imagem/card/')
+        self.assertEqual(resposta.status_code, 302)
+        self.assertTrue(resposta['Location'].endswith(self.produto.imagem.url))
+        agendar.assert_called_once()
+        gerar.assert_not_called()
+        hash_do_arquivo.assert_not_called()
+
+
+@override_settings(IMAGENS_WORKERS=0)
+class MidiaPorConteudoTests(APITestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        configuracao = override_settings(MEDIA_ROOT=self.media)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.loja = Loja.objects.create(empreendedor=criar_usuario(role='empreendedor'), nome='Loja')
+
+    @override_settings(MIDIA_BLOB_CARENCIA=0)
+    def test_conteudo_repetido_gravado_uma_vez(self):
+        self.loja.imagem.save('logo.png', png((10, 10)))
+        produto = Produto(loja=self.loja, nome='Produto', preco=Decimal('5.00'))
+        produto.imagem.save('outro-nome.png', png((10, 10)))
+        self.assertEqual(produto.imagem.name, self.loja.imagem.name)
+        self.assertRegex(produto.imagem.name, r'^blobs/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+
+        caminho = produto.imagem.path
+        with self.captureOnCommitCallbacks(execute=True):
+            produto.delete()
+        self.assertTrue(os.path.exists(caminho))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.loja.imagem.save('azul.png', png((10, 10), 'blue'))
+        self.assertFalse(os.path.exists(caminho))
+
+    def test_blob_reaproveitado_nao_apagado_na_carencia(self):
+        self.loja.imagem.save('logo.png', png((10, 10)))
+        caminho = self.loja.imagem.path
+        os.utime(caminho, (0, 0))
+        # outra transação grava o mesmo conteúdo e ainda não confirmou a linha
+        nome = default_storage.save('produtos/novo.png', png((10, 10)))
+        self.assertEqual(nome, self.loja.imagem.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.loja.imagem.save('azul.png', png((10, 10), 'blue'))
+        self.assertTrue(os.path.exists(caminho))
+
+        # sumiu mesmo assim: o próximo upload do mesmo conteúdo recria
+        os.remove(caminho)
+        default_storage.save('produtos/novo.png', png((10, 10)))
+        self.assertTrue(os.path.exists(caminho))
+
+        os.utime(caminho, (0, 0))
+        call_command('deduplicar_midia', remover_orfaos=True, stdout=io.StringIO())
+        self.assertFalse(os.path.exists(caminho))
+
+    def test_blob_servido_com_cache_imutavel(self):
+        self.loja.imagem.save('logo.png', png((10, 10)))
+        resposta = self.client.get(self.loja.imagem.url)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('immutable', resposta['Cache-Control'])
+
+
+class CheckoutTests(APITestCase):
+    def setUp(self):
+        self.cliente = criar_usuario()
+        self.client.force_authenticate(self.cliente)
+        loja = Loja.objects.create(empreendedor=criar_usuario(role='empreendedor'), nome='Loja')
+        self.bolo = Produto.objects.create(loja=loja, nome='Bolo', preco=Decimal('10.00'), estoque=5)
+        self.cafe = Produto.objects.create(loja=loja, nome='Café', preco=Decimal('4.00'), estoque=1)
+        self.carrinho = Carrinho.objects.create(cliente=self.cliente)
+
+    def test_checkout_baixa_estoque_e_finaliza(self):
+        ItemCarrinho.objects.create(carrinho=self.carrinho, produto=self.bolo, quantidade=2)
+        ItemCarrinho.objects.create(carrinho=self.carrinho, produto=self.cafe, quantidade=1)
+        resposta = self.client.post(f'/carrinhos/{self.carrinho.id}/checkout/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.data['finalizado'])
+        self.bolo.refresh_from_db()
+        self.cafe.refresh_from_db()
+        self.assertEqual((self.bolo.estoque, self.cafe.estoque), (3, 0))
+
+        resposta = self.client.post(f'/carrinhos/{self.carrinho.id}/checkout/')
+        self.assertEqual(resposta.status_code, 409)
+
+    def test_checkout_invalida_produtos_em_cache(self):
+        limpar_caches()
+        ItemCarrinho.objects.create(carrinho=self.carrinho, produto=self.bolo, quantidade=3)
+        self.client.get(f'/produtos/{self.bolo.id}/')
+        self.assertEqual(self.client.get(f'/produtos/{self.bolo.id}/')['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(f'/carrinhos/{self.carrinho.id}/checkout/')
+        self.assertEqual(resposta.status_code, 200)
+        resposta = self.client.get(f'/produtos/{self.bolo.id}/')
+        self.assertEqual((resposta['X-Cache'], resposta.data['estoque']), ('MISS', 2))
+
+    def test_checkout_sem_estoque_nao_altera_nada(self):
+        ItemCarrinho.objects.create(carrinho=self.carrinho, produto=self.bolo, quantidade=2)
+        ItemCarrinho.objects.create(carrinho=self.carrinho, produto=self.cafe, quantidade=2)
+        resposta = self.client.post(f'/carrinhos/{self.carrinho.id}/checkout/')
+        self.assertEqual(resposta.status_code, 409)
+        self.assertEqual([p['id'] for p in resposta.data['produtos']], [self.cafe.id])
+        self.bolo.refresh_from_db()
+        self.carrinho.refresh_from_db()
+        self.assertEqual(self.bolo.estoque, 5)
+        self.assertFalse(self.carrinho.finalizado)
+
+    def test_finalizado_nao_muda_por_patch(self):
+        self.client.patch(f'/carrinhos/{self.carrinho.id}/', {'finalizado': True})
+        self.carrinho.refresh_from_db()
+        self.assertFalse(self.carrinho.finalizado)
+
+    def test_itens_em_lote_somam_quantidades(self):
+        ItemCarrinho.objects.create(carrinho=self.carrinho, produto=self.bolo, quantidade=1)
+        resposta = self.client.post(
+            f'/carrinhos/{self.carrinho.id}/itens/bulk/',
+            [
+                {'produto_id': self.bolo.id, 'quantidade': 2},
+                {'produto_id': self.cafe.id, 'quantidade': 1},
+                {'produto_id': self.cafe.id, 'quantidade': 1},
+            ],
+            format='json',
+        )
+        self.assertEqual(resposta.status_code, 200)
+        quantidades = {i['produto']['id']: i['quantidade'] for i in resposta.data['itens']}
+        self.assertEqual(quantidades, {self.bolo.id: 3, self.cafe.id: 2})
+        self.assertEqual(self.carrinho.itens.count(), 2)
+
+        resposta = self.client.post(
+            f'/carrinhos/{self.carrinho.id}/itens/bulk/', [{'produto_id': 999999, 'quantidade': 1}], format='json'
+        )
+        self.assertEqual(resposta.status_code, 400)
+
+    def test_adicionar_o_mesmo_produto_soma_quantidade(self):
+        for _ in range(2):
+            resposta = self.client.post(
+                '/itens-carrinho/', {'carrinho_id': self.carrinho.id, 'produto_id': self.bolo.id, 'quantidade': 2}
+            )
+            self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(resposta.data['quantidade'], 4)
+        self.assertEqual(self.carrinho.itens.get().quantidade, 4)
+
+
+def escritas(consultas):
+    return [c['sql'] for c in consultas.captured_queries if c['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+
+
+@override_settings(CARRINHOS_KV='carrinhos', CARRINHOS_KV_INTERVALO=0)
+class EstadoCarrinhosTests(APITestCase):
+    def setUp(self):
+        caches['carrinhos'].clear()
+        estado_carrinhos.persistir_pendentes()
+        self.cliente = criar_usuario()
+        self.client.force_authenticate(self.cliente)
+        loja = Loja.objects.create(empreendedor=criar_usuario(role='empreendedor'), nome='Loja')
+        self.bolo = Produto.objects.create(loja=loja, nome='Bolo', preco=Decimal('10.00'), estoque=5)
+        self.cafe = Produto.objects.create(loja=loja, nome='Café', preco=Decimal('4.00'), estoque=5)
+        self.carrinho = Carrinho.objects.create(cliente=self.cliente)
+        self.item = ItemCarrinho.objects.create(carrinho=self.carrinho, produto=self.bolo, quantidade=1)
+
+    def adicionar(self, produto, quantidade):
+        return self.client.post(
+            '/itens-carrinho/', {'carrinho_id': self.carrinho.id, 'produto_id': produto.id, 'quantidade': quantidade}
+        )
+
+    def test_alteracoes_ficam_no_armazenamento_ate_a_leitura(self):
+        resposta = self.adicionar(self.cafe, 1)
+        self.assertEqual(resposta.status_code, 201)
+        cafe_id = resposta.data['id']
+        # só o primeiro item de cada produto é inserido no banco (para ter id)
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self.adicionar(self.bolo, 2).data['quantidade'], 3)
+            self.assertEqual(self.adicionar(self.cafe, 2).data['quantidade'], 3)
+            resposta = self.client.patch(f'/itens-carrinho/{self.item.id}/', {'quantidade': 5})
+            self.assertEqual((resposta.data['quantidade'], resposta.data['subtotal']), (5, Decimal('50.00')))
+            self.assertEqual(self.client.delete(f'/itens-carrinho/{cafe_id}/').status_code, 204)
+        self.assertEqual(escritas(consultas), [])
+        self.assertEqual(self.client.patch(f'/itens-carrinho/{cafe_id}/', {'quantidade': 1}).status_code, 404)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantidade, 1)
+
+        resposta = self.client.get(f'/carrinhos/{self.carrinho.id}/')
+        self.assertEqual([(i['id'], i['quantidade']) for i in resposta.data['itens']], [(self.item.id, 5)])
+        self.assertEqual(resposta.data['total'], Decimal('50.00'))
+        self.assertFalse(ItemCarrinho.objects.filter(pk=cafe_id).exists())
+
+    def test_gravacao_em_lote_e_checkout(self):
+        outro = Carrinho.objects.create(cliente=self.cliente)
+        self.adicionar(self.bolo, 1)
+        resposta = self.client.post(
+            '/itens-carrinho/', {'carrinho_id': outro.id, 'produto_id': self.bolo.id, 'quantidade': 1}
+        )
+        self.client.patch(f"/itens-carrinho/{resposta.data['id']}/", {'quantidade': 4})
+        with CaptureQueriesContext(connection) as consultas:
+            estado_carrinhos.persistir_pendentes()
+        self.assertEqual(len(escritas(consultas)), 1)
+        self.assertEqual(sorted(ItemCarrinho.objects.values_list('quantidade', flat=True)), [2, 4])
+
+        # o checkout grava o pendente antes de baixar o estoque
+        self.adicionar(self.bolo, 1)
+        resposta = self.client.post(f'/carrinhos/{self.carrinho.id}/checkout/')
+        self.assertEqual(resposta.status_code, 200)
+        self.bolo.refresh_from_db()
+        self.assertEqual(self.bolo.estoque, 2)
+        self.assertIsNone(caches['carrinhos'].get(f'carrinho:{self.carrinho.id}'))
+        self.assertEqual(self.adicionar(self.bolo, 1).status_code, 400)
+
+    def test_escrita_externa_grava_o_pendente_e_descarta_o_registro(self):
+        self.adicionar(self.bolo, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            ItemCarrinho.objects.create(carrinho=self.carrinho, produto=self.cafe, quantidade=1)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantidade, 3)
+        self.assertIsNone(caches['carrinhos'].get(f'carrinho:{self.carrinho.id}'))
+        self.assertEqual(self.adicionar(self.cafe, 1).data['quantidade'], 2)
+
+    def test_pendentes_ficam_no_armazenamento(self):
+        # os pendentes são compartilhados: qualquer processo (aqui, a leitura
+        # de staff) grava o que outro alterou
+        kv = caches['carrinhos']
+        outro = estado_carrinhos._balde(self.carrinho.id + 1)
+        kv.set(outro, {self.carrinho.id + 1}, None)
+        with mock.patch.object(kv, 'set', wraps=kv.set) as gravar:
+            self.adicionar(self.bolo, 2)
+        # marcar o carrinho regrava só o balde dele
+        self.assertNotIn(outro, [chamada.args[0] for chamada in gravar.call_args_list])
+        self.assertEqual(kv.get(estado_carrinhos._balde(self.carrinho.id)), {self.carrinho.id})
+        self.assertEqual(estado_carrinhos._pendentes(kv), {self.carrinho.id, self.carrinho.id + 1})
+
+        self.client.force_authenticate(criar_usuario(role='admin', is_staff=True))
+        resposta = self.client.get(f'/carrinhos/{self.carrinho.id}/')
+        self.assertEqual([i['quantidade'] for i in resposta.data['itens']], [3])
+        self.assertEqual(estado_carrinhos._pendentes(kv), set())
+
+    @override_settings(CARRINHOS_KV_TRAVA_ESPERA=0.05)
+    def test_trava_com_prazo(self):
+        kv = caches['carrinhos']
+        trava = f'carrinho:{self.carrinho.id}:trava'
+        kv.add(trava, 'outro processo', 60)
+        self.assertEqual(self.adicionar(self.bolo, 1).status_code, 503)
+        kv.delete(trava)
+        self.assertEqual(self.adicionar(self.bolo, 1).status_code, 201)
+
+        # trava expirada e obtida por outro durante a operação: não é apagada
+        with self.assertLogs('wavewhiz_app.estado_carrinhos', 'ERROR'):
+            with estado_carrinhos._travados([self.carrinho.id]):
+                kv.set(trava, 'outro processo', 60)
+        self.assertEqual(kv.get(trava), 'outro processo')
+
+
+class ExportacaoEmStreamingTests(APITestCase):
+    def setUp(self):
+        self.admin = criar_usuario(role='admin', is_staff=True)
+        for _ in range(4):
+            criar_usuario()
+
+    def exportar(self, url, **extra):
+        resposta = self.client.get(url, **extra)
+        self.assertTrue(resposta.streaming)
+        return resposta, b''.join(resposta.streaming_content)
+
+    @mock.patch.object(UsuarioViewSet, 'bloco_exportacao', 2)
+    def test_lista_json_igual_a_renderizada_de_uma_vez(self):
+        self.client.force_authenticate(self.admin)
+        resposta, corpo = self.exportar('/usuarios/export/')
+        self.assertEqual(resposta['Content-Type'], 'application/json; charset=utf-8')
+        esperado = UsuarioSerializer(Usuario.objects.order_by('-pk'), many=True).data
+        self.assertEqual(corpo, JSONRenderer().render(esperado))
+
+        resposta, corpo = self.exportar('/usuarios/export/', HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(resposta['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertEqual([json.loads(linha)['id'] for linha in corpo.splitlines()], [u['id'] for u in esperado])
+
+        self.client.force_authenticate(criar_usuario())
+        self.assertEqual(self.client.get('/usuarios/export/').status_code, 403)
+
+    @mock.patch.object(CarrinhoViewSet, 'bloco_exportacao', 2)
+    def test_carrinhos_do_cliente_com_campos_numa_unica_consulta(self):
+        cliente = criar_usuario()
+        loja = Loja.objects.create(empreendedor=criar_usuario(role='empreendedor'), nome='Loja')
+        produto = Produto.objects.create(loja=loja, nome='Bolo', preco=Decimal('2.50'))
+        carrinhos = [Carrinho.objects.create(cliente=cliente) for _ in range(5)]
+        for carrinho in carrinhos:
+            ItemCarrinho.objects.create(carrinho=carrinho, produto=produto, quantidade=2)
+        Carrinho.objects.create(cliente=self.admin)
+        self.client.force_authenticate(cliente)
+        with CaptureQueriesContext(connection) as consultas:
+            _, corpo = self.exportar('/carrinhos/export/?format=ndjson&fields=id,total')
+        linhas = [json.loads(linha) for linha in corpo.splitlines()]
+        self.assertEqual(linhas, [{'id': c.id, 'total': 5.0} for c in reversed(carrinhos)])
+        # uma única consulta (total anotado no SQL), lida em blocos pelo iterator()
+        self.assertEqual(len(consultas), 1)
+
+
+class ImportacaoProdutosTests(APITestCase):
+    def setUp(self):
+        self.empreendedor = criar_usuario(role='empreendedor')
+        self.loja = Loja.objects.create(empreendedor=self.empreendedor, nome='Loja')
+        self.client.force_authenticate(self.empreendedor)
+
+    def test_importa_csv_com_erros_por_linha_e_exporta(self):
+        existente = Produto.objects.create(loja=self.loja, nome='Antigo', preco=Decimal('1.00'))
+        csv = (
+            'id,nome,preco,estoque,descricao\n'
+            ',Bolo de cenoura,12.50,3,Com cobertura\n'
+            ',Sem preço,,1,\n'
+            f'{existente.id},Renomeado,2.00,7,\n'
+            '999999,Outra loja,1.00,1,\n'
+        )
+        resposta = self.client.generic(
+            'POST', f'/lojas/{self.loja.id}/produtos/import/', csv.encode(), content_type='text/csv'
+        )
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual((resposta.data['criados'], resposta.data['atualizados']), (1, 1))
+        self.assertEqual([erro['linha'] for erro in resposta.data['erros']], [3, 5])
+        existente.refresh_from_db()
+        self.assertEqual((existente.nome, existente.estoque), ('Renomeado', 7))
+        self.loja.refresh_from_db()
+        self.assertEqual((self.loja.total_produtos, self.loja.preco_min, self.loja.preco_max), (2, Decimal('2.00'), Decimal('12.50')))
+
+        resposta = self.client.get(f'/lojas/{self.loja.id}/produtos/export/', {'formato': 'jsonl'})
+        linhas = b''.join(resposta.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(linha)['nome'] for linha in linhas], ['Renomeado', 'Bolo de cenoura'])
+        self.assertEqual(json.loads(linhas[1])['preco'], '12.50')
+
+    def test_somente_o_empreendedor_da_loja_importa(self):
+        self.client.force_authenticate(criar_usuario(role='empreendedor'))
+        resposta = self.client.generic(
+            'POST', f'/lojas/{self.loja.id}/produtos/import/', b'{"nome": "X", "preco": "1"}\n',
+            content_type='application/x-ndjson',
+        )
+        self.assertEqual(resposta.status_code, 403)
+
+
+@override_settings(CADASTRO_PROCESSOS=0)
+class CadastroEmLoteTests(APITestCase):
+    def setUp(self):
+        self.admin = criar_usuario(role='admin', is_staff=True)
+        self.client.force_authenticate(self.admin)
+
+    def dados(self, n, **extra):
+        dados = {
+            'nome': f'Lote {n}', 'email': f'lote{n}@ex.com', 'cpf': f'{70000000000 + n:011d}',
+            'telefone': '11999990000', 'data_nascimento': '01/02/1990', 'password': 'senha-do-lote',
+        }
+        dados.update(extra)
+        return dados
+
+    def test_cadastra_lista_json_com_erros_por_linha(self):
+        existente = criar_usuario()
+        usuarios = [
+            self.dados(1, cpf='700.000.000-01'),
+            {chave: valor for chave, valor in self.dados(2, role='empreendedor').items() if chave != 'password'},
+            self.dados(3, cpf=existente.cpf),
+            self.dados(4, email='lote1@ex.com'),
+            self.dados(5, cpf='123'),
+            self.dados(6, role='admin'),
+            'não é um objeto',
+        ]
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.post('/usuarios/bulk/', usuarios, format='json')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.data['criados'], 2)
+        self.assertEqual([erro['linha'] for erro in resposta.data['erros']], [3, 4, 5, 6, 7])
+        self.assertIn('email', resposta.data['erros'][1]['erros'])
+        # uma consulta por campo único e um INSERT para o lote inteiro
+        self.assertEqual(sum('INSERT' in consulta['sql'] for consulta in consultas.captured_queries), 1)
+
+        primeiro = Usuario.objects.get(email='lote1@ex.com')
+        self.assertEqual((primeiro.cpf, primeiro.role), ('70000000001', 'cliente'))
+        self.assertTrue(primeiro.check_password('senha-do-lote'))
+        self.assertFalse(Usuario.objects.get(email='lote2@ex.com').has_usable_password())
+
+    def test_somente_admins(self):
+        self.client.force_authenticate(criar_usuario())
+        resposta = self.client.post('/usuarios/bulk/', [self.dados(1)], format='json')
+        self.assertEqual(resposta.status_code, 403)
+
+    def test_csv_e_comando(self):
+        cabecalho = 'nome,email,cpf,telefone,data_nascimento,password,role\n'
+        linha = '{nome},{email},{cpf},{telefone},{data_nascimento},{password},cliente\n'
+        csv = cabecalho + linha.format(**self.dados(1)) + linha.format(**self.dados(1))
+        resposta = self.client.generic('POST', '/usuarios/bulk/', csv.encode(), content_type='text/csv')
+        self.assertEqual((resposta.data['criados'], [erro['linha'] for erro in resposta.data['erros']]), (1, [3]))
+
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as arquivo:
+            arquivo.write(json.dumps(self.dados(2)) + '\n{\n')
+        self.addCleanup(os.remove, arquivo.name)
+        saida, erros = io.StringIO(), io.StringIO()
+        call_command('cadastrar_usuarios', arquivo.name, processos=0, lote=1, stdout=saida, stderr=erros)
+        self.assertIn('1 criados, 1 com erro', saida.getvalue())
+        self.assertIn('linha 2', erros.getvalue())
+        self.assertTrue(Usuario.objects.filter(email='lote2@ex.com').exists())
+
+
+class JSONRapidoTests(APITestCase):
+    DADOS = {
+        'preco': Decimal('9.99'),
+        'nascimento': date(1990, 1, 1),
+        'criado': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+        'texto': 'Café \u2028 linha\u2029 "aspas" \\ 😀',
+        'numeros': [1, -2, 0.1, 1e16, 2.5e-7, 0.00001, Decimal('0.00005'), 10 ** 30, True, None],
+        1: 'chave numérica',
+    }
+
+    def renderizar(self, dados, **kwargs):
+        return JSONRapidoRenderer().render(dados, **kwargs), JSONRenderer().render(dados, **kwargs)
+
+    def test_mesma_saida_do_json_renderer(self):
+        # cada valor sozinho (os que o orjson recusa caem no json sem afetar os outros)
+        for chave, valor in self.DADOS.items():
+            with self.subTest(chave=chave):
+                rapido, padrao = self.renderizar({chave: valor, 'lista': [valor]})
+                self.assertEqual(rapido, padrao)
+        rapido, padrao = self.renderizar(self.DADOS)
+        self.assertEqual(rapido, padrao)
+        rapido, padrao = self.renderizar(self.DADOS, accepted_media_type='application/json; indent=2')
+        self.assertEqual(rapido, padrao)
+        self.assertEqual(JSONRapidoRenderer().render(None), b'')
+        # Decimal NaN: o mesmo erro do JSONRenderer (STRICT_JSON)
+        for renderer in (JSONRapidoRenderer(), JSONRenderer()):
+            with self.assertRaises(ValueError):
+                renderer.render({'preco': Decimal('NaN')})
+
+    def test_orjson_usado_quando_possivel(self):
+        if json_rapido.orjson is None:
+            self.skipTest('orjson não instalado')
+        with mock.patch.object(json_rapido, 'orjson', wraps=json_rapido.orjson) as orjson:
+            JSONRapidoRenderer().render({'preco': Decimal('1.50')})
+            JSONRapidoParser().parse(io.BytesIO(b'{"a": 1}'))
+        orjson.dumps.assert_called_once()
+        orjson.loads.assert_called_once()
+
+    def test_parser_igual_ao_json_parser(self):
+        corpos = [
+            b'{"a": 1, "b": [1.5, -2e3, null, true], "c": "Caf\\u00e9 \xc3\xa9", "a": 2}',
+            b'[12345678901234567890123, 0.1]',
+            '{"texto": "ação"}'.encode(),
+        ]
+        for corpo in corpos:
+            with self.subTest(corpo=corpo):
+                self.assertEqual(
+                    JSONRapidoParser().parse(io.BytesIO(corpo)), JSONParser().parse(io.BytesIO(corpo))
+                )
+        for invalido in (b'{"a": ', b'{"a": NaN}', b'\xff'):
+            with self.subTest(corpo=invalido), self.assertRaises(ParseError):
+                JSONRapidoParser().parse(io.BytesIO(invalido))
+
+    @override_settings(JSON_BACKEND='json')
+    def test_backend_json(self):
+        with mock.patch.object(json_rapido, 'orjson') as orjson:
+            self.assertEqual(*self.renderizar({'preco': Decimal('1.50')}))
+            self.assertEqual(JSONRapidoParser().parse(io.BytesIO(b'{"a": 1}')), {'a': 1})
+        orjson.dumps.assert_not_called()
+        orjson.loads.assert_not_called()
+
+    def test_api_usa_o_backend(self):
+        self.client.force_authenticate(criar_usuario(role='admin', is_staff=True))
+        resposta = self.client.post('/usuarios/bulk/', [{'nome': 'Sem e-mail'}], format='json')
+        self.assertEqual(resposta.data['erros'][0]['linha'], 1)
+        self.assertIsInstance(resposta.renderer_context['request'].parsers[0], JSONRapidoParser)
+        self.assertIsInstance(resposta.accepted_renderer, JSONRapidoRenderer)
+        self.assertEqual(resposta.content, JSONRenderer().render(resposta.data))
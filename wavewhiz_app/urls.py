@@ -8,6 +8,9 @@ from .views import (
     ItemCarrinhoViewSet,
     LojaViewSet,
     CategoriaLojaViewSet,
+    produtos_async,
+    lojas_async,
+    categorias_async,
 )
 router = DefaultRouter()
 router.register(r'usuarios', UsuarioViewSet)
@@ -20,4 +23,11 @@ router.register(r'categorias', CategoriaLojaViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    # leitura do catálogo com views assíncronas (ver views._listar_async)
+    path('async/produtos/', produtos_async, name='produtos-async'),
+    path('async/produtos/<int:pk>/', produtos_async, name='produtos-async-detalhe'),
+    path('async/lojas/', lojas_async, name='lojas-async'),
+    path('async/lojas/<int:pk>/', lojas_async, name='lojas-async-detalhe'),
+    path('async/categorias/', categorias_async, name='categorias-async'),
+    path('async/categorias/<int:pk>/', categorias_async, name='categorias-async-detalhe'),
 ]
@@ -1,5 +1,24 @@
-from rest_framework import viewsets
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_safe
+from django.views.static import serve
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.response import Response
+from rest_framework_simplejwt.views import TokenObtainPairView
 from .models import (
+    CarrinhoJaFinalizado,
+    CarrinhoVazio,
+    EstoqueInsuficiente,
     Usuario,
     Produto,
     MetodoPagamento,
@@ -16,14 +35,104 @@ from .serializers import (
     ItemCarrinhoSerializer
     , LojaSerializer,
     CategoriaLojaSerializer,
+    CustomTokenObtainPairSerializer,
+    ItemCarrinhoLoteSerializer,
+    preparar_queryset,
 )
 
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from . import cadastro_em_lote, estado_carrinhos, imagens, importacao, indice_categorias
+from .storage import PASTA as PASTA_BLOBS
+from .busca import backend as backend_busca
+from .cache_respostas import RespostaEmCacheMixin
+from .pagination import PaginacaoPorCursor
+from .renderers import JSONEmStreamingRenderer, JSONRapidoRenderer, NDJSONRenderer
+from .roteamento import em_replica
+
+
+class CamposDoSerializerMixin:
+    # o queryset carrega só as colunas e relações que o serializer vai gerar
+    # (com ?fields=/?expand=, ver CamposDinamicosMixin)
+    def get_queryset(self):
+        return preparar_queryset(super().get_queryset(), self.get_serializer())
+
+
+class ExportacaoEmStreamingMixin:
+    # GET /<recurso>/export/: a listagem inteira (mesmos filtros), sem paginação,
+    # serializada em blocos de queryset.iterator() e enviada aos pedaços: lista
+    # JSON ou, com Accept: application/x-ndjson (ou ?format=ndjson), um objeto
+    # por linha. A memória fica em um bloco, qualquer que seja o nº de linhas.
+    bloco_exportacao = 500
+
+    @action(
+        detail=False, methods=['get'], url_path='export', renderer_classes=[JSONEmStreamingRenderer, NDJSONRenderer]
+    )
+    def exportar(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        if not queryset.ordered:
+            queryset = queryset.order_by('-pk')
+        renderer = request.accepted_renderer
+        conteudo = renderer.render_lotes(self.lotes_exportados(queryset), request.accepted_media_type)
+        return StreamingHttpResponse(conteudo, content_type=f'{renderer.media_type}; charset=utf-8')
+
+    def lotes_exportados(self, queryset):
+        objetos = queryset.iterator(chunk_size=self.bloco_exportacao)
+        while lote := list(islice(objetos, self.bloco_exportacao)):
+            yield self.get_serializer(lote, many=True).data
+
+
+class CarrinhosGravadosMixin:
+    # com o estado dos carrinhos no armazenamento chave-valor (CARRINHOS_KV),
+    # as leituras gravam antes as alterações pendentes que podem aparecer nelas
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve', 'exportar') and estado_carrinhos.ativo():
+            estado_carrinhos.persistir_visiveis(self.request.user)
+        return super().get_queryset()
+
+
+class BuscaTextualMixin:
+    # /<recurso>/search/?q=: pks ranqueados pelo índice de busca entre os
+    # objetos que passam pelos filtros da própria listagem
+    limite_busca = 20
+    limite_busca_maximo = 100
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        texto = request.query_params.get('q', '').strip()
+        if not texto:
+            raise ValidationError({'q': 'Informe o termo de busca.'})
+        try:
+            limite = min(int(request.query_params.get('page_size', self.limite_busca)), self.limite_busca_maximo)
+        except ValueError:
+            raise ValidationError({'page_size': 'Informe um número inteiro.'})
+        queryset = self.get_queryset()
+        # os filtros da listagem entram na consulta ao índice; sem eles, o
+        # índice não precisa ler os pks da tabela
+        filtro = queryset if queryset.query.where else None
+        pks = backend_busca().buscar(queryset.model, texto, max(limite, 1), filtro)
+        objetos = queryset.in_bulk(pks)
+        resultados = [objetos[pk] for pk in pks if pk in objetos]
+        return Response({'results': self.get_serializer(resultados, many=True).data})
+
 
+class ImagemVariantesMixin:
+    # /<recurso>/<pk>/imagem/<variante>/: redireciona para a variante em
+    # disco; se ainda não existe, agenda a geração e redireciona para o original
+    @action(detail=True, methods=['get'], url_path=f"imagem/(?P<variante>{'|'.join(imagens.VARIANTES)})")
+    def imagem(self, request, pk=None, variante=None):
+        objeto = self.get_object()
+        if not objeto.imagem:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        url = imagens.url_derivado(objeto.imagem, variante) or objeto.imagem.url
+        return HttpResponseRedirect(request.build_absolute_uri(url))
 
-class ProdutoViewSet(viewsets.ModelViewSet):
+
+class ProdutoViewSet(RespostaEmCacheMixin, BuscaTextualMixin, ImagemVariantesMixin, CamposDoSerializerMixin, viewsets.ModelViewSet):
     queryset = Produto.objects.all()
     serializer_class = ProdutoSerializer
+    page_size = 50
+    cache_namespace = 'produtos'
+    cache_query_params = ('loja',)
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -33,15 +142,16 @@ class ProdutoViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class MetodoPagamentoViewSet(viewsets.ModelViewSet):
+class MetodoPagamentoViewSet(CamposDoSerializerMixin, viewsets.ModelViewSet):
     queryset = MetodoPagamento.objects.all()
     serializer_class = MetodoPagamentoSerializer
 
 
-class CarrinhoViewSet(viewsets.ModelViewSet):
+class CarrinhoViewSet(ExportacaoEmStreamingMixin, CarrinhosGravadosMixin, CamposDoSerializerMixin, viewsets.ModelViewSet):
     queryset = Carrinho.objects.all()
     serializer_class = CarrinhoSerializer
     permission_classes = [IsAuthenticated]  
+    page_size = 20
 
     def get_queryset(self):
         user = self.request.user
@@ -59,36 +169,116 @@ class CarrinhoViewSet(viewsets.ModelViewSet):
                 pass  # no filter
             else:
                 queryset = queryset.filter(cliente=user)
+        return self.filtrar_por_total(queryset)
+
+    def filtrar_por_total(self, queryset):
+        # filtros e ordenação por total resolvidos no SQL (anotação valor_total)
+        params = self.request.query_params
+        if 'valor_total' not in queryset.query.annotations and (
+            params.get('total_min') or params.get('total_max') or params.get('ordering') in ('total', '-total')
+        ):
+            queryset = queryset.com_totais()
+        for param, lookup in (('total_min', 'valor_total__gte'), ('total_max', 'valor_total__lte')):
+            valor = params.get(param)
+            if not valor:
+                continue
+            try:
+                valor = Decimal(valor)
+            except InvalidOperation:
+                valor = None
+            if valor is None or not valor.is_finite():
+                raise ValidationError({param: 'Informe um valor numérico.'})
+            queryset = queryset.filter(**{lookup: valor})
+        ordering = params.get('ordering')
+        if ordering == 'total':
+            queryset = queryset.order_by('valor_total', 'id')
+        elif ordering == '-total':
+            queryset = queryset.order_by('-valor_total', '-id')
         return queryset
 
     def perform_create(self, serializer):
-        serializer.save(cliente=self.request.user)  
+        # request.user é o snapshot parcial do cache (ver authentication.py):
+        # serializa o carrinho relido pelo queryset da view, que traz o
+        # cliente numa consulta, em vez de buscar campo a campo
+        carrinho = serializer.save(cliente=self.request.user)
+        serializer.instance = self.get_queryset().get(pk=carrinho.pk)
+
+    @action(detail=True, methods=['post'])
+    def checkout(self, request, pk=None):
+        carrinho = self.get_object()
+        try:
+            with estado_carrinhos.escrita_direta(carrinho.pk):
+                carrinho.finalizar()
+        except EstoqueInsuficiente as erro:
+            return Response({'detail': str(erro), 'produtos': erro.produtos}, status=status.HTTP_409_CONFLICT)
+        except CarrinhoJaFinalizado as erro:
+            return Response({'detail': str(erro)}, status=status.HTTP_409_CONFLICT)
+        except CarrinhoVazio as erro:
+            raise ValidationError({'detail': str(erro)})
+        return Response(self.get_serializer(self.get_object()).data)
+
+    @action(detail=True, methods=['post'], url_path='itens/bulk')
+    def itens_bulk(self, request, pk=None):
+        carrinho = self.get_object()
+        if carrinho.finalizado:
+            raise ValidationError({'detail': 'Carrinho já finalizado.'})
+        serializer = ItemCarrinhoLoteSerializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        quantidades = {}
+        for item in serializer.validated_data:
+            quantidades[item['produto_id']] = quantidades.get(item['produto_id'], 0) + item['quantidade']
+        # todos os produtos validados numa única consulta
+        existentes = set(Produto.objects.filter(pk__in=quantidades).values_list('pk', flat=True))
+        faltando = sorted(set(quantidades) - existentes)
+        if faltando:
+            raise ValidationError({'produto_id': [f'Produto {pk} não encontrado.' for pk in faltando]})
+        with estado_carrinhos.escrita_direta(carrinho.pk):
+            carrinho.adicionar_itens(quantidades)
+        return Response(self.get_serializer(self.get_object()).data)
 
 
-class ItemCarrinhoViewSet(viewsets.ModelViewSet):
+class ItemCarrinhoViewSet(CarrinhosGravadosMixin, CamposDoSerializerMixin, viewsets.ModelViewSet):
     queryset = ItemCarrinho.objects.all()
     serializer_class = ItemCarrinhoSerializer
     permission_classes = [IsAuthenticated]
+    page_size = 50
 
     def get_queryset(self):
         user = self.request.user
+        queryset = super().get_queryset()
         if user.is_staff:
-            return super().get_queryset()
+            return queryset
         # Non-staff see only items from their own carts
-        return super().get_queryset().filter(carrinho__cliente=user)
+        return queryset.filter(carrinho__cliente=user)
+
+    def get_object(self):
+        item = super().get_object()
+        if estado_carrinhos.ativo():
+            pendente, quantidade = estado_carrinhos.quantidade(item)
+            if pendente and quantidade is None:
+                raise NotFound
+            if pendente:
+                # o subtotal anotado no SQL usou a quantidade do banco
+                item.quantidade, item.subtotal_calculado = quantidade, None
+        return item
 
     def perform_create(self, serializer):
         serializer.save()
 
+    def perform_destroy(self, instance):
+        if not (estado_carrinhos.ativo() and estado_carrinhos.remover(instance)):
+            instance.delete()
 
-class UsuarioViewSet(viewsets.ModelViewSet):
+
+class UsuarioViewSet(ExportacaoEmStreamingMixin, CamposDoSerializerMixin, viewsets.ModelViewSet):
     queryset = Usuario.objects.all()
     serializer_class = UsuarioSerializer
+    page_size = 50
 
     def get_permissions(self):
         if self.action == 'create':  # Cadastro é público
             permission_classes = [AllowAny]
-        elif self.action in ['list', 'destroy']:  # Listagem e deleção só admins
+        elif self.action in ['list', 'destroy', 'cadastrar_em_lote', 'exportar']:  # Listagem, deleção, cadastro e exportação em lote só admins
             permission_classes = [IsAdminUser]
         else:  # Atualização ou retrieve exige login
             permission_classes = [IsAuthenticated]
@@ -96,10 +286,27 @@ class UsuarioViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        queryset = super().get_queryset()
         if user.is_staff: 
-            return Usuario.objects.all()
+            return queryset
         # usuários comuns só veem seu próprio perfil
-        return Usuario.objects.filter(id=user.id)
+        return queryset.filter(id=user.id)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def cadastrar_em_lote(self, request):
+        # lista JSON de usuários, ou CSV/JSON Lines lido linha a linha
+        formato = importacao.formato_do_content_type(request.content_type)
+        if formato:
+            linhas = (linha.decode('utf-8-sig') for linha in request.stream or ())
+            registros = importacao.ler_registros(linhas, formato)
+        elif isinstance(request.data, list):
+            registros = (
+                (numero, registro if isinstance(registro, dict) else None)
+                for numero, registro in enumerate(request.data, start=1)
+            )
+        else:
+            raise ValidationError({'detail': 'Envie uma lista de usuários em JSON, CSV ou JSON Lines.'})
+        return Response(cadastro_em_lote.cadastrar_usuarios(registros))
 
     def update(self, request, *args, **kwargs):
         # permitir que usuários atualizem apenas seu próprio perfil
@@ -116,33 +323,229 @@ class UsuarioViewSet(viewsets.ModelViewSet):
         return super().partial_update(request, *args, **kwargs)
 
 
-class LojaViewSet(viewsets.ModelViewSet):
+class LojaViewSet(RespostaEmCacheMixin, BuscaTextualMixin, ImagemVariantesMixin, CamposDoSerializerMixin, viewsets.ModelViewSet):
     queryset = Loja.objects.all()
     serializer_class = LojaSerializer
+    page_size = 20
+    cache_namespace = 'lojas'
+    cache_query_params = ('categoria', 'modo', 'empreendedor')
 
     def get_permissions(self):
         if self.action in ['create']:
             return [IsAuthenticated()]
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'search', 'imagem']:
             return [AllowAny()]
         return [IsAuthenticated()]
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        categoria_id = self.request.query_params.get('categoria')
+        filtro = filtro_de_categorias(self.request.query_params)
         empreendedor_id = self.request.query_params.get('empreendedor')
-        if categoria_id:
-            queryset = queryset.filter(categorias__id=categoria_id)
         if empreendedor_id:
             queryset = queryset.filter(empreendedor__id=empreendedor_id)
+        if filtro:
+            queryset = self.filtrar_por_categorias(queryset, *filtro, apenas_do_banco=bool(empreendedor_id))
         return queryset
 
+    def filtrar_por_categorias(self, queryset, categorias, modo, apenas_do_banco):
+        if self.action != 'list':
+            # busca e detalhe não seguem a ordem do índice: filtra no banco
+            if modo == 'all':
+                for categoria in categorias:
+                    queryset = queryset.filter(categorias__id=categoria)
+                return queryset
+            return queryset.filter(categorias__id__in=categorias).distinct()
+        # a página do cursor sai do índice; o banco só hidrata esses ids
+        cursor = self.paginator.decode_cursor(self.request)
+        try:
+            posicao = int(cursor.position) if cursor and cursor.position is not None else None
+        except ValueError:
+            raise NotFound('Cursor inválido.')
+        return lojas_por_categorias(
+            queryset, categorias, modo, posicao=posicao, decrescente=not (cursor and cursor.reverse),
+            folga=cursor.offset if cursor else 0, apenas_do_banco=apenas_do_banco,
+        )
+
     def perform_create(self, serializer):
         # atribui automaticamente o empreendedor como o usuário autenticado
         serializer.save(empreendedor=self.request.user)
 
+    def get_loja_do_empreendedor(self):
+        loja = self.get_object()
+        user = self.request.user
+        if not user.is_staff and loja.empreendedor_id != user.pk:
+            raise PermissionDenied('Apenas o empreendedor da loja pode gerenciar o catálogo.')
+        return loja
+
+    def get_formato(self, padrao=None):
+        formato = self.request.query_params.get('formato') or padrao
+        if formato not in importacao.FORMATOS:
+            raise ValidationError({'formato': f"Use um destes formatos: {', '.join(importacao.FORMATOS)}."})
+        return formato
+
+    @action(detail=True, methods=['post'], url_path='produtos/import')
+    def importar_produtos(self, request, pk=None):
+        loja = self.get_loja_do_empreendedor()
+        formato = self.get_formato(importacao.formato_do_content_type(request.content_type))
+        # lê o corpo da requisição linha a linha, sem carregá-lo inteiro
+        stream = request.stream or ()
+        linhas = (linha.decode('utf-8-sig') for linha in stream)
+        relatorio = importacao.importar_produtos(loja, importacao.ler_registros(linhas, formato))
+        return Response(relatorio)
+
+    @action(detail=True, methods=['get'], url_path='produtos/export')
+    def exportar_produtos(self, request, pk=None):
+        loja = self.get_loja_do_empreendedor()
+        formato = self.get_formato('csv')
+        content_type = 'text/csv' if formato == 'csv' else 'application/x-ndjson'
+        resposta = StreamingHttpResponse(importacao.exportar_produtos(loja, formato), content_type=f'{content_type}; charset=utf-8')
+        resposta['Content-Disposition'] = f'attachment; filename="loja-{loja.pk}-produtos.{formato}"'
+        return resposta
 
-class CategoriaLojaViewSet(viewsets.ReadOnlyModelViewSet):
+
+def filtro_de_categorias(params):
+    # ?categoria=1,3&modo=any|all -> (ids das categorias, modo), ou None sem ?categoria=
+    valor = params.get('categoria')
+    if not valor:
+        return None
+    try:
+        categorias = [int(categoria) for categoria in valor.split(',') if categoria.strip()]
+    except ValueError:
+        raise ValidationError({'categoria': 'Informe ids numéricos separados por vírgula.'})
+    modo = params.get('modo') or 'any'
+    if modo not in indice_categorias.MODOS:
+        raise ValidationError({'modo': f"Use um destes modos: {', '.join(indice_categorias.MODOS)}."})
+    return (categorias, modo) if categorias else None
+
+
+def lojas_por_categorias(queryset, categorias, modo, posicao=None, decrescente=True, folga=0, apenas_do_banco=False):
+    # restringe o queryset aos ids da página (a partir de posicao, na ordem -id)
+    # vindos do índice de categorias; apenas_do_banco: os demais filtros do
+    # queryset são aplicados aos ids do índice
+    apenas = set(queryset.values_list('pk', flat=True)) if apenas_do_banco else None
+    quantidade = folga + PaginacaoPorCursor.max_page_size + 1
+    ids = indice_categorias.lojas(categorias, modo, posicao, decrescente, quantidade, apenas)
+    return queryset.filter(pk__in=ids)
+
+
+class CategoriaLojaViewSet(CamposDoSerializerMixin, viewsets.ReadOnlyModelViewSet):
     queryset = CategoriaLoja.objects.all()
     serializer_class = CategoriaLojaSerializer
-    permission_classes = [AllowAny]
\ No newline at end of file
+    permission_classes = [AllowAny]
+    page_size = 100
+
+
+# Leitura do catálogo com o ORM assíncrono: sob ASGI a requisição não prende
+# uma thread enquanto espera o banco ou um cliente lento. Mesmo JSON das
+# rotas síncronas; a página seguinte vem de ?apos=<id> (keyset, ordem -id).
+def _json(dados, status=200):
+    return HttpResponse(JSONRapidoRenderer().render(dados), status=status, content_type='application/json')
+
+
+def _inteiro(request, nome, padrao=None):
+    valor = request.GET.get(nome)
+    if not valor:
+        return padrao
+    try:
+        return int(valor)
+    except ValueError:
+        raise ValidationError({nome: 'Informe um número inteiro.'})
+
+
+async def _listar_async(request, queryset, serializer_class, page_size):
+    # relações pré-carregadas (preparar_queryset): o serializer não pode consultar o banco aqui
+    queryset = preparar_queryset(queryset, serializer_class(context={'request': request}))
+    try:
+        limite = max(1, min(_inteiro(request, 'page_size', page_size), PaginacaoPorCursor.max_page_size))
+        apos = _inteiro(request, 'apos')
+    except ValidationError as erro:
+        return _json(erro.detail, status=400)
+    if apos is not None:
+        queryset = queryset.filter(pk__lt=apos)
+    objetos = [objeto async for objeto in queryset.order_by('-pk')[:limite + 1].aiterator(chunk_size=limite + 1)]
+    proxima = None
+    if len(objetos) > limite:
+        objetos = objetos[:limite]
+        parametros = request.GET.copy()
+        parametros['apos'] = objetos[-1].pk
+        proxima = request.build_absolute_uri(f'{request.path}?{parametros.urlencode()}')
+    dados = serializer_class(objetos, many=True, context={'request': request}).data
+    return _json({'next': proxima, 'results': dados})
+
+
+async def _detalhar_async(request, queryset, serializer_class, pk):
+    queryset = preparar_queryset(queryset, serializer_class(context={'request': request}))
+    objeto = await queryset.filter(pk=pk).afirst()
+    if objeto is None:
+        raise Http404
+    return _json(serializer_class(objeto, context={'request': request}).data)
+
+
+@em_replica
+@require_safe
+async def produtos_async(request, pk=None):
+    queryset = Produto.objects.all()
+    if pk is not None:
+        return await _detalhar_async(request, queryset, ProdutoSerializer, pk)
+    loja_id = request.GET.get('loja')
+    if loja_id:
+        queryset = queryset.filter(loja_id=loja_id)
+    return await _listar_async(request, queryset, ProdutoSerializer, ProdutoViewSet.page_size)
+
+
+@em_replica
+@require_safe
+async def lojas_async(request, pk=None):
+    queryset = Loja.objects.all()
+    if pk is not None:
+        return await _detalhar_async(request, queryset, LojaSerializer, pk)
+    try:
+        filtro = filtro_de_categorias(request.GET)
+        apos = _inteiro(request, 'apos')
+    except ValidationError as erro:
+        return _json(erro.detail, status=400)
+    empreendedor_id = request.GET.get('empreendedor')
+    if empreendedor_id:
+        queryset = queryset.filter(empreendedor__id=empreendedor_id)
+    if filtro:
+        # o índice pode precisar ser (re)construído a partir do banco
+        queryset = await sync_to_async(lojas_por_categorias)(
+            queryset, *filtro, posicao=apos, apenas_do_banco=bool(empreendedor_id)
+        )
+    return await _listar_async(request, queryset, LojaSerializer, LojaViewSet.page_size)
+
+
+@em_replica
+@require_safe
+async def categorias_async(request, pk=None):
+    queryset = CategoriaLoja.objects.all()
+    if pk is not None:
+        return await _detalhar_async(request, queryset, CategoriaLojaSerializer, pk)
+    return await _listar_async(request, queryset, CategoriaLojaSerializer, CategoriaLojaViewSet.page_size)
+
+
+_token_obtain_pair = TokenObtainPairView.as_view(serializer_class=CustomTokenObtainPairSerializer)
+_login_executor = ThreadPoolExecutor(max_workers=settings.LOGIN_THREADS, thread_name_prefix='login')
+
+
+def _obter_token(request):
+    try:
+        return _token_obtain_pair(request)
+    finally:
+        # a conexão pertence à thread do pool; respeita CONN_MAX_AGE como uma requisição normal
+        close_old_connections()
+
+
+@csrf_exempt
+async def obter_token(request):
+    # o hash da senha é CPU-bound e libera o GIL: roda em um pool próprio para
+    # não bloquear o event loop (ASGI) nem a thread única de views síncronas
+    return await sync_to_async(_obter_token, thread_sensitive=False, executor=_login_executor)(request)
+
+
+def servir_midia(request, path):
+    resposta = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if path.startswith((f'{PASTA_BLOBS}/', 'derivados/')):
+        # o nome muda quando o conteúdo muda
+        patch_cache_control(resposta, public=True, max_age=settings.MIDIA_CACHE_MAX_AGE, immutable=True)
+    return resposta